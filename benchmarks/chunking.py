@@ -0,0 +1,95 @@
+"""Compare the access times of the chunk layouts of nxptycho.chunking.
+
+Writes a synthetic frame stack chunked for every access profile and for
+h5py's chunk guess, then times reading single frames, batches of frames and
+pixel time series of each layout and prints a markdown table::
+
+    python benchmarks/chunking.py --frames 512 --size 256 --batch 16
+
+Every layout is read with the chunk cache its plan recommends, each profile
+should be fastest for its own access pattern.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from synthetic import synthetic_frames  # first, puts nxptycho on sys.path
+from nxptycho.chunking import plan_chunks
+from nxptycho.creator import NXCreator
+
+
+def access_patterns(shape, batch, count, seed=0):
+    """Random single frames, frame batches and pixels to read."""
+    rng = np.random.default_rng(seed)
+    frames = rng.integers(0, shape[0], count)
+    batches = rng.integers(0, max(shape[0] // batch, 1), count) * batch
+    pixels = rng.integers(0, shape[1:], (count, 2))
+    return dict(
+        frame=[np.s_[n] for n in frames],
+        batch=[np.s_[n:n + batch] for n in batches],
+        pixel=[np.s_[:, y, x] for y, x in pixels],
+    )
+
+
+def run(frames, size, batch=16, count=20, filters="gzip-4"):
+    """Return one result row per chunk layout."""
+    data = synthetic_frames(frames, size)
+    patterns = access_patterns(data.shape, batch, count)
+    layouts = {"frame": "frame", f"batch-{batch}": f"batch-{batch}",
+               "pixel": "pixel", "h5py guess": True}
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, auto_chunk in layouts.items():
+            path = os.path.join(tmp, "chunks.nxs")
+            with NXCreator(path) as creator:
+                entry = creator.create_entry_group()
+                tic = time.perf_counter()
+                ds = creator._create_dataset(entry, "data", data,
+                                             auto_chunk=auto_chunk,
+                                             filters=filters)
+                ds.file.flush()
+                write_time = time.perf_counter() - tic
+                chunks = ds.chunks
+            cache = {}
+            if isinstance(auto_chunk, str):
+                plan = plan_chunks(data.shape, data.dtype, auto_chunk)
+                cache = dict(rdcc_nbytes=plan.cache_nbytes,
+                             rdcc_nslots=plan.cache_slots)
+            row = dict(layout=name, chunks="x".join(map(str, chunks)),
+                       write_s=write_time)
+            for pattern, selections in patterns.items():
+                # reopen so every pattern starts with an empty chunk cache
+                with h5py.File(path, "r", **cache) as f:
+                    ds = f["entry/data"]
+                    tic = time.perf_counter()
+                    for selection in selections:
+                        ds[selection]
+                    row[pattern] = (time.perf_counter() - tic) / count * 1e3
+            rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=512)
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--count", type=int, default=20,
+                        help="reads timed per access pattern")
+    parser.add_argument("--filters", default="gzip-4")
+    options = parser.parse_args()
+
+    print("| layout | chunks | write s | frame ms | batch ms | pixel ms |")
+    print("|---|---|---:|---:|---:|---:|")
+    for row in run(options.frames, options.size, options.batch,
+                   options.count, options.filters):
+        print("| {layout} | {chunks} | {write_s:.2f} | {frame:.2f} | "
+              "{batch:.2f} | {pixel:.2f} |".format(**row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""Measure conversion throughput and peak memory on synthetic inputs.
+
+Generates cxi files and velociprobe-like master/data/csv sets of the
+requested sizes, converts them with NXCreator, the cxi converter and
+velociprobe2nexus and stores wall time per stage, MB/s, frames/s and peak
+RSS of every run as JSON. Every run is done in a fresh process, so the peak
+RSS belongs to that run alone::
+
+    python benchmarks/conversion.py --preset small -o results.json
+    python benchmarks/conversion.py --preset small --baseline results.json
+
+With ``--baseline`` the runs are compared to a previous result file and
+slowdowns or memory growth beyond ``--tolerance`` are reported.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from synthetic import synthetic_frames  # first, puts nxptycho on sys.path
+from nxptycho.converter.cxi import cxi2nexus
+from nxptycho.converter.velociprobe import velociprobe2nexus
+from nxptycho.creator import NXCreator
+
+TOOLS = ("creator", "cxi", "velociprobe")
+PRESETS = {
+    # (frames, detector size, entries)
+    "small": [(64, 128, 1), (64, 128, 4)],
+    "medium": [(512, 256, 1), (256, 256, 4), (1024, 128, 1)],
+    "large": [(2048, 512, 1), (1024, 512, 4), (8192, 256, 1)],
+}
+FRAMES_PER_DATA_FILE = 1000  # velociprobe default of the Eiger writer
+GENERATE_BLOCK = 64  # frames generated at once, keeps the inputs out of the peak RSS
+
+
+def write_frames(dataset, seed=0):
+    """Fill a dataset block by block with synthetic frames."""
+    frames, size = dataset.shape[0], dataset.shape[-1]
+    for first in range(0, frames, GENERATE_BLOCK):
+        count = min(GENERATE_BLOCK, frames - first)
+        dataset[first:first + count] = synthetic_frames(
+            count, size, dataset.dtype, seed=seed + first)
+
+
+def write_cxi(path, frames, size, entries=1):
+    """Write a cxi file with ``entries`` entries of synthetic frames."""
+    with h5py.File(path, "w") as f:
+        f["cxi_version"] = 150
+        for n in range(1, entries + 1):
+            instrument = f.create_group(f"entry_{n}/instrument_1")
+            instrument["name"] = "synthetic"
+            instrument["source_1/name"] = "synthetic"
+            instrument["source_1/energy"] = 1.2e-16  # J
+            detector = instrument.create_group("detector_1")
+            write_frames(
+                detector.create_dataset("data", (frames, size, size),
+                                        np.float32))
+            detector["distance"] = 0.12
+            detector["x_pixel_size"] = 30e-6
+            detector["y_pixel_size"] = 30e-6
+            detector["translation"] = np.random.rand(frames, 3) * 1e-6
+
+
+def write_velociprobe(folder, name, frames, size):
+    """Write a velociprobe master file, its data files and position file."""
+    with h5py.File(os.path.join(folder, f"{name}_master.h5"), "w") as master:
+        for i, first in enumerate(range(0, frames, FRAMES_PER_DATA_FILE)):
+            count = min(FRAMES_PER_DATA_FILE, frames - first)
+            data_name = f"{name}_data_{i + 1:06d}.h5"
+            with h5py.File(os.path.join(folder, data_name), "w") as f:
+                write_frames(f.create_dataset("entry/data/data",
+                                              (count, size, size), np.uint16,
+                                              chunks=(1, size, size)),
+                             seed=first)
+            master[f"entry/data/data_{i + 1:06d}"] = h5py.ExternalLink(
+                data_name, "entry/data/data")
+        master["entry/instrument/beam/incident_wavelength"] = 1e-10
+        detector = master.create_group("entry/instrument/detector")
+        for field, value in (("detector_distance", 2.0),
+                             ("x_pixel_size", 75e-6),
+                             ("y_pixel_size", 75e-6)):
+            detector[field] = value
+            detector[field].attrs["units"] = np.bytes_("m")
+        detector["detectorSpecific/nimages"] = frames
+        master["entry/sample/goniometer/chi"] = np.zeros(1)
+        master["entry/sample/goniometer/chi"].attrs["units"] = np.bytes_(
+            "degree")
+    np.savetxt(os.path.join(folder, f"{name}_pos.csv"),
+               np.random.rand(frames, 2) * 1e-6, delimiter=",")
+
+
+def _input_bytes(paths):
+    return sum(os.path.getsize(p) for p in paths)
+
+
+def _read_back(path):
+    """Read all frames of the output file, following links and VDS."""
+    with h5py.File(path, "r") as f:
+        for name in f:
+            data = f.get(f"{name}/instrument/detector/data")
+            if data is not None:
+                for i in range(0, data.shape[0], 64):
+                    data[i:i + 64]
+
+
+def run_case(tool, frames, size, entries):
+    """Run one benchmark case, called in a fresh process.
+
+    :return *dict*: wall time of the generate, convert and read stages,
+                    byte counts and the peak RSS of the process
+    """
+    logging.disable(logging.INFO)  # keep the progress logs out of the timing
+    stages = {}
+    with tempfile.TemporaryDirectory() as tmp, \
+            contextlib.redirect_stdout(io.StringIO()):
+        output = os.path.join(tmp, "output.nxs")
+
+        tic = time.perf_counter()
+        if tool == "creator":
+            data = synthetic_frames(frames, size)
+            inputs = []
+        elif tool == "cxi":
+            inputs = [os.path.join(tmp, "input.cxi")]
+            write_cxi(inputs[0], frames, size, entries)
+        else:
+            write_velociprobe(tmp, "scan", frames, size)
+            inputs = [
+                os.path.join(tmp, p) for p in os.listdir(tmp)
+                if p.startswith("scan")
+            ]
+        stages["generate"] = time.perf_counter() - tic
+        rss_generate = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        tic = time.perf_counter()
+        if tool == "creator":
+            with NXCreator(output) as creator:
+                for n in range(1, entries + 1):
+                    entry = creator.create_entry_group(entry_index=n)
+                    instrument = creator.create_instrument_group(
+                        h5parent=entry, name="synthetic")
+                    creator.create_detector_group(h5parent=instrument,
+                                                  data=data,
+                                                  data_units="counts",
+                                                  distance=0.12,
+                                                  distance_units="m",
+                                                  x_pixel_size=30e-6,
+                                                  y_pixel_size=30e-6,
+                                                  pixel_size_units="m")
+            data_bytes = data.nbytes * entries
+        elif tool == "cxi":
+            cxi2nexus(inputs[0], output)
+            data_bytes = frames * size * size * 4 * entries
+        else:
+            velociprobe2nexus(os.path.join(tmp, "scan_master.h5"),
+                              os.path.join(tmp, "scan_pos.csv"), output)
+            data_bytes = frames * size * size * 2
+        stages["convert"] = time.perf_counter() - tic
+
+        tic = time.perf_counter()
+        _read_back(output)
+        stages["read"] = time.perf_counter() - tic
+
+        output_bytes = os.path.getsize(output)
+        input_bytes = _input_bytes(inputs)
+
+    convert = stages["convert"]
+    return dict(
+        tool=tool,
+        frames=frames,
+        size=size,
+        entries=entries,
+        input_bytes=input_bytes,
+        output_bytes=output_bytes,
+        data_bytes=data_bytes,
+        stages=stages,
+        mb_s=data_bytes / 2**20 / convert,
+        frames_s=frames * entries / convert,
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss /
+        (2**20 if sys.platform == "darwin" else 2**10),
+        generate_rss_mb=rss_generate /
+        (2**20 if sys.platform == "darwin" else 2**10),
+    )
+
+
+def run(cases, tools=TOOLS, repeat=1):
+    """Run every tool on every case, each run in its own process.
+
+    The fastest of ``repeat`` runs is kept.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for frames, size, entries in cases:
+        for tool in tools:
+            if tool == "velociprobe" and entries > 1:
+                continue  # a velociprobe scan has a single entry
+            best = None
+            for _ in range(repeat):
+                with concurrent.futures.ProcessPoolExecutor(
+                        1, mp_context=context) as pool:
+                    result = pool.submit(run_case, tool, frames, size,
+                                         entries).result()
+                if best is None or (result["stages"]["convert"] <
+                                    best["stages"]["convert"]):
+                    best = result
+            results.append(best)
+    return results
+
+
+def case_key(result):
+    return (result["tool"], result["frames"], result["size"],
+            result["entries"])
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Return the runs that are slower or use more memory than the baseline.
+
+    :param tolerance: allowed relative change
+    :return *list*: (key, quantity, baseline value, new value)
+    """
+    previous = {case_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None:
+            continue
+        if result["mb_s"] < old["mb_s"] * (1 - tolerance):
+            regressions.append(
+                (case_key(result), "mb_s", old["mb_s"], result["mb_s"]))
+        if result["peak_rss_mb"] > old["peak_rss_mb"] * (1 + tolerance):
+            regressions.append((case_key(result), "peak_rss_mb",
+                                old["peak_rss_mb"], result["peak_rss_mb"]))
+    return regressions
+
+
+def environment():
+    """Versions and machine the results were measured with."""
+    return dict(
+        date=datetime.datetime.now().isoformat(timespec="seconds"),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpu_count=os.cpu_count(),
+        numpy=np.__version__,
+        h5py=h5py.__version__,
+        hdf5=h5py.version.hdf5_version,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--preset", choices=PRESETS, default="small")
+    parser.add_argument("--frames", type=int,
+                        help="run a single case instead of the preset")
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--entries", type=int, default=1)
+    parser.add_argument("--tools", nargs="+", choices=TOOLS, default=TOOLS)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("-o", "--output", help="JSON file of the results")
+    parser.add_argument("--baseline", help="JSON file of a previous run")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    options = parser.parse_args()
+
+    if options.frames:
+        cases = [(options.frames, options.size, options.entries)]
+    else:
+        cases = PRESETS[options.preset]
+    results = run(cases, options.tools, options.repeat)
+
+    print("| tool | frames | size | entries | generate s | convert s | "
+          "read s | MB/s | frames/s | peak RSS MB |")
+    print("|---|---:|---:|---:|---:|---:|---:|---:|---:|---:|")
+    for r in results:
+        print("| {tool} | {frames} | {size} | {entries} | {generate:.2f} | "
+              "{convert:.2f} | {read:.2f} | {mb_s:.0f} | {frames_s:.0f} | "
+              "{peak_rss_mb:.0f} |".format(**r, **r["stages"]))
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(dict(environment=environment(), results=results), f,
+                      indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, options.tolerance)
+        for key, quantity, old, new in regressions:
+            print(f"REGRESSION {key}: {quantity} {old:.1f} -> {new:.1f}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
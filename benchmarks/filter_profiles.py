@@ -0,0 +1,73 @@
+"""Compare compression ratio and throughput of the NXCreator filter profiles.
+
+Writes a synthetic stack of low-count diffraction frames with every filter
+profile available in this environment and prints a markdown table::
+
+    python benchmarks/filter_profiles.py --frames 256 --size 256
+
+``--workers N`` compresses the chunks in N threads where the profile has a
+chunk encoder (gzip, zstd), see :meth:`NXCreator._write_chunks`.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from synthetic import synthetic_frames  # first, puts nxptycho on sys.path
+from nxptycho.creator import NXCreator
+from nxptycho.filters import available_profiles
+
+
+def run(frames, size, repeat=3, workers=1):
+    """Return one result row per available filter profile."""
+    data = synthetic_frames(frames, size)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in available_profiles():
+            path = os.path.join(tmp, f"{profile}.nxs")
+            write_time = np.inf
+            for _ in range(repeat):
+                with NXCreator(path, compression_workers=workers) as creator:
+                    entry = creator.create_entry_group()
+                    tic = time.perf_counter()
+                    ds = creator._create_dataset(entry, "data", data,
+                                                 filters=profile)
+                    ds.file.flush()
+                    write_time = min(write_time, time.perf_counter() - tic)
+                    stored = ds.id.get_storage_size()
+            read_time = np.inf
+            with h5py.File(path, "r") as f:
+                for _ in range(repeat):
+                    tic = time.perf_counter()
+                    f["entry/data"][()]
+                    read_time = min(read_time, time.perf_counter() - tic)
+            rows.append(
+                dict(profile=profile,
+                     ratio=data.nbytes / stored,
+                     write_mb_s=data.nbytes / 2**20 / write_time,
+                     read_mb_s=data.nbytes / 2**20 / read_time))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=256)
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="threads compressing the chunks")
+    options = parser.parse_args()
+
+    print("| profile | ratio | write MB/s | read MB/s |")
+    print("|---|---:|---:|---:|")
+    for row in run(options.frames, options.size, options.repeat,
+                   options.workers):
+        print("| {profile} | {ratio:.1f} | {write_mb_s:.0f} | "
+              "{read_mb_s:.0f} |".format(**row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Check the start-up time of the package and its command line tools.
+
+Runs every command in a fresh interpreter, keeps the fastest of
+``--repeat`` runs and compares the time above a bare interpreter start
+(``python -c pass``) with its budget. Exits with an error if a budget is
+exceeded or a lazily imported module was imported::
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --scale 2  # slow machine
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name: (arguments of the python interpreter, budget in seconds)
+COMMANDS = {
+    "import nxptycho": (["-c", "import nxptycho"], 0.05),
+    "import nxptycho.creator": (["-c", "import nxptycho.creator"], 0.3),
+    "import nxptycho.converter": (["-c", "import nxptycho.converter"], 0.05),
+    "toNXconverter.py --version": (["toNXconverter.py", "--version"], 0.35),
+    "toNXconverter.py --help": (["toNXconverter.py", "--help"], 0.35),
+    "cxi --help": (["-m", "nxptycho.converter.cxi", "--help"], 0.35),
+    "velociprobe --help": (["-m", "nxptycho.converter.velociprobe", "--help"],
+                           0.35),
+    "batch --help": (["-m", "nxptycho.converter.batch", "--help"], 0.35),
+}
+
+# modules that must only be imported on first use
+LAZY_MODULES = ("pint", "dask", "hdf5plugin")
+
+
+def startup_time(args, repeat):
+    """Fastest wall time of ``python *args`` in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - tic)
+    return best
+
+
+def eagerly_imported(statement):
+    """Return the lazy modules imported by ``statement``."""
+    code = (f"import sys; {statement}; "
+            f"print(' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT,
+                            check=True, capture_output=True, text=True)
+    return output.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="factor applied to all budgets")
+    options = parser.parse_args()
+
+    interpreter = startup_time(["-c", "pass"], options.repeat)
+    print(f"python -c pass: {interpreter:.3f} s")
+    print("| command | s above interpreter | budget s |")
+    print("|---|---:|---:|")
+    failed = False
+    for name, (args, budget) in COMMANDS.items():
+        overhead = startup_time(args, options.repeat) - interpreter
+        budget *= options.scale
+        over = overhead > budget
+        failed |= over
+        print(f"| {name} | {overhead:.3f} | {budget:.2f}"
+              f"{' OVER BUDGET' if over else ''} |")
+
+    for statement in ("import nxptycho.creator", "import nxptycho.loader",
+                      "import nxptycho.converter.batch"):
+        modules = eagerly_imported(statement)
+        if modules:
+            failed = True
+            print(f"{statement} imports {', '.join(modules)}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""Synthetic detector data shared by the benchmarks.
+
+Importing this module also puts the repository root on ``sys.path``, so the
+benchmarks run from a checkout without installing nxptycho.
+"""
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def synthetic_frames(frames, size, dtype=np.uint16, seed=0):
+    """Poisson frames with a bright central beam falling off to zero counts."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[:size, :size] - size / 2
+    intensity = 1e4 * np.exp(-(x**2 + y**2) / (2 * (size / 16)**2)) + 0.05
+    return rng.poisson(intensity, (frames, size, size)).astype(dtype)
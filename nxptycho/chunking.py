@@ -0,0 +1,137 @@
+"""Chunk shapes planned for the way a frame stack will be read.
+
+Reconstruction codes read whole frames, batch oriented codes read ``K``
+frames at once and analyses read the time series of single pixels. A chunk
+shape that suits one of these patterns makes the others read and decompress
+far more data than they use. :func:`plan_chunks` picks the chunk shape and
+the HDF5 chunk cache settings for an access profile:
+
+* ``frame``: one frame per chunk, several small frames or rows of a large
+  frame
+* ``batch-K``: ``K`` frames per chunk, tiled if they exceed MAX_CHUNK_BYTES
+* ``pixel``: as many frames as fit the memory budget (the copy writes whole
+  chunks) times a square tile of pixels
+
+``python benchmarks/chunking.py`` compares the access times of the profiles.
+"""
+import collections
+import math
+
+import numpy as np
+
+ACCESS_PROFILES = ("frame", "batch", "pixel")
+DEFAULT_BATCH = 16
+MIN_CHUNK_BYTES = 64 * 2**10  # smaller chunks cost more in overhead than data
+TARGET_CHUNK_BYTES = 2**20
+MAX_CHUNK_BYTES = 4 * 2**20
+DEFAULT_MEMORY_BUDGET = 256 * 2**20
+
+ChunkPlan = collections.namedtuple(
+    "ChunkPlan", ["profile", "chunks", "cache_nbytes", "cache_slots"])
+"""Planned chunk shape and the chunk cache bytes and hash slots that hold
+the chunks of one chunk row of frames, see :func:`plan_chunks`."""
+
+
+def add_chunk_profile_argument(parser):
+    """Add the ``--chunk-profile`` option to an argparse parser."""
+    parser.add_argument(
+        "--chunk-profile",
+        metavar="PROFILE",
+        help="chunk the copied frames for reading whole frames (frame), "
+             "K frames at once (batch-K) or pixel time series (pixel)",
+    )
+
+
+def parse_profile(profile):
+    """Split an access profile into its kind and batch size.
+
+    :return *tuple*: kind and number of frames per batch (1 unless batch)
+    :raises ValueError: if the profile is unknown
+    """
+    kind, _, frames = str(profile).partition("-")
+    if kind not in ACCESS_PROFILES or (frames and kind != "batch"):
+        raise ValueError(f"Unknown access profile '{profile}', choose frame, "
+                         "batch-K or pixel")
+    if kind != "batch":
+        return kind, 1
+    try:
+        frames = int(frames) if frames else DEFAULT_BATCH
+    except ValueError:
+        raise ValueError(f"Batch size of '{profile}' is not a number") from None
+    if frames < 1:
+        raise ValueError(f"Batch size of '{profile}' must be positive")
+    return kind, frames
+
+
+def _tile(shape, itemsize, frames, max_bytes):
+    """Rows and columns of a frame tile so that frames x tile fit max_bytes.
+
+    :param itemsize: bytes of a pixel, including the axes kept whole
+    """
+    ny, nx = shape[-2:] if len(shape) > 2 else (1, shape[-1])
+    pixels = max(1, max_bytes // (frames * itemsize))
+    if pixels >= ny * nx:
+        return ny, nx
+    if pixels >= nx:
+        return pixels // nx, nx
+    return 1, pixels
+
+
+def _next_prime(n):
+    n = max(n, 2)
+    while any(n % d == 0 for d in range(2, math.isqrt(n) + 1)):
+        n += 1
+    return n
+
+
+def plan_chunks(shape, dtype, profile="frame",
+                memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Plan the chunk shape of a frame stack for an access profile.
+
+    :param shape: dataset shape, ``(frames, ..., ny, nx)``, the axes between
+                  frames and pixels are not split
+    :param dtype: dataset dtype
+    :param profile: ``frame``, ``batch-K`` or ``pixel``
+    :param memory_budget: bytes of frames held by the copy, bounds the frames
+                          per chunk of the pixel profile
+    :return *ChunkPlan*:
+    """
+    kind, batch = parse_profile(profile)
+    shape = tuple(int(n) for n in shape)
+    itemsize = np.dtype(dtype).itemsize
+    nframes = max(shape[0], 1)
+    frame_nbytes = itemsize * int(np.prod(shape[1:], dtype=np.int64))
+    if kind == "frame":
+        frames = max(1, MIN_CHUNK_BYTES // max(frame_nbytes, 1))
+        max_bytes = MAX_CHUNK_BYTES
+    elif kind == "batch":
+        frames = batch
+        max_bytes = MAX_CHUNK_BYTES
+    else:
+        frames = max(1, memory_budget // max(frame_nbytes, 1))
+        max_bytes = TARGET_CHUNK_BYTES
+    frames = min(frames, nframes)
+    # the last two axes are the pixels of a frame, axes in between are whole
+    whole = shape[1:-2]
+    whole_itemsize = itemsize * int(np.prod(whole, dtype=np.int64))
+    if len(shape) == 1:
+        chunks = (min(nframes, max(frames, MAX_CHUNK_BYTES // itemsize)), )
+    else:
+        if kind == "pixel":
+            pixels = max(1, max_bytes // (frames * whole_itemsize))
+            ny, nx = shape[-2:] if len(shape) > 2 else (1, shape[-1])
+            rows = min(ny, max(1, math.isqrt(pixels)))
+            cols = min(nx, max(1, pixels // rows))
+        else:
+            rows, cols = _tile(shape, whole_itemsize, frames, max_bytes)
+        tile = (rows, cols) if len(shape) > 2 else (cols, )
+        chunks = (frames, *whole, *tile)
+    chunk_nbytes = itemsize * int(np.prod(chunks, dtype=np.int64))
+    row_chunks = int(np.prod([-(-n // c) for n, c in
+                              zip(shape[1:], chunks[1:])], dtype=np.int64))
+    cache_nbytes = min(max(row_chunks * chunk_nbytes, 2**20), memory_budget)
+    return ChunkPlan(profile=kind if kind != "batch" else f"batch-{batch}",
+                     chunks=chunks,
+                     cache_nbytes=cache_nbytes,
+                     cache_slots=_next_prime(100 * max(
+                         1, cache_nbytes // max(chunk_nbytes, 1))))
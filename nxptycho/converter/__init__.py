@@ -1,2 +1,34 @@
-from .cxi import *
-from .velociprobe import *
+"""Converters of beamline file formats to NXptycho.
+
+The converter modules are imported on first access of their functions, so
+that e.g. a velociprobe conversion never imports the cxi converter and
+command line tools start quickly.
+"""
+import importlib
+
+_EXPORTS = {
+    "cxi2nexus": "cxi",
+    "write_entry": "cxi",
+    "velociprobe2nexus": "velociprobe",
+    "update_velociprobe": "velociprobe",
+    "follow_velociprobe": "velociprobe",
+    "load_positions": "velociprobe",
+    "velociprobe_position_path": "velociprobe",
+    "convert_entries": "parallel",
+    "convert_batch": "batch",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(f".{_EXPORTS[name]}", __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,280 @@
+"""Convert whole directories of ptychography files in a worker pool.
+
+Collects cxi files and velociprobe ``<scan>_master.h5`` / ``<scan>_pos.csv``
+pairs from directories or glob patterns, identified by their content (see
+``nxptycho.loader.identify``) rather than their names, converts them in a process pool and
+records timings, byte counts and failures in ``manifest.json`` and
+``manifest.csv`` in the output directory. Inputs whose size, modification
+time and fingerprint match a successful record of the previous manifest are
+skipped.
+
+USAGE::
+
+    python -m nxptycho.converter.batch /data/beamtime "/data/other/*.cxi" \
+        /data/nexus --jobs 16
+"""
+import concurrent.futures
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+from ..creator import NX_EXTENSION
+from ..loader import identify
+from ..filters import add_filter_arguments, filters_from_options
+from .cxi import cxi2nexus
+from .velociprobe import (VELOCIPROBE_POSITION_SUFFIX, velociprobe2nexus,
+                          velociprobe_position_path)
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest"
+MANIFEST_FIELDS = ("status", "kind", "inputs", "output", "input_bytes",
+                   "output_bytes", "seconds", "fingerprints", "error")
+FINGERPRINT_BLOCK = 2**20  # bytes hashed at the start and end of each file
+
+
+def get_user_parameters():
+    """configure user's command line parameters from sys.argv"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog=sys.argv[0], description="NXptycho batch converter"
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="logging verbosity",
+    )
+
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        help="input directories or glob patterns",
+    )
+
+    parser.add_argument(
+        "output_dir",
+        help="directory of the NeXus files and the manifest",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of files converted in parallel",
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="convert all inputs, even if unchanged since the last manifest",
+    )
+
+    add_filter_arguments(parser)
+
+    return parser.parse_args()
+
+
+def file_fingerprint(path):
+    """Return the size, mtime and a sha256 of the first and last block.
+
+    Hashing only the ends of the file keeps reruns over multi-TB beamtimes
+    cheap while still catching rewritten files with unchanged size.
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_BLOCK))
+        if stat.st_size > 2 * FINGERPRINT_BLOCK:
+            f.seek(-FINGERPRINT_BLOCK, os.SEEK_END)
+        digest.update(f.read(FINGERPRINT_BLOCK))
+    return dict(size=stat.st_size, mtime=stat.st_mtime,
+                sha256=digest.hexdigest())
+
+
+def find_jobs(patterns, output_dir):
+    """Collect conversion jobs from directories and glob patterns.
+
+    :return *list*: dicts with kind, inputs and output of each job
+    :raises ValueError: if several inputs would be written to the same output
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        paths.update(os.path.abspath(p) for p in glob.glob(pattern))
+
+    jobs = []
+    for path in sorted(paths):
+        if not os.path.isfile(path):
+            continue
+        stem = os.path.splitext(os.path.basename(path))[0]
+        kind = identify(path)
+        if kind == "cxi":
+            jobs.append(dict(kind="cxi", inputs=[path], stem=stem))
+        elif kind == "velociprobe":
+            position_path = velociprobe_position_path(path)
+            stem = os.path.basename(position_path)[
+                :-len(VELOCIPROBE_POSITION_SUFFIX)]
+            if not os.path.exists(position_path):
+                logger.warning("No position file %s for %s, skipped",
+                               position_path, path)
+                continue
+            jobs.append(
+                dict(kind="velociprobe", inputs=[path, position_path],
+                     stem=stem))
+    outputs = {}
+    for job in jobs:
+        job["output"] = os.path.join(output_dir,
+                                     job.pop("stem") + NX_EXTENSION)
+        outputs.setdefault(job["output"], []).append(job["inputs"][0])
+    duplicates = {output: inputs for output, inputs in outputs.items()
+                  if len(inputs) > 1}
+    if duplicates:
+        raise ValueError(
+            "Inputs with the same output name: " + "; ".join(
+                f"{', '.join(inputs)} -> {output}"
+                for output, inputs in sorted(duplicates.items())))
+    return jobs
+
+
+def convert_job(job, creator_options=None):
+    """Convert a single job and return its manifest record.
+
+    :param creator_options: keyword arguments of cxi2nexus and
+                            velociprobe2nexus, e.g. filters or narrow_dtype
+    """
+    creator_options = creator_options or {}
+    record = dict(job, status="ok", error=None, fingerprints=[])
+    tic = time.perf_counter()
+    try:
+        record["fingerprints"] = [file_fingerprint(p) for p in job["inputs"]]
+        if job["kind"] == "cxi":
+            cxi2nexus(job["inputs"][0], job["output"], **creator_options)
+        else:
+            velociprobe2nexus(*job["inputs"], job["output"],
+                              **creator_options)
+        record["output_bytes"] = os.path.getsize(job["output"])
+    except Exception as err:
+        logger.exception("Conversion of %s failed", job["inputs"][0])
+        record.update(status="failed", error=repr(err), output_bytes=0)
+    record["seconds"] = time.perf_counter() - tic
+    record["input_bytes"] = sum(
+        f["size"] for f in record["fingerprints"])
+    return record
+
+
+def load_manifest(output_dir):
+    """Return the records of the previous manifest keyed by first input."""
+    path = os.path.join(output_dir, MANIFEST_NAME + ".json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {record["inputs"][0]: record for record in json.load(f)}
+
+
+def is_unchanged(job, previous):
+    """Return ``True`` if the job was converted before from identical inputs."""
+    if (previous is None or previous["status"] != "ok"
+            or previous["inputs"] != job["inputs"]
+            or not os.path.exists(job["output"])):
+        return False
+    fingerprints = previous.get("fingerprints", [])
+    if len(fingerprints) != len(job["inputs"]):
+        return False
+    for path, old in zip(job["inputs"], fingerprints):
+        stat = os.stat(path)
+        if stat.st_size != old["size"] or stat.st_mtime != old["mtime"]:
+            return False
+    return all(
+        file_fingerprint(path) == old
+        for path, old in zip(job["inputs"], fingerprints))
+
+
+def write_manifest(output_dir, records):
+    """Write the records as manifest.json and manifest.csv."""
+    with open(os.path.join(output_dir, MANIFEST_NAME + ".json"), "w") as f:
+        json.dump(records, f, indent=2)
+    with open(os.path.join(output_dir, MANIFEST_NAME + ".csv"), "w",
+              newline="") as f:
+        writer = csv.DictWriter(f, MANIFEST_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for record in records:
+            writer.writerow(
+                dict(record,
+                     inputs=";".join(record["inputs"]),
+                     fingerprints=";".join(
+                         fp["sha256"]
+                         for fp in record.get("fingerprints", []))))
+
+
+def convert_batch(patterns, output_dir, jobs=None, filters=None, force=False,
+                  creator_options=None):
+    """Convert all inputs found by ``patterns`` into ``output_dir``.
+
+    :param patterns: input directories or glob patterns
+    :param output_dir: directory of the NeXus files and the manifest
+    :param jobs: number of worker processes, defaults to the CPU count
+    :param filters: filter profiles passed to NXCreator
+    :param force: convert inputs even if unchanged since the last manifest
+    :param creator_options: further keyword arguments of cxi2nexus and
+                            velociprobe2nexus, e.g. narrow_dtype or
+                            chunk_profile
+    :return *list*: manifest records, skipped inputs keep their old record
+    """
+    creator_options = dict(creator_options or {}, filters=filters)
+    os.makedirs(output_dir, exist_ok=True)
+    previous = {} if force else load_manifest(output_dir)
+    records = []
+    pending = []
+    for job in find_jobs(patterns, output_dir):
+        old = previous.get(job["inputs"][0])
+        if is_unchanged(job, old):
+            logger.info("Unchanged, skipped: %s", job["inputs"][0])
+            records.append(dict(old, status="ok"))
+        else:
+            pending.append(job)
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(convert_job, job, creator_options) for job in pending]
+        for future in concurrent.futures.as_completed(futures):
+            record = future.result()
+            logger.info("%s: %s in %.1f s", record["status"],
+                        record["output"], record["seconds"])
+            records.append(record)
+
+    records.sort(key=lambda record: record["inputs"][0])
+    write_manifest(output_dir, records)
+    failed = sum(record["status"] != "ok" for record in records)
+    logger.info("%d converted, %d skipped, %d failed", len(pending) - failed,
+                len(records) - len(pending), failed)
+    return records
+
+
+def main():
+    options = get_user_parameters()
+
+    choices = "WARNING INFO DEBUG".split()
+    logLevel = min(max(0, options.verbose), len(choices) - 1)
+    logging.basicConfig(level=choices[logLevel])
+
+    records = convert_batch(options.inputs,
+                            options.output_dir,
+                            jobs=options.jobs,
+                            filters=filters_from_options(options),
+                            force=options.force)
+    if any(record["status"] != "ok" for record in records):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,53 @@
 import logging
 import sys
 import numpy as np
-import h5py
-from ..creator import NXCreator
+from ..chunking import add_chunk_profile_argument
+from ..filters import (add_compression_workers_argument,
+                       add_filter_arguments, filters_from_options)
+from ..loader import CXILoader
+from ..narrowing import add_narrow_dtype_argument
+from ..preprocess import add_preprocess_arguments, preprocess_from_options
+from ..sparse import add_sparse_argument
+from ..statistics import add_frame_statistics_argument
+from ..profiling import ProfileReport, add_profile_argument
+from ..transformations import add_transformations_argument, compile_plan
+from .parallel import add_jobs_argument, convert_entries
+
+# Axes of the cxi detector and sample, see nxptycho.transformations
+CXI_TRANSFORMATIONS = dict(
+    detector=[
+        dict(name='x_translation', type='translation', vector=[1, 0, 0]),
+        dict(name='y_translation', type='translation', vector=[0, 1, 0],
+             depends_on='x_translation'),
+        dict(name='z_translation', type='translation', vector=[0, 0, 1],
+             depends_on='y_translation'),
+    ],
+    sample=[
+        dict(name='x_coarse_translation', type='translation', vector=[1, 0, 0]),
+        dict(name='x_fine_translation', type='translation', vector=[1, 0, 0],
+             positioner='horizontal', units='m'),
+        dict(name='y_coarse_translation', type='translation', vector=[0, 1, 0]),
+        dict(name='y_fine_translation', type='translation', vector=[0, 1, 0],
+             positioner='vertical', units='m'),
+        dict(name='z_coarse_translation', type='translation', vector=[0, 0, 1]),
+        dict(name='alpha_rotation', type='rotation', vector=[1, 0, 0],
+             units='degree'),
+        dict(name='beta_rotation', type='rotation', vector=[0, 1, 0],
+             units='degree'),
+        dict(name='gamma_rotation', type='rotation', vector=[0, 0, 1],
+             units='degree'),
+    ],
+)
+_cxi_plan = None
+
+
+def cxi_transformations():
+    """Return the compiled CXI_TRANSFORMATIONS, compiled on first use."""
+    global _cxi_plan
+    if _cxi_plan is None:
+        _cxi_plan = compile_plan(CXI_TRANSFORMATIONS)
+    return _cxi_plan
+
 
 def get_user_parameters():
     """configure user's command line parameters from sys.argv"""
@@ -41,8 +86,161 @@ def get_user_parameters():
         help="NXcxi_ptycho (output) data file name",
     )
 
+    parser.add_argument(
+        "--link",
+        action="store_true",
+        help="reference frames and translations of the input file through "
+             "virtual datasets instead of copying them",
+    )
+
+    parser.add_argument(
+        "--resumable",
+        action="store_true",
+        help="checkpoint the progress and continue an interrupted conversion "
+             "of the same output file",
+    )
+
+    add_jobs_argument(parser)
+    add_filter_arguments(parser)
+    add_compression_workers_argument(parser)
+    add_profile_argument(parser)
+    add_transformations_argument(parser)
+    add_preprocess_arguments(parser)
+    add_narrow_dtype_argument(parser)
+    add_sparse_argument(parser)
+    add_chunk_profile_argument(parser)
+    add_frame_statistics_argument(parser)
+
     return parser.parse_args()
 
+
+def write_entry(creator, loader, n, link=False, transformations=None):
+    """
+    Write entry ``n`` of a cxi file as NXptycho entry.
+
+    :param creator: NXCreator of the output file
+    :param loader: CXILoader of the cxi file
+    :param n: index of the cxi entry
+    :param link: reference frames and translations instead of copying them
+    :param transformations: compiled TransformationPlan of the detector and
+                            sample axes, defaults to CXI_TRANSFORMATIONS
+    """
+    cxi = loader.data_dict(n)
+    entry = creator.create_entry_group(definition='NXptycho',
+                                       entry_index=n,
+                                       experiment_description="basic",
+                                       title='test_experiment')
+    instrument = creator.create_instrument_group(h5parent=entry,
+                                                 name=f"{cxi['source_name']} {cxi['instrument_name']}")
+    creator.create_beam_group(h5parent=instrument,
+                              incident_beam_energy=cxi["energy"],
+                              energy_units='eV')
+    if link:
+        data = creator.link_dataset(cxi.dataset("data"))
+        translation = cxi.dataset("translation")
+        x_translation = creator.link_dataset(translation, np.s_[:, 0])
+        y_translation = creator.link_dataset(translation, np.s_[:, 1])
+    else:
+        data = cxi["data"]
+        translation = cxi["translation"]
+        x_translation = translation[:, 0]
+        y_translation = translation[:, 1]
+    detector = creator.create_detector_group(h5parent=instrument,
+                                             data=data,
+                                             data_units='counts',
+                                             distance=cxi["distance"],
+                                             distance_units='m',
+                                             x_pixel_size=cxi["x_pixel_size"],
+                                             y_pixel_size=cxi["y_pixel_size"],
+                                             pixel_size_units='um',
+                                             data_average=cxi["data_average"])
+    creator.create_data_group(h5parent=entry, signal_data='data')
+    plan = transformations or cxi_transformations()
+    plan.write(creator, 'detector', detector)
+
+    sample = creator.create_sample_group(h5parent=entry)
+    # create positioner groups
+    x = creator.create_positioner_group(h5parent=sample,
+                                        name='horizontal',
+                                        raw_value=x_translation,
+                                        positioner_index=1)
+    y = creator.create_positioner_group(h5parent=sample,
+                                        name='vertical',
+                                        raw_value=y_translation,
+                                        positioner_index=2)
+    plan.write(creator, 'sample', sample,
+               positioners=dict(horizontal=x, vertical=y))
+
+
+def cxi2nexus(input_path, nexus_path, jobs=1, filters=None, link=False,
+              resumable=False, report=None, transformations=None,
+              preprocess=None, narrow_dtype=False, sparse_threshold=None,
+              compression_workers=1, chunk_profile=None,
+              frame_statistics=False):
+    """Convert all entries of a cxi file to NXptycho.
+
+    :param input_path: cxi file to convert
+    :param nexus_path: NeXus file to write
+    :param jobs: number of entries converted in parallel
+    :param filters: filter profiles passed to NXCreator
+    :param link: reference frames and translations instead of copying them
+    :param resumable: checkpoint the output and continue an interrupted
+                      conversion
+    :param report: ProfileReport collecting the conversion events
+    :param transformations: transformations spec (dict or JSON/YAML file)
+                            replacing CXI_TRANSFORMATIONS
+    :param preprocess: Preprocessing applied to the frames, needs a copy of
+                       the frames, so it cannot be combined with link
+    :param narrow_dtype: store the frames in the narrowest integer type
+                         holding their counts, cannot be combined with link
+    :param sparse_threshold: store the frames as nonzero pixels if their
+                             fraction of zero pixels is larger, cannot be
+                             combined with link
+    :param compression_workers: threads compressing the frames of each
+                                output file
+    :param chunk_profile: access profile the copied frames are chunked for,
+                          'frame', 'batch-K' or 'pixel', cannot be combined
+                          with link
+    :param frame_statistics: record total counts, maxima and saturated
+                             pixels per frame and the average frame, cannot
+                             be combined with link
+    """
+    if link and preprocess is not None:
+        raise ValueError("Preprocessed frames cannot be linked")
+    if link and narrow_dtype:
+        raise ValueError("Linked frames keep their dtype, drop --narrow-dtype")
+    if link and sparse_threshold is not None:
+        raise ValueError("Linked frames are stored dense, drop --sparse")
+    if link and chunk_profile is not None:
+        raise ValueError("Linked frames keep their chunks, drop "
+                         "--chunk-profile")
+    if link and frame_statistics:
+        raise ValueError("Statistics are recorded while frames are copied, "
+                         "drop --frame-statistics")
+    plan = (cxi_transformations() if transformations is None
+            else compile_plan(transformations))
+    with CXILoader(input_path) as loader:
+        number_of_entries = len([entry for entry in loader.data_file.keys() if 'entry' in entry])
+    convert_entries(write_entry,
+                    CXILoader,
+                    input_path,
+                    nexus_path,
+                    range(1, number_of_entries + 1),
+                    jobs=jobs,
+                    report=report,
+                    creator_options=dict(
+                        filters=filters,
+                        resumable=resumable,
+                        preprocess=preprocess,
+                        narrow_dtype=narrow_dtype,
+                        sparse_threshold=sparse_threshold,
+                        compression_workers=compression_workers,
+                        chunk_profile=chunk_profile,
+                        frame_statistics=frame_statistics),
+                    link=link,
+                    transformations=plan)
+
+
 def main():
     options = get_user_parameters()
     input_filename = options.Input_file
@@ -53,149 +251,25 @@ def main():
     logging.basicConfig(level=choices[logLevel])
     logger = logging.getLogger(__name__)
 
-    data_file = h5py.File(input_filename, 'r')
-
-    def data_dict(entry_index):
-        """
-        load data from ALS cxi file
-
-        :param entry_index:
-        :return: cxi_dict dictionary holding key-value pairs that is needed to fill the nexus datasets
-        """
-        cxi_dict = dict(
-                        ### Beam/Source fields
-                        source_name=data_file.get(f'entry_{entry_index}/instrument_1/source_1/name'),
-                        instrument_name=data_file.get(f'entry_{entry_index}/instrument_1/name'),  # beamline name
-                        energy=data_file.get(f'entry_{entry_index}/instrument_1/source_1/energy'),
-                        # data_illumination_key = 'instrument_1/source_1/data_illumination'
-                        # probe_key = 'instrument_1/source_1/probe'
-                        # probe_mask_key = 'instrument_1/source_1/probe_mask'
-                        ### Detector fields
-                        data=data_file.get(f'entry_{entry_index}/instrument_1/detector_1/data'),
-                        data_average=data_file.get(f'entry_{entry_index}/instrument_1/detector_1/Data Average'),
-                        x_pixel_size=data_file.get(f'entry_{entry_index}/instrument_1/detector_1/x_pixel_size'),
-                        y_pixel_size=data_file.get(f'entry_{entry_index}/instrument_1/detector_1/y_pixel_size'),
-                        distance=data_file.get(f'entry_{entry_index}/instrument_1/detector_1/distance'),
-                        translation=data_file.get(f'entry_{entry_index}/instrument_1/detector_1/translation')
-                        )
-        return cxi_dict
-
-    number_of_entries = len([entry for entry in data_file.keys() if 'entry' in entry])
-    with NXCreator(output_filename) as creator:
-        for n in range(1, number_of_entries + 1):
-            entry = creator.create_entry_group(definition='NXptycho',
-                                               entry_index=n,
-                                               experiment_description="basic",
-                                               title='test_experiment')
-            instrument = creator.create_instrument_group(h5parent=entry,
-                                                         name=f"{data_dict(n)['source_name']} {data_dict(n)['instrument_name']}")
-            creator.create_beam_group(h5parent=instrument,
-                                      incident_beam_energy=data_dict(n)["energy"],
-                                      energy_units='eV')
-            detector = creator.create_detector_group(h5parent=instrument,
-                                                     data=data_dict(n)["data"],
-                                                     data_units='counts',
-                                                     distance=data_dict(n)["distance"],
-                                                     distance_units='m',
-                                                     x_pixel_size=data_dict(n)["x_pixel_size"],
-                                                     y_pixel_size=data_dict(n)["y_pixel_size"],
-                                                     pixel_size_units='um')
-            creator.create_data_group(h5parent=entry, signal_data='data')
-            transformation = creator.create_transformation_group(h5parent=detector)
-            # create transformation axes
-            creator.create_axis(transformation=transformation,
-                                axis_name='x_translation',
-                                transformation_type='translation',
-                                vector=np.array([1, 0, 0], dtype=float),
-                                offset=np.zeros(3, dtype=float),
-                                units="m",
-                                depends_on=".")
-            creator.create_axis(transformation=transformation,
-                                axis_name='y_translation',
-                                transformation_type='translation',
-                                vector=np.array([0, 1, 0], dtype=float),
-                                offset=np.zeros(3, dtype=float),
-                                units="m",
-                                depends_on="x_translation")
-            creator.create_axis(transformation=transformation,
-                                axis_name='z_translation',
-                                transformation_type='translation',
-                                vector=np.array([0, 0, 1], dtype=float),
-                                offset=np.zeros(3, dtype=float),
-                                units="m",
-                                depends_on="y_translation")
-
-            sample = creator.create_sample_group(h5parent=entry)
-            transformation = creator.create_transformation_group(h5parent=sample)
-            # create positioner groups
-            x = creator.create_positioner_group(h5parent=sample,
-                                                name='horizontal',
-                                                raw_value=data_dict(n)["translation"][:,0],
-                                                positioner_index=1)
-            y = creator.create_positioner_group(h5parent=sample,
-                                                name='vertical',
-                                                raw_value=data_dict(n)["translation"][:,1],
-                                                positioner_index=2)
-            #create transformation axes
-            creator.create_axis(transformation=transformation,
-                                axis_name='x_coarse_translation',
-                                transformation_type='translation',
-                                vector=np.array([1, 0, 0], dtype=float),
-                                offset=np.zeros(3, dtype=float),
-                                units="m",
-                                depends_on=".")
-            creator.create_axis(transformation=transformation,
-                                axis_name='x_fine_translation',
-                                value=x['raw_value'],
-                                transformation_type='translation',
-                                vector=np.array([1, 0, 0], dtype=float),
-                                offset=np.zeros(3, dtype=float),
-                                units="m",
-                                depends_on=".")
-            creator.create_axis(transformation=transformation,
-                                axis_name='y_coarse_translation',
-                                transformation_type='translation',
-                                vector=np.array([0, 1, 0], dtype=float),
-                                offset=np.zeros(3, dtype=float),
-                                units="m",
-                                depends_on='.')
-            creator.create_axis(transformation=transformation,
-                                axis_name='y_fine_translation',
-                                value=y['raw_value'],
-                                transformation_type='translation',
-                                vector=np.array([0, 1, 0], dtype=float),
-                                offset=np.zeros(3, dtype=float),
-                                units="m",
-                                depends_on='.')
-            creator.create_axis(transformation=transformation,
-                                axis_name='z_coarse_translation',
-                                transformation_type='translation',
-                                vector=np.array([0, 0, 1], dtype=float),
-                                offset=np.zeros(3, dtype=float),
-                                units="m",
-                                depends_on='.')
-            creator.create_axis(transformation=transformation,
-                                axis_name='alpha_rotation',
-                                transformation_type='rotation',
-                                vector=np.array([1, 0, 0], dtype=float),
-                                offset=np.zeros(3, dtype=float),
-                                units="degree",
-                                depends_on='.')
-            creator.create_axis(transformation=transformation,
-                                axis_name='beta_rotation',
-                                transformation_type='rotation',
-                                vector=np.array([0, 1, 0], dtype=float),
-                                offset=np.zeros(3, dtype=float),
-                                units="degree",
-                                depends_on='.')
-            creator.create_axis(transformation=transformation,
-                                axis_name='gamma_rotation',
-                                transformation_type='rotation',
-                                vector=np.array([0, 0, 1], dtype=float),
-                                offset=np.zeros(3, dtype=float),
-                                units="degree",
-                                depends_on='.')
+    report = ProfileReport() if options.profile else None
+    cxi2nexus(input_filename,
+              output_filename,
+              jobs=options.jobs,
+              filters=filters_from_options(options),
+              link=options.link,
+              resumable=options.resumable,
+              report=report,
+              transformations=options.transformations,
+              preprocess=preprocess_from_options(options),
+              narrow_dtype=options.narrow_dtype,
+              sparse_threshold=options.sparse,
+              compression_workers=options.compression_workers,
+              chunk_profile=options.chunk_profile,
+              frame_statistics=options.frame_statistics)
     logger.info("Wrote HDF5 file: %s", output_filename)
+    if report is not None:
+        report.write(options.profile)
+        logger.info("Wrote profile report: %s", options.profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,101 @@
+"""Convert the entries of a multi-entry input file in a process pool.
+
+Each worker writes one entry into its own shard file next to the output
+file. The output file then becomes a master file that stitches the shards
+together with external links, so a reader sees the same ``entry_N`` tree as
+for a serial conversion.
+"""
+import concurrent.futures
+import logging
+import os
+
+from ..creator import NXCreator
+from ..profiling import ProfileReport
+
+logger = logging.getLogger(__name__)
+
+
+def add_jobs_argument(parser):
+    """Add the ``--jobs`` option to an argparse parser."""
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of entries converted in parallel, each into its own "
+             "shard file linked from the output file",
+    )
+
+
+def shard_filename(output_filename, entry_index):
+    """Name of the shard file holding entry ``entry_index``."""
+    stem, extension = os.path.splitext(output_filename)
+    return f"{stem}_entry_{entry_index}{extension}"
+
+
+def _write_entries(write_entry, open_input, input_filename, output_filename,
+                   entry_indices, report, creator_options, kwargs):
+    """Write the given entries of the input file into a single output file.
+
+    :return *tuple*: output file name and the profile report
+    """
+    with open_input(input_filename) as data_file, \
+            NXCreator(output_filename, observer=report,
+                      **creator_options) as creator:
+        for n in entry_indices:
+            write_entry(creator, data_file, n, **kwargs)
+    return output_filename, report
+
+
+def convert_entries(write_entry,
+                    open_input,
+                    input_filename,
+                    output_filename,
+                    entry_indices,
+                    jobs: int = 1,
+                    report: ProfileReport = None,
+                    creator_options: dict = None,
+                    **kwargs):
+    """Convert entries serially or in a process pool of ``jobs`` workers.
+
+    :param write_entry: module level function
+                        ``write_entry(creator, data_file, n, **kwargs)``
+                        writing entry ``n`` of the opened input
+    :param open_input: callable opening the input file as context manager
+    :param input_filename: file to convert
+    :param output_filename: NeXus file to write, the master file if jobs > 1
+    :param entry_indices: indices of the entries to convert
+    :param jobs: number of worker processes
+    :param report: profile report collecting the events of all output files,
+                   workers send their reports back to be merged into it
+    :param creator_options: keyword arguments of the NXCreator of each
+                            output file except the observer, e.g. filters,
+                            resumable, preprocess or frame_statistics
+    :param kwargs: passed on to write_entry
+    """
+    creator_options = creator_options or {}
+    entry_indices = list(entry_indices)
+    if jobs <= 1 or len(entry_indices) <= 1:
+        _write_entries(write_entry, open_input, input_filename,
+                       output_filename, entry_indices, report,
+                       creator_options, kwargs)
+        return
+
+    shards = {n: shard_filename(output_filename, n) for n in entry_indices}
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        futures = [
+            pool.submit(_write_entries, write_entry, open_input,
+                        input_filename, shards[n], [n],
+                        None if report is None else ProfileReport(),
+                        creator_options, kwargs)
+            for n in entry_indices
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            shard, shard_report = future.result()
+            logger.info("Wrote shard file: %s", shard)
+            if report is not None:
+                report.merge(shard_report)
+
+    with NXCreator(output_filename, observer=report) as creator:
+        for n in entry_indices:
+            creator.create_entry_link(shards[n], entry_index=n)
@@ -1,19 +1,334 @@
+import collections
+import glob
+import io
+import logging
+import os
+import sys
+import time
+
 import h5py
 import numpy as np
 
+from ..chunking import add_chunk_profile_argument
 from ..creator import NXCreator
+from ..filters import (add_compression_workers_argument,
+                       add_filter_arguments, filters_from_options)
+from ..narrowing import add_narrow_dtype_argument
+from ..preprocess import add_preprocess_arguments, preprocess_from_options
+from ..sparse import add_sparse_argument
+from ..statistics import add_frame_statistics_argument
+from ..profiling import ProfileReport, add_profile_argument
+from ..transformations import add_transformations_argument, compile_plan
+
+logger = logging.getLogger(__name__)
+
+DETECTOR_PATH = '/entry/instrument/detector'
+POSITIONER_COLUMNS = {'/entry/sample/positioner_0/raw_value': 0,
+                      '/entry/sample/positioner_1/raw_value': 1}
+
+
+FrameSource = collections.namedtuple(
+    'FrameSource', ['file', 'dataset', 'first_frame', 'count'])
+"""Location of the frames of one Eiger data file within the scan."""
+
+VELOCIPROBE_MASTER_SUFFIX = '_master'
+VELOCIPROBE_POSITION_SUFFIX = '_pos.csv'
+# Velociprobe sample positioner is horizontal stage on rotation stage on
+# vertical stage, see nxptycho.transformations
+VELOCIPROBE_TRANSFORMATIONS = dict(
+    detector=[
+        dict(name='z', type='translation', vector=[0, 0, 1]),
+    ],
+    sample=[
+        dict(name='vertical', type='translation', vector=[0, 1, 0],
+             positioner='vertical'),
+        dict(name='rotation', type='rotation', vector=[0, 1, 0],
+             positioner='rotation', depends_on='vertical'),
+        dict(name='horizontal', type='translation', vector=[1, 0, 0],
+             positioner='horizontal', depends_on='rotation'),
+    ],
+)
+_velociprobe_plan = None
+POSITION_BLOCK_SIZE = 32 * 2**20  # bytes of the position file parsed at once
+FRAME_INDEX_DTYPE = np.dtype([('file', h5py.string_dtype()),
+                              ('first_frame', np.int64),
+                              ('count', np.int64)])
+
+
+def velociprobe_position_path(master_path):
+    """Position file written next to a master file: ``<scan>_master.h5`` -> ``<scan>_pos.csv``."""
+    stem = os.path.splitext(master_path)[0]
+    if stem.endswith(VELOCIPROBE_MASTER_SUFFIX):
+        stem = stem[:-len(VELOCIPROBE_MASTER_SUFFIX)]
+    return stem + VELOCIPROBE_POSITION_SUFFIX
+
+
+def velociprobe_transformations():
+    """Return the compiled VELOCIPROBE_TRANSFORMATIONS, compiled on first use."""
+    global _velociprobe_plan
+    if _velociprobe_plan is None:
+        _velociprobe_plan = compile_plan(VELOCIPROBE_TRANSFORMATIONS)
+    return _velociprobe_plan
+
+
+def _data_file_path(master_path, chunk):
+    """Absolute path of the data file holding ``chunk``."""
+    filename = chunk.file.filename
+    if not os.path.isabs(filename) and not os.path.exists(filename):
+        filename = os.path.join(os.path.dirname(master_path), filename)
+    return os.path.abspath(filename)
+
+
+def frame_sources(f):
+    """Locate the frames of every valid data file linked from a master file.
+
+    Velociprobe data often has empty links because the links are created
+    before the data is actually collected, so missing files are skipped.
+    Eiger data files record their first image number in the image_nr_low
+    attribute; files without it are placed by their position in
+    /entry/data, assuming that all but the last file are full.
+
+    :param f: opened velociprobe master file
+    :return *tuple*: list of FrameSource sorted by first frame, frame shape
+                     and dtype (both ``None`` if no data file is valid yet)
+    """
+    frame_shape = dtype = None
+    valid = []
+    for position, name in enumerate(sorted(f['/entry/data'])):
+        chunk = f['/entry/data'].get(name)
+        if chunk is None:
+            logger.debug('%s: data file is not available', name)
+            continue
+        if frame_shape is None:
+            frame_shape, dtype = chunk.shape[1:], chunk.dtype
+        elif chunk.shape[1:] != frame_shape or chunk.dtype != dtype:
+            logger.warning('%s: frames %s of %s do not match %s of %s, skipped',
+                           name, chunk.shape[1:], chunk.dtype, frame_shape,
+                           dtype)
+            continue
+        valid.append((position, chunk))
+
+    nominal_count = max((chunk.shape[0] for _, chunk in valid), default=0)
+    sources = []
+    for position, chunk in valid:
+        image_nr_low = chunk.attrs.get('image_nr_low')
+        if image_nr_low is not None:
+            first_frame = int(image_nr_low) - 1
+        else:
+            first_frame = position * nominal_count
+        sources.append(
+            FrameSource(_data_file_path(f.filename, chunk), chunk.name,
+                        first_frame, chunk.shape[0]))
+    sources.sort(key=lambda source: source.first_frame)
+    for previous, source in zip(sources, sources[1:]):
+        if previous.first_frame + previous.count > source.first_frame:
+            raise ValueError(f'Frames of {previous.file} and {source.file} '
+                             'overlap')
+    return sources, frame_shape, dtype
+
+
+def _relative_file(source, relative_to):
+    if relative_to is None:
+        return source.file
+    return os.path.relpath(source.file, relative_to)
+
+
+def frame_layout(sources, frame_shape, dtype, frame_count=None,
+                 relative_to=None):
+    """Combine the frames of the data files into a single VirtualLayout.
+
+    Each data file is mapped at its own first frame with its own frame
+    count. Frames of missing files are left unmapped and read as zeros.
 
+    :param sources: FrameSources, see frame_sources
+    :param frame_count: total number of frames of the scan, defaults to the
+                        end of the last valid data file
+    :param relative_to: directory the data file names are made relative to
+    :return *h5py.VirtualLayout*: ``None`` if there are no sources
+    """
+    if not sources:
+        return None
+    covered = sources[-1].first_frame + sources[-1].count
+    layout = h5py.VirtualLayout(
+        shape=(max(covered, frame_count or 0), *frame_shape),
+        dtype=dtype,
+    )
+    for source in sources:
+        layout[source.first_frame:source.first_frame + source.count] = \
+            h5py.VirtualSource(_relative_file(source, relative_to),
+                               source.dataset,
+                               shape=(source.count, *frame_shape),
+                               dtype=dtype)
+    return layout
+
+
+def frame_index(sources, frame_count, relative_to=None):
+    """Frame index datasets written next to the detector data.
+
+    ``frame_index`` holds file, first frame and frame count of every data
+    file, ``frame_file`` the row of frame_index for every frame (-1 if its
+    file is missing) so that frames map to files in O(1), and
+    ``frame_mask`` whether a frame holds measured data.
+
+    :return *dict*: dataset name and value
+    """
+    index = np.array([(_relative_file(source, relative_to),
+                       source.first_frame, source.count)
+                      for source in sources],
+                     dtype=FRAME_INDEX_DTYPE)
+    frame_file = np.full(frame_count, -1, dtype=np.int32)
+    for row, source in enumerate(sources):
+        frame_file[source.first_frame:source.first_frame + source.count] = row
+    return dict(frame_index=index,
+                frame_file=frame_file,
+                frame_mask=frame_file >= 0)
+
+
+def _parse_csv_block(text, usecols=None):
+    """Parse complete lines of a numeric CSV file into a 2D array."""
+    return np.loadtxt(io.BytesIO(text), delimiter=',', usecols=usecols,
+                      ndmin=2)
+
+
+def _position_cache_name(position_path):
+    """Cache file name keyed on size and modification time of the CSV."""
+    stat = os.stat(position_path)
+    return f'{position_path}.{stat.st_size}-{stat.st_mtime_ns}.npy'
+
+
+def read_positions(position_path, usecols=None):
+    """Read a numeric CSV file in blocks into a preallocated array.
 
-def velociprobe2nexus(master_path, position_path, nexus_path):
+    The file is parsed block by block with NumPy's C parser, so memory stays
+    bounded by the output array plus one block.
+
+    :param usecols: indices of the columns to read, defaults to all columns
+    :return *np.ndarray*: positions of shape (lines, columns)
+    """
+    positions = None
+    rows = 0
+    with open(position_path, 'rb') as f:
+        remainder = b''
+        while True:
+            block = f.read(POSITION_BLOCK_SIZE)
+            text = remainder + block
+            end = len(text) if not block else text.rfind(b'\n') + 1
+            text, remainder = text[:end], text[end:]
+            if text.strip():
+                values = _parse_csv_block(text, usecols)
+                if positions is None:
+                    # estimate the line count from the bytes per line
+                    size = os.fstat(f.fileno()).st_size
+                    estimate = int(size / len(text) * len(values) * 1.05) + 1
+                    positions = np.empty((estimate, values.shape[1]))
+                if rows + len(values) > len(positions):
+                    positions = np.resize(
+                        positions,
+                        (max(2 * len(positions), rows + len(values)),
+                         positions.shape[1]))
+                positions[rows:rows + len(values)] = values
+                rows += len(values)
+            if not block:
+                break
+    if positions is None:
+        return np.empty((0, len(usecols) if usecols else 0))
+    return positions[:rows]
+
+
+def load_positions(position_path, usecols=None, cache=True):
+    """Load velociprobe positions, using a binary cache next to the CSV.
+
+    The parsed positions are saved as ``<csv>.<size>-<mtime>.npy`` and
+    memory-mapped on later calls as long as the CSV is unchanged, so repeat
+    conversions of the same scan do not parse the CSV again. Caches of older
+    versions of the CSV are removed. If the directory is not writable the
+    positions are returned without caching.
+
+    :param usecols: indices of the columns to return
+    :param cache: read and write the binary cache
+    :return *np.ndarray*: positions of shape (lines, columns)
+    """
+    if not cache:
+        return read_positions(position_path, usecols)
+    cache_name = _position_cache_name(position_path)
+    if os.path.exists(cache_name):
+        positions = np.load(cache_name, mmap_mode='r')
+    else:
+        positions = read_positions(position_path)
+        try:
+            for stale in glob.glob(glob.escape(position_path) + '.*.npy'):
+                os.remove(stale)
+            tmp_name = cache_name + '.tmp'
+            with open(tmp_name, 'wb') as f:
+                np.save(f, positions)
+            os.replace(tmp_name, cache_name)
+        except OSError as err:
+            logger.info('Positions of %s not cached: %s', position_path, err)
+    if usecols is not None:
+        usecols = list(usecols)
+        if usecols == list(range(usecols[0], usecols[-1] + 1)):
+            # a slice keeps the memory map instead of copying the columns
+            positions = positions[:, usecols[0]:usecols[-1] + 1]
+        else:
+            positions = positions[:, usecols]
+    return positions
+
+
+def velociprobe2nexus(master_path, position_path, nexus_path, filters=None,
+                      growing=False, observer=None, transformations=None,
+                      preprocess=None, narrow_dtype=False,
+                      sparse_threshold=None, compression_workers=1,
+                      materialize=False, chunk_profile=None,
+                      frame_statistics=False):
     """Convert APS velociprobe data to the new Nexus format.
 
     Because the Velociprobe is collected with a Dectris Eiger detector the
     master file is very Nexus-like. It claims to follow the NXmx standard for
     macromolecular crystallography, but it also contains a bunch of nonsense
     in the NXTransformations.
+
+    :param filters: filter profiles passed to NXCreator
+    :param growing: convert a scan that is still running: the data holds
+                    the frames that are valid now and the positioners are
+                    created empty and resizable, see update_velociprobe
+    :param observer: NXCreator observer, e.g. a ProfileReport
+    :param transformations: transformations spec (dict or JSON/YAML file)
+                            replacing VELOCIPROBE_TRANSFORMATIONS
+    :param preprocess: Preprocessing applied to the frames, which are then
+                       copied into the NeXus file instead of referenced
+    :param narrow_dtype: copy the frames in the narrowest integer type
+                         holding the Eiger's count cutoff
+    :param sparse_threshold: copy the frames as nonzero pixels if their
+                             fraction of zero pixels is larger
+    :param compression_workers: threads compressing copied frames
+    :param materialize: copy the stored Eiger chunks into the NeXus file
+                        instead of referencing the data files, for a
+                        self-contained file
+    :param chunk_profile: copy the frames chunked for an access profile,
+                          'frame', 'batch-K' or 'pixel', instead of
+                          referencing them
+    :param frame_statistics: record total counts, maxima and pixels above
+                             the count cutoff per frame and the average
+                             frame, referenced frames are read for them
     """
+    if growing and preprocess is not None:
+        raise ValueError("Preprocessing is not available in follow mode")
+    if growing and (materialize or chunk_profile is not None):
+        raise ValueError("Frames of a running scan cannot be materialized "
+                         "or rechunked")
+    if growing and (narrow_dtype or sparse_threshold is not None
+                    or frame_statistics):
+        raise ValueError("Narrowing the dtype, sparse frames and frame "
+                         "statistics are not available in follow mode")
 
-    with h5py.File(master_path, 'r') as f, NXCreator(nexus_path) as creator:
+    with h5py.File(master_path, 'r', swmr=growing) as f, \
+            NXCreator(nexus_path, filters=filters,
+                      observer=observer, preprocess=preprocess,
+                      narrow_dtype=narrow_dtype,
+                      sparse_threshold=sparse_threshold,
+                      compression_workers=compression_workers,
+                      chunk_profile=chunk_profile,
+                      frame_statistics=frame_statistics) as creator:
 
         entry = creator.create_entry_group(definition='NXptycho')
 
@@ -29,27 +344,11 @@ def velociprobe2nexus(master_path, position_path, nexus_path):
         )
         print('/entry/instrument/beam')
 
-        # Collect the data and combine into a single virtual dataset. We have
-        # to check whether each dataset is valid because Velociprobe data often
-        # has empty links due to the links being created before the data is
-        # actually collected.
-        total_frame_count = 0
-        frame_chunks = []
-        for chunk in f['/entry/data'].values():
-            if chunk is not None:
-                frame_chunks.append(h5py.VirtualSource(chunk))
-                chunk_shape = chunk.shape
-                total_frame_count += chunk_shape[0]
-
-        layout = h5py.VirtualLayout(
-            shape=(total_frame_count, *chunk_shape[1:]),
-            dtype=frame_chunks[0].dtype,
-        )
-        for i, chunk in zip(
-                range(0, total_frame_count, chunk_shape[0]),
-                frame_chunks,
-        ):
-            layout[i:i + chunk_shape[0]] = chunk
+        relative_to = os.path.dirname(os.path.abspath(nexus_path))
+        sources, frame_shape, dtype = frame_sources(f)
+        layout = frame_layout(sources, frame_shape, dtype,
+                              None if growing else expected_frame_count(f),
+                              relative_to)
 
         # The detector group already exists in velociprobe data, but it is
         # filled with garbage, so we must copy the entries we need instead of
@@ -69,23 +368,23 @@ def velociprobe2nexus(master_path, position_path, nexus_path):
             )],  # meter
             pixel_size_units=f['/entry/instrument/detector/x_pixel_size'].
             attrs['units'].decode('utf-8'),
+            count_range=count_range(f, preprocess),
+            materialize=materialize,
         )
+        if layout is not None:
+            for name, value in frame_index(sources, layout.shape[0],
+                                           relative_to).items():
+                creator._create_dataset(detector, name, value)
 
-        # NOTE: Create transformation function is slightly redundant because
-        # there can only be one transformation per group.
-        transformation = creator.create_transformation_group(h5parent=detector)
-        creator.create_axis(
-            transformation=transformation,
-            axis_name='z',
-            value=f['/entry/instrument/detector/detector_distance'][(
-            )],  # meter,
-            transformation_type='translation',
-            vector=np.array([0, 0, 1], dtype=float),
-            offset=np.zeros(3, dtype=float),
-            depends_on=".",
-        )
+        plan = (velociprobe_transformations() if transformations is None
+                else compile_plan(transformations))
+        plan.write(creator, 'detector', detector, values=dict(
+            z=f['/entry/instrument/detector/detector_distance'][()]))  # meter
 
-        positions = np.genfromtxt(position_path, delimiter=",")  # m
+        if growing:
+            positions = np.empty((0, 2))
+        else:
+            positions = load_positions(position_path, usecols=(0, 1))  # m
 
         sample = creator.create_sample_group(h5parent=entry, )
 
@@ -95,6 +394,7 @@ def velociprobe2nexus(master_path, position_path, nexus_path):
             raw_value=positions[:, 0],
             positioner_index=0,
             units='m',
+            resizable=growing,
         )
         y = creator.create_positioner_group(
             h5parent=sample,
@@ -102,6 +402,7 @@ def velociprobe2nexus(master_path, position_path, nexus_path):
             raw_value=positions[:, 1],
             positioner_index=1,
             units='m',
+            resizable=growing,
         )
         rotation = creator.create_positioner_group(
             h5parent=sample,
@@ -114,36 +415,274 @@ def velociprobe2nexus(master_path, position_path, nexus_path):
                 "utf-8"),
         )
 
-        transformation = creator.create_transformation_group(h5parent=sample)
-        # Velociprobe sample positioner is horizontal stage on rotation stage
-        # on vertical stage.
-        creator.create_axis(
-            depends_on='.',
-            transformation=transformation,
-            axis_name='vertical',
-            value=y['raw_value'],
-            units=y['raw_value'].attrs['units'],
-            transformation_type='translation',
-            vector=np.array([0, 1, 0], dtype=float),
-            offset=np.zeros(3, dtype=float),
-        )
-        creator.create_axis(
-            depends_on="vertical",
-            transformation=transformation,
-            axis_name='rotation',
-            value=rotation['raw_value'],
-            units=rotation['raw_value'].attrs['units'],
-            transformation_type='rotation',
-            vector=np.array([0, 1, 0], dtype=float),
-            offset=np.zeros(3, dtype=float),
-        )
-        creator.create_axis(
-            depends_on="rotation",
-            transformation=transformation,
-            axis_name='horizontal',
-            value=x['raw_value'],
-            units=x['raw_value'].attrs['units'],
-            transformation_type='translation',
-            vector=np.array([1, 0, 0], dtype=float),
-            offset=np.zeros(3, dtype=float),
-        )
+        plan.write(creator, 'sample', sample,
+                   positioners=dict(horizontal=x, vertical=y,
+                                    rotation=rotation))
+
+
+def _read_new_positions(position_path, offset):
+    """Parse the complete lines appended to a position file since offset.
+
+    :return *tuple*: positions as 2D array and the offset after the last
+                     complete line
+    """
+    if not os.path.exists(position_path):
+        return np.empty((0, 2)), offset
+    with open(position_path, 'rb') as f:
+        f.seek(offset)
+        text = f.read()
+    text = text[:text.rfind(b'\n') + 1]
+    if not text.strip():
+        return np.empty((0, 2)), offset
+    return _parse_csv_block(text), offset + len(text)
+
+
+def update_velociprobe(master_path, position_path, nexus_path,
+                       position_offset=0):
+    """Extend a NeXus file written with ``growing=True`` by new data.
+
+    The virtual detector data is rebuilt from all data files that are valid
+    now and the positioners are extended by the lines appended to the
+    position file. The NeXus file is only open during the update, so readers
+    see the new frames as soon as they reopen the file.
+
+    :param position_offset: bytes of the position file already converted
+    :return *tuple*: number of frames, number of positions and the new
+                     position offset
+    """
+    relative_to = os.path.dirname(os.path.abspath(nexus_path))
+    with h5py.File(master_path, 'r', swmr=True) as f:
+        sources, frame_shape, dtype = frame_sources(f)
+    layout = frame_layout(sources, frame_shape, dtype,
+                          relative_to=relative_to)
+    positions, position_offset = _read_new_positions(position_path,
+                                                     position_offset)
+    with h5py.File(nexus_path, 'a') as nexus:
+        detector = nexus[DETECTOR_PATH]
+        if layout is not None and (
+                'frame_index' not in detector
+                or len(sources) != len(detector['frame_index'])
+                or layout.shape != detector['data'].shape):
+            attrs = dict(detector['data'].attrs)
+            del detector['data']
+            data = detector.create_virtual_dataset('data', layout=layout)
+            data.attrs.update(attrs)
+            for name, value in frame_index(sources, layout.shape[0],
+                                           relative_to).items():
+                if name in detector:
+                    del detector[name]
+                detector.create_dataset(name, data=value)
+                detector[name].attrs['target'] = detector[name].name
+        for path, column in POSITIONER_COLUMNS.items():
+            raw_value = nexus[path]
+            start = raw_value.shape[0]
+            raw_value.resize((start + len(positions), ))
+            raw_value[start:] = positions[:, column]
+        # all positioners hold one value per position
+        positions_path = '/entry/sample/positioner_0/raw_value'
+        return (detector['data'].shape[0], nexus[positions_path].shape[0],
+                position_offset)
+
+
+def count_range(f, preprocess=None):
+    """Range of valid counts from the Eiger's count cutoff.
+
+    Pixels above the cutoff are marked as overflowing. ``None`` if the
+    cutoff is unknown or the frames are preprocessed, which changes their
+    counts.
+
+    :param f: opened velociprobe master file
+    """
+    path = f'{DETECTOR_PATH}/detectorSpecific/countrate_correction_count_cutoff'
+    if preprocess is not None or path not in f:
+        return None
+    return (0, int(f[path][()]))
+
+
+def expected_frame_count(f):
+    """Number of frames announced by the Eiger, ``None`` if unknown.
+
+    :param f: opened velociprobe master file
+    """
+    specific = f.get(f'{DETECTOR_PATH}/detectorSpecific')
+    if specific is None or 'nimages' not in specific:
+        return None
+    ntrigger = specific['ntrigger'][()] if 'ntrigger' in specific else 1
+    return int(specific['nimages'][()] * ntrigger)
+
+
+def follow_velociprobe(master_path,
+                       position_path,
+                       nexus_path,
+                       poll_interval=2.0,
+                       timeout=60.0,
+                       filters=None,
+                       observer=None,
+                       transformations=None):
+    """Convert a running velociprobe scan and keep extending the NeXus file.
+
+    Waits for the first valid data file, writes the NeXus file and then
+    polls the master file (opened in SWMR read mode) and the position file
+    for new data every ``poll_interval`` seconds. Following stops once all
+    frames announced by the detector and their positions are converted, or
+    when nothing new arrived for ``timeout`` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        if os.path.exists(master_path):
+            with h5py.File(master_path, 'r', swmr=True) as f:
+                if frame_sources(f)[0]:
+                    break
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"No valid data in {master_path} after "
+                               f"{timeout} s")
+        time.sleep(poll_interval)
+
+    velociprobe2nexus(master_path, position_path, nexus_path,
+                      filters=filters, growing=True, observer=observer,
+                      transformations=transformations)
+    state = (0, 0, 0)
+    last_change = time.monotonic()
+    while True:
+        try:
+            new_state = update_velociprobe(master_path, position_path,
+                                           nexus_path, state[2])
+        except OSError as err:
+            # e.g. a reader holds a lock on the NeXus file, retry next poll
+            logger.warning("Update of %s failed: %s", nexus_path, err)
+            new_state = state
+        if new_state[:2] != state[:2]:
+            logger.info("%s: %d frames, %d positions", nexus_path,
+                        *new_state[:2])
+            last_change = time.monotonic()
+        state = new_state
+        with h5py.File(master_path, 'r', swmr=True) as f:
+            expected = expected_frame_count(f)
+        if expected is not None and min(state[:2]) >= expected:
+            logger.info("All %d frames converted", expected)
+            return
+        if time.monotonic() - last_change > timeout:
+            logger.info("No new data for %.0f s, stopped following",
+                        timeout)
+            return
+        time.sleep(poll_interval)
+
+
+def get_user_parameters():
+    """configure user's command line parameters from sys.argv"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog=sys.argv[0], description="velociprobe to NXptycho writer"
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="logging verbosity",
+    )
+
+    parser.add_argument(
+        "master_file",
+        help="velociprobe <scan>_master.h5 file",
+    )
+
+    parser.add_argument(
+        "position_file",
+        help="velociprobe <scan>_pos.csv file",
+    )
+
+    parser.add_argument(
+        "NeXus_file",
+        help="NXptycho (output) data file name",
+    )
+
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="convert a running scan and keep adding new frames",
+    )
+
+    parser.add_argument(
+        "--materialize",
+        action="store_true",
+        help="copy the compressed frames into the NeXus file instead of "
+             "referencing the data files, without decompressing them",
+    )
+
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=2.0,
+        help="seconds between checks for new data in follow mode",
+    )
+
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60.0,
+        help="stop following after this many seconds without new data",
+    )
+
+    add_filter_arguments(parser)
+    add_compression_workers_argument(parser)
+    add_profile_argument(parser)
+    add_transformations_argument(parser)
+    add_preprocess_arguments(parser)
+    add_narrow_dtype_argument(parser)
+    add_sparse_argument(parser)
+    add_chunk_profile_argument(parser)
+    add_frame_statistics_argument(parser)
+
+    return parser.parse_args()
+
+
+def main():
+    options = get_user_parameters()
+
+    choices = "WARNING INFO DEBUG".split()
+    logLevel = min(max(0, options.verbose), len(choices) - 1)
+    logging.basicConfig(level=choices[logLevel])
+
+    report = ProfileReport() if options.profile else None
+    preprocess = preprocess_from_options(options)
+    if options.follow:
+        if (preprocess is not None or options.narrow_dtype
+                or options.sparse is not None or options.materialize
+                or options.chunk_profile is not None
+                or options.frame_statistics):
+            raise ValueError("Preprocessing, narrowing the dtype, sparse, "
+                             "materialized and rechunked frames and frame "
+                             "statistics are not available in follow mode")
+        follow_velociprobe(options.master_file,
+                           options.position_file,
+                           options.NeXus_file,
+                           poll_interval=options.poll_interval,
+                           timeout=options.timeout,
+                           filters=filters_from_options(options),
+                           observer=report,
+                           transformations=options.transformations)
+    else:
+        velociprobe2nexus(options.master_file,
+                          options.position_file,
+                          options.NeXus_file,
+                          filters=filters_from_options(options),
+                          observer=report,
+                          transformations=options.transformations,
+                          preprocess=preprocess,
+                          narrow_dtype=options.narrow_dtype,
+                          sparse_threshold=options.sparse,
+                          compression_workers=options.compression_workers,
+                          materialize=options.materialize,
+                          chunk_profile=options.chunk_profile,
+                          frame_statistics=options.frame_statistics)
+    logger.info("Wrote HDF5 file: %s", options.NeXus_file)
+    if report is not None:
+        report.write(options.profile)
+        logger.info("Wrote profile report: %s", options.profile)
+
+
+if __name__ == "__main__":
+    main()
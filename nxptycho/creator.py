@@ -1,9 +1,24 @@
+import collections
+import concurrent.futures
+import contextlib
 import datetime
 import h5py
+import itertools
+import json
 import logging
 import os
+import posixpath
+import time
 import numpy as np
-import pint
+
+from .chunking import parse_profile, plan_chunks
+from .filters import (FILTER_ROLES, chunk_encoder, profile_matches,
+                      resolve_profile)
+from .narrowing import Narrowing
+from .profiling import Event
+from .sparse import (SPARSE_CHUNK, is_sparse, open_frames, sparse_names,
+                     sparsify, zero_fraction)
+from .statistics import STATISTICS_FIELDS, FrameStatistics, overflow_marker
 
 # TODO
 # [x] load data (in loader module)
@@ -15,13 +30,70 @@ import pint
 # [-] add positioner data and define names per axis
 
 # FIXME
-# [ ] check why nxs file is x times larger than the original cxi file
+# [x] check why nxs file is x times larger than the original cxi file
+#     --> written uncompressed, choose filter profiles (see filters module)
 # [ ] update NXCreator usage documentation
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 NX_APP_DEF_NAME = "NXptycho"
 NX_EXTENSION = ".nxs"
+ARBITRARY_UNITS = ('au', 'a.u.', 'a.u')
+DEFAULT_MEMORY_BUDGET = 256 * 2**20  # bytes of frame data held per slab
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+UnitCheck = collections.namedtuple("UnitCheck", ["valid", "factor", "error"])
+"""Memoized result of a unit check: whether the units are compatible, the
+factor converting supplied into expected units and the pint error, if any."""
+
+_unit_registry = None
+_unit_checks = {}
+
+
+def get_unit_registry():
+    """Return the process-wide pint UnitRegistry, created on first use.
+
+    Importing pint and loading its unit definitions is expensive, so pint is
+    only imported here on the first unit check and every unit check in the
+    process shares this single registry.
+    """
+    global _unit_registry
+    if _unit_registry is None:
+        import pint
+        _unit_registry = pint.UnitRegistry()
+    return _unit_registry
+
+
+def check_units(supplied: str, expected: str) -> UnitCheck:
+    """Check whether ``supplied`` units can be converted to ``expected`` units.
+
+    Results are memoized per (supplied, expected) pair together with the
+    conversion factor, so repeated checks of the same units are free and
+    later conversion stages can reuse the factor.
+
+    :param supplied: units string that was given
+    :param expected: units string required by the NeXus definition
+    :return *UnitCheck*: validity, conversion factor (``None`` if invalid)
+                         and the pint error message (``None`` if valid)
+    """
+    key = (supplied, expected)
+    try:
+        return _unit_checks[key]
+    except KeyError:
+        pass
+    ureg = get_unit_registry()
+    import pint  # already loaded with the registry
+    try:
+        user = 1.0 * ureg(supplied)
+    except pint.UndefinedUnitError as err:
+        result = UnitCheck(False, None, str(err))
+    else:
+        if user.check(expected):
+            result = UnitCheck(True, user.to(expected).magnitude, None)
+        else:
+            result = UnitCheck(False, None, None)
+    _unit_checks[key] = result
+    return result
 
 
 class NXCreator:
@@ -47,8 +119,69 @@ class NXCreator:
             )
 
     """
-    def __init__(self, output_filename):
+    def __init__(self,
+                 output_filename,
+                 memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 filters: dict = None,
+                 resumable: bool = False,
+                 observer=None,
+                 preprocess=None,
+                 narrow_dtype: bool = False,
+                 sparse_threshold: float = None,
+                 compression_workers: int = 1,
+                 chunk_profile: str = None,
+                 frame_statistics: bool = False):
+        """
+        :param output_filename: NeXus file to write
+        :param memory_budget: bytes of frame data held in memory while copying
+        :param filters: filter profile per dataset role ('data', 'raw_value'
+                        or 'axis'), see :mod:`nxptycho.filters`
+        :param resumable: record the progress in a checkpoint file next to
+                          the output and continue from an existing checkpoint
+                          instead of rewriting the file
+        :param observer: callable receiving an :class:`~nxptycho.profiling.Event`
+                         for every file open/close, group, dataset, unit
+                         check and link, see :mod:`nxptycho.profiling`
+        :param preprocess: :class:`~nxptycho.preprocess.Preprocessing` applied
+                           to the detector data while it is copied
+        :param narrow_dtype: store the detector data in the narrowest integer
+                             type holding its counts, see
+                             :mod:`nxptycho.narrowing`
+        :param sparse_threshold: store the detector data as nonzero pixels if
+                                 the fraction of zero pixels exceeds it, see
+                                 :mod:`nxptycho.sparse`
+        :param compression_workers: threads compressing the chunks of
+                                    streamed datasets, see
+                                    :meth:`_write_chunks`
+        :param chunk_profile: access profile the detector data is chunked
+                              for, 'frame', 'batch-K' or 'pixel', see
+                              :mod:`nxptycho.chunking`
+        :param frame_statistics: record per-frame statistics and the average
+                                 of the detector data while it is copied,
+                                 see :mod:`nxptycho.statistics`
+        """
         self._output_filename = output_filename
+        self.memory_budget = memory_budget
+        self.resumable = resumable
+        self.observer = observer
+        self.preprocess = preprocess
+        self.narrow_dtype = narrow_dtype
+        self.sparse_threshold = sparse_threshold
+        self.compression_workers = compression_workers
+        if chunk_profile is not None:
+            parse_profile(chunk_profile)  # fail before any data is written
+        self.chunk_profile = chunk_profile
+        self.frame_statistics = frame_statistics
+        self._opened = None  # perf_counter when the file was opened
+        self.checkpoint_filename = output_filename + CHECKPOINT_SUFFIX
+        self._checkpoint = None  # committed datasets, None if not resumable
+        self._pending = {}  # datasets written since the last checkpoint
+        self.filters = {}
+        for role, profile in (filters or {}).items():
+            if role not in FILTER_ROLES:
+                raise ValueError(f"Unknown filter role '{role}'")
+            resolve_profile(profile)  # fail before any data is written
+            self.filters[role] = profile
         self.entry_group_name = None
         self.instrument_group_name = None
         self.detector_group = None
@@ -65,13 +198,72 @@ class NXCreator:
         writing some header information. Then file is closed.
         Actual data will be added opening the file in "a" mode
         see below in the different create_group methods
+
+        A resumable creator with an existing checkpoint reopens the file in
+        append mode instead, keeping everything committed so far.
         """
+        self._opened = time.perf_counter()
+        if self.resumable and os.path.exists(self.checkpoint_filename):
+            with open(self.checkpoint_filename) as f:
+                self._checkpoint = json.load(f)
+            logger.info("Resuming %s from checkpoint %s",
+                        self._output_filename, self.checkpoint_filename)
+            self.file_handle = h5py.File(self._output_filename, "a")
+            self._notify("file_open", self._output_filename, self._opened,
+                         mode="a")
+            return self
         self.file_handle = h5py.File(self._output_filename, "w")
         self.write_file_header(self.file_handle)
+        if self.resumable:
+            self._checkpoint = dict(datasets={})
+            self.save_checkpoint()
+        self._notify("file_open", self._output_filename, self._opened,
+                     mode="w")
         return self
 
     def __exit__(self, type, value, traceback):
+        if self._checkpoint is not None:
+            if type is None:
+                os.remove(self.checkpoint_filename)
+            else:
+                self.save_checkpoint()
+                logger.warning(
+                    "Conversion interrupted, rerun to resume from %s",
+                    self.checkpoint_filename)
+        tic = time.perf_counter()
         self.file_handle.close()
+        self._notify("file_close",
+                     self._output_filename,
+                     tic,
+                     nbytes=os.path.getsize(self._output_filename),
+                     wall_seconds=time.perf_counter() - self._opened,
+                     completed=type is None)
+
+    def _notify(self, kind, name, tic, nbytes=0, **details):
+        """Send an event to the observer, timed from ``tic`` until now."""
+        if self.observer is not None:
+            self.observer(
+                Event(kind, name, time.perf_counter() - tic, nbytes, details))
+
+    def save_checkpoint(self):
+        """Flush the output file and record all datasets written so far.
+
+        The checkpoint is replaced atomically so that an interruption never
+        leaves a checkpoint referring to data that is not on disk.
+        """
+        self.file_handle.flush()
+        self._checkpoint["datasets"].update(self._pending)
+        self._pending = {}
+        tmp_filename = self.checkpoint_filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(self._checkpoint, f)
+        os.replace(tmp_filename, self.checkpoint_filename)
+
+    def _committed(self, path):
+        """Return ``(committed, total)`` frames of a checkpointed dataset."""
+        if self._checkpoint is None:
+            return None
+        return self._checkpoint["datasets"].get(path)
 
     def write_file_header(self, output_file: h5py.File):
         """optional header metadata for writing a new file"""
@@ -94,10 +286,18 @@ class NXCreator:
         # output_file.attrs["end_time"] = timestamp
 
     def _init_group(self, h5parent: h5py.Group, name: str, NX_class: str):
-        """Conveniently initialize a NeXus HDF5 group."""
-        group = h5parent.create_group(name)
+        """Conveniently initialize a NeXus HDF5 group.
+
+        Groups that already exist in a resumed file are reused.
+        """
+        tic = time.perf_counter()
+        if self._checkpoint is not None and name in h5parent:
+            group = h5parent[name]
+        else:
+            group = h5parent.create_group(name)
         group.attrs["NX_class"] = NX_class
         print(group.name)
+        self._notify("group", group.name, tic, NX_class=NX_class)
         return group
 
     def _create_dataset(self,
@@ -105,26 +305,549 @@ class NXCreator:
                         name: str,
                         value: np.ndarray,
                         chunk_size: int = None,
-                        auto_chunk: bool = False,
+                        auto_chunk=False,
+                        filters: str = None,
+                        maxshape: tuple = None,
+                        transform=None,
+                        sparse_threshold: float = None,
+                        materialize: bool = False,
+                        statistics: FrameStatistics = None,
                         **kwargs):
-        """Conveniently create a dataset in a Nexus HDF5 group."""
+        """Conveniently create a dataset in a Nexus HDF5 group.
+
+        Datasets of the output file are hard linked. Datasets from other
+        files whose layout and filters fit the request are copied by HDF5
+        (see :meth:`_can_copy_object`). Other numeric arrays and datasets are
+        streamed in slabs of frames (see :meth:`_stream_dataset`) when they
+        exceed the memory budget, come from another file or when chunking or
+        filters are requested.
+
+        :param chunk_size: number of frames per HDF5 chunk
+        :param auto_chunk: let h5py guess the chunk shape, or an access
+                           profile of :func:`~nxptycho.chunking.plan_chunks`
+                           to chunk for, recorded as attribute
+                           'chunk_profile'
+        :param filters: filter profile name, see :mod:`nxptycho.filters`
+        :param maxshape: maximum shape of a resizable array, e.g. ``(None,)``
+                         for positions that grow during acquisition
+        :param transform: function applied to every slab of frames, e.g. a
+                          :class:`~nxptycho.preprocess.Preprocessing`, the
+                          data is always copied then
+        :param sparse_threshold: copy frame stacks with a larger fraction of
+                                 zero pixels into the sparse fields of
+                                 :mod:`nxptycho.sparse` instead, the
+                                 attributes then go to the values
+        :param materialize: copy the chunks of the sources of a VirtualLayout
+                            into a regular dataset instead of referencing
+                            them, see :meth:`_copy_raw_chunks`
+        :param statistics: FrameStatistics updated with the frames while
+                           they are written, frames that would be copied by
+                           HDF5 or as stored chunks are streamed then
+        :param kwargs: attributes of the dataset
+        """
         if value is None:
             return
-        if isinstance(value, h5py.VirtualLayout):
+        tic = time.perf_counter()
+        path = posixpath.join(group.name, name)
+        committed = 0
+        if self._checkpoint is not None and is_sparse(group, name):
+            # partial sparse fields are rewritten, complete ones skipped
+            done, total = self._committed(path) or (0, None)
+            if done == total:
+                logger.info(' %s: already written, skipped', path)
+                self._notify("dataset", path, tic, mode="skipped")
+                return group[sparse_names(name)[1]]
+        elif self._checkpoint is not None and name in group:
+            committed, total = self._committed(path) or (0, None)
+            if committed == total:
+                logger.info(' %s: already written, skipped', path)
+                self._notify("dataset", path, tic, mode="skipped")
+                if isinstance(value, h5py.ExternalLink):
+                    return
+                return group[name]
+            if not committed or not self._is_streamable(
+                    value, chunk_size, auto_chunk, filters, maxshape,
+                    transform, sparse_threshold):
+                del group[name]
+                committed = 0
+        nbytes = 0
+        copy = transform is not None or sparse_threshold is not None
+        rechunk = isinstance(auto_chunk, str)  # chunked for an access profile
+        # copies by HDF5 never pass the frames through here, so frames with
+        # statistics are streamed instead of read a second time afterwards
+        decode = copy or statistics is not None
+        ds = None
+        if (isinstance(value, h5py.VirtualLayout) and materialize
+                and not decode and not rechunk):
+            mode = "raw_chunks"
+            ds = self._copy_raw_chunks(group, name, value)
+            copy = ds is None  # decode and copy the frames instead
+        if ds is not None:
+            nbytes = ds.id.get_storage_size()
+        elif isinstance(value, h5py.VirtualLayout) and (
+                copy or rechunk or (materialize and decode)):
+            # read the frames through a temporary virtual dataset
+            mode = "stream"
+            if f".{name}_source" in group:  # left by an interrupted copy
+                del group[f".{name}_source"]
+            source = group.create_virtual_dataset(f".{name}_source",
+                                                  layout=value)
+            ds = self._stream_dataset(group, name, source, chunk_size,
+                                      auto_chunk, filters, committed,
+                                      maxshape, transform, sparse_threshold,
+                                      statistics)
+            del group[source.name]
+            nbytes = ds.nbytes
+        elif isinstance(value, h5py.VirtualLayout):
+            mode = "virtual"
             ds = group.create_virtual_dataset(name, layout=value)
-        elif isinstance(value, h5py.Dataset):
+        elif (isinstance(value, h5py.Dataset) and value.file == group.file
+              and not copy and not rechunk):
+            mode = "hard_link"
             group[name] = value
             ds = group[name]
         elif isinstance(value, h5py.ExternalLink):
             group[name] = value
+            if self._checkpoint is not None:
+                self._pending[path] = (1, 1)
+            self._notify("dataset", path, tic, mode="external_link")
             return  # Cannot edit external links
+        elif not decode and self._can_copy_object(value, chunk_size,
+                                                  auto_chunk, filters,
+                                                  maxshape):
+            mode = "object_copy"
+            if name in group:  # partial copy of an interrupted conversion
+                del group[name]
+            group.copy(value, name, without_attrs=True)
+            ds = group[name]
+            nbytes = ds.nbytes
+        elif self._is_streamable(value, chunk_size, auto_chunk, filters,
+                                 maxshape, transform, sparse_threshold):
+            mode = "stream"
+            ds = self._stream_dataset(group, name, value, chunk_size,
+                                      auto_chunk, filters, committed,
+                                      maxshape, transform, sparse_threshold,
+                                      statistics)
+            nbytes = ds.nbytes
         else:
+            mode = "write"
+            if isinstance(value, h5py.Dataset):
+                value = value[()]
+            if statistics is not None:
+                statistics.update(0, value)
             ds = group.create_dataset(name, data=value)
+            nbytes = ds.nbytes
+        if mode == "stream" and is_sparse(group, name):
+            mode = "sparse"
+        elif isinstance(auto_chunk, str) and mode in ("stream", "object_copy"):
+            ds.attrs["chunk_profile"] = plan_chunks(
+                ds.shape, ds.dtype, auto_chunk, self.memory_budget).profile
         for k, v in kwargs.items():
             ds.attrs[k] = v
         ds.attrs["target"] = ds.name
+        if self._checkpoint is not None:
+            self._pending.setdefault(path, (1, 1))
+        self._notify("dataset", path, tic, nbytes, mode=mode,
+                     filters=filters or "none")
+        return ds
+
+    def _is_streamable(self, value, chunk_size, auto_chunk, filters=None,
+                       maxshape=None, transform=None, sparse_threshold=None):
+        """Return ``True`` if value should be copied slab by slab."""
+        if not isinstance(value, (np.ndarray, h5py.Dataset)):
+            return False
+        if value.ndim == 0 or value.dtype.kind not in "biufc":
+            return False
+        if (maxshape is not None or transform is not None
+                or sparse_threshold is not None):
+            return True
+        if value.shape[0] == 0 or value.size == 0:
+            return False
+        return (isinstance(value, h5py.Dataset) or chunk_size is not None
+                or auto_chunk or bool(resolve_profile(filters))
+                or value.nbytes > self.memory_budget)
+
+    def _can_copy_object(self, value, chunk_size, auto_chunk, filters=None,
+                         maxshape=None):
+        """Return ``True`` if HDF5 can copy value as it is stored.
+
+        Datasets of other files are copied with H5Ocopy, which moves the
+        stored chunks within the C library, when their chunk shape and
+        filters are the requested ones. Without a filter profile the filters
+        of the source are kept.
+        """
+        if not isinstance(value, h5py.Dataset) or value.is_virtual:
+            return False
+        if (maxshape is not None
+                and value.maxshape[:len(maxshape)] != tuple(maxshape)):
+            return False
+        if ((chunk_size is not None or isinstance(auto_chunk, str))
+                and value.chunks != self._chunk_shape(
+                    value.shape, chunk_size, auto_chunk, value.dtype)):
+            return False
+        if auto_chunk and value.chunks is None:
+            return False
+        return filters is None or profile_matches(filters, value)
+
+    def _chunk_shape(self, shape, chunk_size, auto_chunk, dtype=None):
+        """Return the chunk shape for a streamed dataset of ``shape``.
+
+        By default frame stacks are chunked one frame per chunk, while 1-D
+        arrays are left to h5py's chunk guess. An access profile as
+        ``auto_chunk`` is planned by :func:`~nxptycho.chunking.plan_chunks`.
+        """
+        if chunk_size is not None:
+            return (max(1, min(chunk_size, shape[0])), *shape[1:])
+        if isinstance(auto_chunk, str) and shape[0] > 0:
+            return plan_chunks(shape, dtype, auto_chunk,
+                               self.memory_budget).chunks
+        if auto_chunk or len(shape) == 1:
+            return True
+        return (1, *shape[1:])
+
+    def _slab_frames(self, shape, dtype, chunk_frames=1):
+        """Number of frames to copy at once within the memory budget.
+
+        The slab is rounded down to a whole number of chunks whenever the
+        budget holds at least one chunk.
+        """
+        frame_nbytes = int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize
+        frames = max(1, self.memory_budget // max(frame_nbytes, 1))
+        if frames >= chunk_frames:
+            frames -= frames % chunk_frames
+        return min(frames, max(shape[0], 1))
+
+    def _iter_slabs(self, source, slab_frames, first_frame=0):
+        """Yield ``(start, stop, slab)`` along the first axis of source.
+
+        Slabs of HDF5 datasets are read into one reused buffer, so memory use
+        stays constant regardless of the number of frames. The yielded array
+        is only valid until the next iteration.
+        """
+        nframes = source.shape[0]
+        if isinstance(source, h5py.Dataset):
+            buffer = np.empty((slab_frames, *source.shape[1:]),
+                              dtype=source.dtype)
+        for start in range(first_frame, nframes, slab_frames):
+            stop = min(start + slab_frames, nframes)
+            if isinstance(source, h5py.Dataset):
+                slab = buffer[:stop - start]
+                source.read_direct(slab, np.s_[start:stop])
+            else:
+                slab = source[start:stop]
+            yield start, stop, slab
+
+    def _resume_dataset(self, group, name, source, committed, shape, dtype,
+                        transform=None):
+        """Return the partially written dataset if it can be continued.
+
+        The dataset must have the expected shape and dtype and its last
+        committed frame must equal the (transformed) source, otherwise it is
+        removed.
+        """
+        ds = group[name]
+        last = source[committed - 1:committed]
+        if transform is not None:
+            last = transform(last)
+        if (ds.shape == shape and ds.dtype == dtype
+                and np.array_equal(ds[committed - 1], last[0])):
+            logger.info(' %s: resuming at frame %d of %d', ds.name, committed,
+                        source.shape[0])
+            return ds
+        logger.warning(' %s: partial data does not match the source, '
+                       'rewriting it', ds.name)
+        del group[name]
+        return None
+
+    def _stream_dataset(self, group, name, source, chunk_size=None,
+                        auto_chunk=False, filters=None, committed=0,
+                        maxshape=None, transform=None, sparse_threshold=None,
+                        statistics=None):
+        """Copy ``source`` into a new chunked dataset in slabs of frames.
+
+        Resumable creators checkpoint after every slab, and continue after
+        the ``committed`` frames of an interrupted copy. A ``transform`` is
+        applied to every slab before it is written, transforms with a
+        ``prepare`` method get a first pass over the slabs of the source.
+        Frame stacks with more zero pixels than ``sparse_threshold`` are
+        copied by :meth:`_sparse_dataset` instead. The written slabs update
+        ``statistics``, frames of a resumed copy are read back for it.
+        """
+        shape, dtype = source.shape, source.dtype
+        prepare = getattr(transform, "prepare", None)
+        if prepare is not None:
+            prepare(self._iter_slabs(source,
+                                     self._slab_frames(shape, dtype)))
+        if transform is not None:
+            shape = transform.output_shape(shape)
+            dtype = transform.output_dtype(dtype)
+        if sparse_threshold is not None and len(shape) == 3:
+            slabs = (slab if transform is None else transform(slab)
+                     for _, _, slab in self._iter_slabs(
+                         source, self._slab_frames(source.shape,
+                                                   source.dtype)))
+            zeros = zero_fraction(slabs, int(np.prod(shape, dtype=np.int64)),
+                                  sparse_threshold)
+            if zeros > sparse_threshold:
+                return self._sparse_dataset(group, name, source, shape, dtype,
+                                            filters, transform, statistics)
+            logger.info(' %s: at most %.1f%% zero pixels, stored dense',
+                        posixpath.join(group.name, name), 100 * zeros)
+        ds = None
+        if committed:
+            ds = self._resume_dataset(group, name, source, committed, shape,
+                                      dtype, transform)
+        if ds is None:
+            committed = 0
+            cache = {}
+            if (isinstance(auto_chunk, str) and chunk_size is None
+                    and shape[0] > 0):
+                # the cache holds a row of chunks spanning the frames
+                plan = plan_chunks(shape, dtype, auto_chunk,
+                                   self.memory_budget)
+                cache = dict(rdcc_nbytes=plan.cache_nbytes,
+                             rdcc_nslots=plan.cache_slots)
+            ds = group.create_dataset(name,
+                                      shape=shape,
+                                      dtype=dtype,
+                                      chunks=self._chunk_shape(
+                                          shape, chunk_size, auto_chunk,
+                                          dtype),
+                                      maxshape=maxshape,
+                                      **cache,
+                                      **resolve_profile(filters))
+        slab_frames = self._slab_frames(source.shape, source.dtype,
+                                        ds.chunks[0])
+        nframes = source.shape[0]
+        if statistics is not None and committed:
+            for start, _, slab in self._iter_slabs(ds, slab_frames):
+                if start >= committed:
+                    break
+                statistics.update(start, slab[:committed - start])
+        encoder = pool = None
+        if self.compression_workers > 1 and filters:
+            encoder = chunk_encoder(filters, ds.dtype)
+            if encoder is None:
+                logger.info(' %s: no chunk encoder for filters %s, '
+                            'compressed by HDF5', ds.name, filters)
+            else:
+                pool = concurrent.futures.ThreadPoolExecutor(
+                    self.compression_workers)
+        tic = time.perf_counter()
+        try:
+            for start, stop, slab in self._iter_slabs(source, slab_frames,
+                                                      committed):
+                if transform is not None:
+                    slab = transform(slab)
+                slab = np.ascontiguousarray(slab)
+                if statistics is not None:
+                    statistics.update(start, slab)
+                if pool is None or not self._write_chunks(
+                        ds, slab, start, encoder, pool):
+                    ds.write_direct(slab, dest_sel=np.s_[start:stop])
+                if self._checkpoint is not None:
+                    self._pending[ds.name] = (stop, nframes)
+                    self.save_checkpoint()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        elapsed = time.perf_counter() - tic
+        nframes -= committed
+        nbytes = nframes * source.dtype.itemsize * int(
+            np.prod(source.shape[1:], dtype=np.int64))
+        logger.info(
+            ' %s: copied %d frames in %.2f s (%.1f frames/s, %.1f MB/s, '
+            'filters: %s)', ds.name, nframes, elapsed,
+            nframes / max(elapsed, 1e-9), nbytes / 2**20 / max(elapsed, 1e-9),
+            filters or "none")
+        return ds
+
+    def _copy_raw_chunks(self, group, name, layout):
+        """Copy the stored chunks of the sources of a layout undecoded.
+
+        Every chunk is read with ``read_direct_chunk`` and written unchanged
+        with ``write_direct_chunk`` into a dataset with the chunk shape and
+        filter pipeline of the sources, so no codec runs and no filter plugin
+        is needed; filters not registered here are marked optional. Frames
+        not mapped by the layout are not written and read as the fill value
+        zero, like in the virtual dataset.
+
+        :return *h5py.Dataset*: ``None`` if the sources differ in chunk shape,
+                                dtype or filters, are not chunked or do not
+                                start at a chunk boundary of the output
+        """
+        output_dir = os.path.dirname(os.path.abspath(self._output_filename))
+        path = posixpath.join(group.name, name)
+        mapping = layout.dcpl
+        with contextlib.ExitStack() as stack:
+            sources = []
+            for i in range(mapping.get_virtual_count()):
+                filename = mapping.get_virtual_filename(i)
+                if filename == ".":
+                    return None
+                f = stack.enter_context(
+                    h5py.File(os.path.join(output_dir, filename), "r"))
+                source = f[mapping.get_virtual_dsetname(i)]
+                start, end = mapping.get_virtual_vspace(i).get_select_bounds()
+                if (source.chunks is None or source.dtype != layout.dtype
+                        or source.shape[1:] != layout.shape[1:]
+                        or end[0] - start[0] + 1 != source.shape[0]
+                        or mapping.get_virtual_srcspace(i).get_select_npoints()
+                        != source.size
+                        or any(start[1:]) or start[0] % source.chunks[0]):
+                    logger.info(' %s: %s cannot be copied chunk by chunk',
+                                path, source.name)
+                    return None
+                plist = source.id.get_create_plist()
+                pipeline = tuple(plist.get_filter(n)[:3]
+                                 for n in range(plist.get_nfilters()))
+                sources.append((start[0], source, (source.chunks, pipeline)))
+            if not sources or len({plan for *_, plan in sources}) != 1:
+                logger.info(' %s: sources differ in chunks or filters', path)
+                return None
+
+            chunks, pipeline = sources[0][2]
+            dcpl = h5py.h5p.create(h5py.h5p.DATASET_CREATE)
+            dcpl.set_chunk(chunks)
+            dcpl.set_fill_value(np.zeros((), dtype=layout.dtype))
+            for code, flags, values in pipeline:
+                if not h5py.h5z.filter_avail(code):
+                    flags |= h5py.h5z.FLAG_OPTIONAL
+                dcpl.set_filter(code, flags, values)
+            if name in group:
+                del group[name]
+            ds = h5py.Dataset(h5py.h5d.create(
+                group.id, name.encode("utf-8"),
+                h5py.h5t.py_create(layout.dtype),
+                h5py.h5s.create_simple(layout.shape), dcpl=dcpl))
+            tic = time.perf_counter()
+            for first_frame, source, _ in sources:
+                offsets = []
+                source.id.chunk_iter(lambda info: offsets.append(
+                    info.chunk_offset))
+                for offset in offsets:
+                    mask, data = source.id.read_direct_chunk(offset)
+                    ds.id.write_direct_chunk(
+                        (offset[0] + first_frame, *offset[1:]), data, mask)
+        nbytes = ds.id.get_storage_size()
+        elapsed = time.perf_counter() - tic
+        logger.info(' %s: copied %.1f MB of stored chunks in %.2f s '
+                    '(%.1f MB/s)', path, nbytes / 2**20, elapsed,
+                    nbytes / 2**20 / max(elapsed, 1e-9))
         return ds
 
+    def _write_chunks(self, ds, slab, start, encoder, pool):
+        """Compress the chunks of a slab in a pool and write them directly.
+
+        HDF5 runs the filters of a dataset on the writing thread only, so
+        the chunks are encoded by ``encoder`` (see
+        :func:`~nxptycho.filters.chunk_encoder`) in the threads of ``pool``
+        and stored with ``write_direct_chunk``. Chunks at the end of the
+        dataset are padded with zeros, like HDF5 does.
+
+        :return *bool*: ``False`` if the slab does not cover whole chunks,
+                        the caller then writes it through HDF5
+        """
+        chunks = ds.chunks
+        stop = start + len(slab)
+        if start % chunks[0] or (stop % chunks[0] and stop != ds.shape[0]):
+            return False
+
+        def encode(offset):
+            index = tuple(slice(o - s, o - s + c) for o, s, c in
+                          zip(offset, (start, *[0] * (ds.ndim - 1)), chunks))
+            block = slab[index]
+            if block.shape != chunks:
+                padded = np.zeros(chunks, dtype=ds.dtype)
+                padded[tuple(slice(0, n) for n in block.shape)] = block
+                block = padded
+            return encoder(np.ascontiguousarray(block, ds.dtype).tobytes())
+
+        offsets = list(itertools.product(
+            range(start, stop, chunks[0]),
+            *(range(0, n, c) for n, c in zip(ds.shape[1:], chunks[1:]))))
+        for offset, data in zip(offsets, pool.map(encode, offsets)):
+            ds.id.write_direct_chunk(offset, data)
+        return True
+
+    def _sparse_dataset(self, group, name, source, shape, dtype,
+                        filters=None, transform=None, statistics=None):
+        """Copy the nonzero pixels of ``source`` into sparse fields.
+
+        Writes the index, value and offset fields of :mod:`nxptycho.sparse`
+        slab by slab, replacing any dense or partial copy.
+
+        :return *h5py.Dataset*: the value field
+        """
+        for field in (name, *sparse_names(name)):
+            if field in group:
+                del group[field]
+        indices_name, values_name, offsets_name = sparse_names(name)
+        profile = resolve_profile(filters)
+        indices = group.create_dataset(indices_name, shape=(0, ),
+                                       dtype=np.uint32, maxshape=(None, ),
+                                       chunks=(SPARSE_CHUNK, ), **profile)
+        values = group.create_dataset(values_name, shape=(0, ), dtype=dtype,
+                                      maxshape=(None, ),
+                                      chunks=(SPARSE_CHUNK, ), **profile)
+        offsets = group.create_dataset(offsets_name, shape=(shape[0] + 1, ),
+                                       dtype=np.int64)
+        offsets.attrs["frame_shape"] = shape[1:]
+        slab_frames = self._slab_frames(source.shape, source.dtype)
+        nnz = 0
+        tic = time.perf_counter()
+        for start, stop, slab in self._iter_slabs(source, slab_frames):
+            if transform is not None:
+                slab = transform(slab)
+            if statistics is not None:
+                statistics.update(start, slab)
+            counts, slab_indices, slab_values = sparsify(slab)
+            end = nnz + len(slab_indices)
+            for ds, data in ((indices, slab_indices), (values, slab_values)):
+                ds.resize((end, ))
+                ds[nnz:end] = data
+            offsets[start + 1:stop + 1] = nnz + np.cumsum(counts)
+            nnz = end
+        elapsed = time.perf_counter() - tic
+        logger.info(
+            ' %s: copied %d frames as %d nonzero pixels (%.1f%%) in %.2f s',
+            posixpath.join(group.name, name), shape[0], nnz,
+            100 * nnz / max(int(np.prod(shape, dtype=np.int64)), 1), elapsed)
+        return values
+
+    def _source_path(self, filename):
+        """Path of a source file relative to the output file's directory.
+
+        HDF5 resolves relative external link and virtual dataset file names
+        against the directory of the linking file, so converted files stay
+        valid when moved together with their sources.
+        """
+        output_dir = os.path.dirname(os.path.abspath(self._output_filename))
+        return os.path.relpath(os.path.abspath(filename), output_dir)
+
+    def link_dataset(self, dataset: h5py.Dataset, index=np.s_[...]):
+        """Return a VirtualLayout referencing ``dataset[index]`` in place.
+
+        Passing the layout as value to any of the create methods writes a
+        virtual dataset instead of copying the data, so the frames stay in
+        the source file while the NeXus file can still carry attributes
+        such as units.
+
+        :param dataset: dataset of the source file
+        :param index: selection of the dataset, e.g. a column of positions
+        :return *h5py.VirtualLayout*:
+        """
+        tic = time.perf_counter()
+        source = h5py.VirtualSource(self._source_path(dataset.file.filename),
+                                    dataset.name,
+                                    shape=dataset.shape,
+                                    dtype=dataset.dtype)[index]
+        layout = h5py.VirtualLayout(shape=source.shape, dtype=dataset.dtype)
+        layout[...] = source
+        self._notify("link", dataset.name, tic,
+                     file=self._source_path(dataset.file.filename))
+        return layout
+
     def _check_unit(self, group, name, expected, supplied):
         """
         Return ``True`` if conversion is possible between expected and supplied units.
@@ -138,36 +861,37 @@ class NXCreator:
         """
 
         # catch arbitrary unit separately from pint --> point that out in documentation
-        if supplied in ['au', 'a.u.', 'a.u']:
+        if supplied in ARBITRARY_UNITS:
             logger.info(
                 "Arbitrary units supplied for '%s' in form of '%s' no unit conversion or "
                 "pint unit check applicable", name, supplied)
             return True
+        tic = time.perf_counter()
+        result = check_units(supplied, expected)
+        self._notify("unit_check", posixpath.join(group.name, name), tic,
+                     supplied=supplied, expected=expected,
+                     valid=result.valid)
+        if result.valid:
+            logger.info(' %s/%s: units [%s] added', group.name, name,
+                        supplied)
+            return True
+        if result.error is not None:
+            logger.warning(' %s --> units for %s/%s not written', result.error,
+                           group.name, name)
         else:
-            ureg = pint.UnitRegistry()
-            try:
-                user = 1.0 * ureg(supplied)
-            except pint.UndefinedUnitError as err:
-                logger.warning(' %s --> units for %s/%s not written', err,
-                               group.name, name)
-                return False
-            if user.check(expected):
-                logger.info(' %s/%s: units [%s] added', group.name, name,
-                            supplied)
-                return True
-            else:
-                logger.warning(
-                    ' Supplied unit [%s] for %s/%s does not match expected units [%s]',
-                    supplied, group.name, name, expected)
-                return False
+            logger.warning(
+                ' Supplied unit [%s] for %s/%s does not match expected units [%s]',
+                supplied, group.name, name, expected)
+        return False
 
     def _create_data_with_unit(self, group, name, value, expected,
-                               supplied) -> object:
+                               supplied, **kwargs) -> object:
 
         if self._check_unit(group, name, expected, supplied):
-            return self._create_dataset(group, name, value, units=supplied)
+            return self._create_dataset(group, name, value, units=supplied,
+                                        **kwargs)
         else:
-            return self._create_dataset(group, name, value)
+            return self._create_dataset(group, name, value, **kwargs)
 
     def create_entry_group(self,
                            definition: str = NX_APP_DEF_NAME,
@@ -192,7 +916,8 @@ class NXCreator:
         entry_group = self._init_group(self.file_handle, entry_name, "NXentry")
         self.entry_group_name = entry_group.name
 
-        entry_group.create_dataset("definition", data=definition)
+        if "definition" not in entry_group:
+            entry_group.create_dataset("definition", data=definition)
         if experiment_description is not None:
             experiment_description = experiment_description
         else:
@@ -208,6 +933,25 @@ class NXCreator:
 
         return entry_group
 
+    def create_entry_link(self, filename: str, entry_index: int = None):
+        """Link an entry written to another NeXus file into this file.
+
+        Used to stitch shard files holding one entry each into a master file.
+
+        :param filename: NeXus file holding the entry
+        :param entry_index: index number of the entry, see create_entry_group
+        :return entry_name
+        """
+        if entry_index is None:
+            entry_name = "entry"
+        else:
+            entry_name = f"entry_{entry_index}"
+        self.file_handle[entry_name] = h5py.ExternalLink(
+            self._source_path(filename), f"/{entry_name}")
+        if "default" not in self.file_handle.attrs:
+            self.file_handle.attrs["default"] = entry_name
+        return entry_name
+
     def create_instrument_group(self,
                                 h5parent: h5py.Group,
                                 name: str,
@@ -304,6 +1048,10 @@ class NXCreator:
                               y_pixel_size: float,
                               pixel_size_units: str,
                               detector_index: int = None,
+                              compression: str = None,
+                              count_range: tuple = None,
+                              materialize: bool = False,
+                              data_average: np.ndarray = None,
                               *args,
                               **kwargs):
         """
@@ -315,7 +1063,28 @@ class NXCreator:
         :param x_pixel_size pixel size of the detector in horizontal direction
         :param y_pixel_size pixel size of the detector in vertical direction
         :param detector_index: index number of the detector that created the data
+        :param compression: filter profile of the data, overrides the
+                            creator's 'data' filter profile
+        :param count_range: ``(min, max)`` of the valid counts, e.g. from the
+                            detector's count cutoff, spares the scan of the
+                            data when the creator narrows its dtype
+        :param materialize: copy the stored chunks of data given as
+                            VirtualLayout instead of referencing them
+        :param data_average: average frame of the input, e.g. the cxi 'Data
+                             Average', written if the frames are stored
+                             unchanged and no statistics are recorded
         :param args:
+
+        The creator's preprocessing is applied to the data, the pixel sizes
+        are scaled by its binning and the operations are recorded in the
+        NXprocess group 'preprocessing' of the entry. Creators with
+        ``narrow_dtype`` then store the data in the narrowest lossless integer
+        type, see :class:`~nxptycho.narrowing.Narrowing`, creators with a
+        ``sparse_threshold`` store sparse frames as nonzero pixels, see
+        :mod:`nxptycho.sparse`, creators with a ``chunk_profile`` chunk copied
+        data for that access pattern, see :mod:`nxptycho.chunking`. Creators
+        with ``frame_statistics`` record the statistics of the stored frames,
+        see :meth:`_write_frame_statistics`.
         :param kwargs:
         :return:
         """
@@ -332,6 +1101,27 @@ class NXCreator:
             "NXdetector")
         self.detector_group_name = self.detector_group.name
 
+        preprocess = self.preprocess
+        if preprocess is not None and data is not None:
+            preprocess.check_frame_shape(data.shape[1:])
+            if preprocess.bin > 1:
+                x_pixel_size = x_pixel_size * preprocess.bin
+                y_pixel_size = y_pixel_size * preprocess.bin
+        transform = preprocess
+        if self.narrow_dtype and data is not None:
+            transform = Narrowing(count_range=count_range,
+                                  transform=preprocess)
+        statistics = None
+        if self.frame_statistics and data is not None:
+            if count_range is not None:
+                saturation_value = count_range[1] + 1
+            elif isinstance(transform, Narrowing):
+                # known once the counts are scanned
+                saturation_value = transform.saturation_value
+            else:
+                saturation_value = overflow_marker
+            statistics = FrameStatistics(data.shape[0], saturation_value)
+
         self._create_data_with_unit(self.detector_group,
                                     "distance",
                                     distance,
@@ -347,14 +1137,110 @@ class NXCreator:
                                     y_pixel_size,
                                     expected='m',
                                     supplied=pixel_size_units)
-        self._create_data_with_unit(self.detector_group,
-                                    "data",
-                                    data,
-                                    expected='counts',
-                                    supplied=data_units)
+        ds = self._create_data_with_unit(self.detector_group,
+                                         "data",
+                                         data,
+                                         expected='counts',
+                                         supplied=data_units,
+                                         filters=compression
+                                         or self.filters.get('data'),
+                                         transform=transform,
+                                         sparse_threshold=self.sparse_threshold,
+                                         materialize=materialize,
+                                         auto_chunk=self.chunk_profile
+                                         or False,
+                                         statistics=statistics)
+        if isinstance(transform, Narrowing) and ds is not None:
+            for key, value in transform.attributes().items():
+                ds.attrs[key] = value
+        if statistics is not None and ds is not None:
+            self._write_frame_statistics(statistics, data_units)
+        elif data_average is not None and data is not None:
+            if (preprocess is not None
+                    or tuple(data_average.shape) != tuple(data.shape[1:])):
+                logger.warning(' %s: data_average does not match the stored '
+                               'frames, skipped', self.detector_group_name)
+            else:
+                self._create_data_with_unit(self.detector_group,
+                                            "data_average",
+                                            data_average,
+                                            expected='counts',
+                                            supplied=data_units)
+                self._link_frame_statistics()
+        if preprocess is not None and data is not None:
+            self.create_process_group(
+                self.file_handle[self.entry_group_name],
+                name="preprocessing",
+                parameters=preprocess.parameters(),
+                note=f"{' -> '.join(preprocess.operations)} applied to "
+                     f"{self.detector_group_name}/data during conversion")
 
         return self.detector_group
 
+    def _write_frame_statistics(self, statistics, units):
+        """Write the statistics of the detector data and link them to NXdata.
+
+        Data that was not copied (referenced frames or frames written by an
+        interrupted conversion) is read for them.
+        HDF5 opens the sources of virtual data for writing, which fails for
+        files the caller holds open read-only; the statistics are then
+        skipped with a warning.
+        """
+        detector = self.detector_group
+        done, total = self._committed(
+            posixpath.join(detector.name, "data_average")) or (0, None)
+        if not statistics.complete and done != total:
+            logger.info(' %s/data: frames were not copied, reading them '
+                        'for the frame statistics',
+                        detector.name)
+            statistics = FrameStatistics(statistics.nframes,
+                                         statistics.saturation_value)
+            frames = open_frames(detector)
+            try:
+                for start, _, slab in self._iter_slabs(
+                        frames, self._slab_frames(frames.shape, frames.dtype)):
+                    statistics.update(start, slab)
+            except OSError as error:
+                logger.warning(' %s/data: frames cannot be read, frame '
+                               'statistics skipped: %s', detector.name, error)
+                return
+        results = statistics.results()
+        for name, value in results.items():
+            if name == "saturated_pixels":
+                self._create_dataset(detector, name, value)
+            else:
+                self._create_data_with_unit(detector, name, value,
+                                            expected='counts',
+                                            supplied=units)
+        if "saturated_pixels" in results:
+            self._create_data_with_unit(detector, "saturation_value",
+                                        statistics.saturation_value,
+                                        expected='counts', supplied=units)
+        self._link_frame_statistics()
+
+    def _link_frame_statistics(self):
+        """Link the detector's statistics into NXdata groups of the entry.
+
+        ``frame_statistics`` plots the total counts per frame, with maxima
+        and saturated pixels as auxiliary signals, ``data_average`` the
+        average frame.
+        """
+        detector = self.detector_group
+        entry = self.file_handle[self.entry_group_name]
+        fields = [name for name in STATISTICS_FIELDS if name in detector]
+        if fields:
+            group = self._init_group(entry, "frame_statistics", "NXdata")
+            for name in fields:
+                self._create_dataset(group, name, detector[name])
+            group.attrs["signal"] = fields[0]
+            if fields[1:]:
+                group.attrs["auxiliary_signals"] = fields[1:]
+        if "data_average" in detector:
+            group = self._init_group(entry, "data_average", "NXdata")
+            self._create_dataset(group, "data_average",
+                                 detector["data_average"])
+            group.attrs["signal"] = "data_average"
+
     def create_sample_group(self, h5parent):
         """Write a NXsample group.
 
@@ -371,6 +1257,7 @@ class NXCreator:
         target_value: float = None,
         positioner_index: int = None,
         units: str = "",
+        resizable: bool = False,
     ):
         """
         Write positioner groups
@@ -380,6 +1267,8 @@ class NXCreator:
         :param raw_value: raw values, e.g. encoder values, of the positions
         :param target_value: target values, i.e. as commanded, of the positions
         :param positioner_index: index number for the postioner
+        :param resizable: create the values resizable along the first axis,
+                          so that they can be extended while a scan runs
         :return:
         """
         if positioner_index is None:
@@ -398,6 +1287,8 @@ class NXCreator:
                 group=self.positioner_group,
                 name='raw_value',
                 value=raw_value,
+                filters=self.filters.get('raw_value'),
+                maxshape=(None, ) if resizable else None,
                 units=units,
             )
         if target_value is not None:
@@ -405,6 +1296,8 @@ class NXCreator:
                 group=self.positioner_group,
                 name='target_value',
                 value=target_value,
+                filters=self.filters.get('raw_value'),
+                maxshape=(None, ) if resizable else None,
                 units=units,
             )
         return self.positioner_group
@@ -475,7 +1368,8 @@ class NXCreator:
                                            name=axis_name,
                                            value=value,
                                            expected=expected_units,
-                                           supplied=units)
+                                           supplied=units,
+                                           filters=self.filters.get('axis'))
 
         axis.attrs['transformation_type'] = transformation_type
         axis.attrs['vector'] = vector
@@ -505,40 +1399,59 @@ class NXCreator:
         # TODO: will need to get and add data
         pass
 
-    def create_process_group(
-        self,
-        hdf5filename,
-        entrygroup="/entry",
-        nm=None,  # name of process group
-        md=None,
-    ):
-        """Add a new NXprocess group to an existing HDF5 file."""
-        # TODO: will need to get and add data
-        nxclass = "NXprocess"
-        if os.path.exists(hdf5filename):
-            with h5py.File(hdf5filename, "a") as root:
-                group = root[entrygroup]
-                if nm is None:
-                    nm = (f"process_{1+self.count_subgroups(group, nxclass)}")
-                logger.debug(
-                    "Adding NXprocess group '%s' to '%s' in file %s",
-                    nm,
-                    group.name,
-                    hdf5filename,
-                )
-                self.create_process_group(group, nm, current_entry=1, md=md)
+    def create_process_group(self,
+                             h5parent: h5py.Group,
+                             name: str = None,
+                             program: str = "nxptycho",
+                             parameters: dict = None,
+                             note: str = None):
+        """Write a NXprocess group documenting an operation on the data.
+
+        see: https://manual.nexusformat.org/classes/base_classes/NXprocess.html
+
+        :param h5parent: h5 parent group in this case the entry group
+        :param name: group name, defaults to process_<n>
+        :param program: name of the program that processed the data
+        :param parameters: parameters of the process, written as fields of a
+                           NXparameters group
+        :param note: description of the process
+        :return process_group:
+        """
+        sequence_index = 1 + self.count_subgroups(h5parent, "NXprocess")
+        if name is None:
+            name = f"process_{sequence_index}"
+        elif name in h5parent:
+            sequence_index -= 1  # rewritten by a resumed conversion
+        logger.debug("Adding NXprocess group '%s' to '%s'", name,
+                     h5parent.name)
+        process_group = self._init_group(h5parent, name, "NXprocess")
+        self._create_dataset(process_group, "program", program)
+        self._create_dataset(process_group, "sequence_index", sequence_index)
+        self._create_dataset(
+            process_group, "date",
+            datetime.datetime.now().isoformat(sep=" ", timespec="seconds"))
+        if parameters:
+            parameters_group = self._init_group(process_group, "parameters",
+                                                "NXparameters")
+            for key, value in parameters.items():
+                self._create_dataset(parameters_group, key, value)
+        if note is not None:
+            note_group = self._init_group(process_group, "note", "NXnote")
+            self._create_dataset(note_group, "type", "text/plain")
+            self._create_dataset(note_group, "data", note)
+        return process_group
 
     def count_subgroups(self, h5parent, nxclass):
         """Count the number of subgroups of a specific NX_class.
 
         :param h5parent: h5 parent group
+        :param nxclass: NX_class of the counted subgroups
         """
         count = 0
         for key in h5parent.keys():
             obj = h5parent[key]
             if not isinstance(obj, h5py.Group):
                 continue
-            nxclass = obj.attrs.get("NX_class")
-            if nxclass == "NXprocess":
+            if obj.attrs.get("NX_class") == nxclass:
                 count += 1
         return count
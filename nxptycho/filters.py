@@ -0,0 +1,213 @@
+"""Named HDF5 filter profiles for the large datasets written by NXCreator.
+
+A profile is a short name such as ``"shuffle-gzip-4"`` that resolves to the
+keyword arguments of :meth:`h5py.Group.create_dataset`. Profiles based on
+registered HDF5 plugin filters (bitshuffle, blosc, zstd, lz4) are only
+available when the filter is registered with HDF5, e.g. by installing the
+optional ``hdf5plugin`` package.
+"""
+import logging
+import zlib
+
+import h5py
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# NXCreator dataset roles that can be given their own profile
+FILTER_ROLES = ("data", "raw_value", "axis")
+
+BUILTIN_PROFILES = {
+    "none": {},
+    "lzf": dict(compression="lzf"),
+    "shuffle-lzf": dict(compression="lzf", shuffle=True),
+}
+for _level in (1, 4, 9):
+    BUILTIN_PROFILES[f"gzip-{_level}"] = dict(compression="gzip",
+                                              compression_opts=_level)
+    BUILTIN_PROFILES[f"shuffle-gzip-{_level}"] = dict(compression="gzip",
+                                                      compression_opts=_level,
+                                                      shuffle=True)
+
+# registered filter id and its cd_values, see
+# https://portal.hdfgroup.org/display/support/Registered+Filter+Plugins
+PLUGIN_PROFILES = {
+    "bitshuffle-lz4": (32008, (0, 2)),
+    "blosc-lz4": (32001, (0, 0, 0, 0, 5, 1, 1)),
+    "zstd": (32015, (3, )),
+    "lz4": (32004, (0, )),
+}
+
+
+def _register_plugins():
+    """Import hdf5plugin if installed so that its filters get registered."""
+    try:
+        import hdf5plugin  # noqa: F401
+    except ImportError:
+        logger.debug("hdf5plugin is not installed")
+
+
+def plugin_available(filter_id: int) -> bool:
+    """Return ``True`` if the HDF5 filter is registered."""
+    if not h5py.h5z.filter_avail(filter_id):
+        _register_plugins()
+    return bool(h5py.h5z.filter_avail(filter_id))
+
+
+def available_profiles():
+    """Return the names of all profiles usable in this environment."""
+    names = list(BUILTIN_PROFILES)
+    names += [
+        name for name, (filter_id, _) in PLUGIN_PROFILES.items()
+        if plugin_available(filter_id)
+    ]
+    return names
+
+
+def resolve_profile(profile: str) -> dict:
+    """Return the create_dataset keyword arguments of a filter profile.
+
+    :param profile: profile name, ``None`` is the same as ``"none"``
+    :return *dict*: compression, compression_opts and shuffle arguments
+    :raises ValueError: if the profile is unknown or its plugin filter is not
+                        registered with HDF5
+    """
+    if profile is None:
+        return {}
+    if profile in BUILTIN_PROFILES:
+        return dict(BUILTIN_PROFILES[profile])
+    if profile in PLUGIN_PROFILES:
+        filter_id, cd_values = PLUGIN_PROFILES[profile]
+        if not plugin_available(filter_id):
+            raise ValueError(
+                f"HDF5 filter {filter_id} for profile '{profile}' is not "
+                "registered, install hdf5plugin to use it")
+        return dict(compression=filter_id, compression_opts=cd_values)
+    raise ValueError(f"Unknown filter profile '{profile}', choose one of "
+                     f"{', '.join(list(BUILTIN_PROFILES) + list(PLUGIN_PROFILES))}")
+
+
+def filter_pipeline(dataset):
+    """Return ``(filter id, client values)`` of every filter of a dataset."""
+    plist = dataset.id.get_create_plist()
+    return [plist.get_filter(n)[::2] for n in range(plist.get_nfilters())]
+
+
+def profile_matches(profile: str, dataset) -> bool:
+    """Return ``True`` if dataset is stored with the filters of profile.
+
+    Filters are compared by id and, for gzip, compression level; plugins
+    add their own client values when a dataset is created, so these are not
+    compared.
+    """
+    kwargs = resolve_profile(profile)
+    expected = []
+    if kwargs.get("shuffle"):
+        expected.append((h5py.h5z.FILTER_SHUFFLE, None))
+    compression = kwargs.get("compression")
+    if compression == "gzip":
+        expected.append((h5py.h5z.FILTER_DEFLATE,
+                         (kwargs.get("compression_opts", 4), )))
+    elif compression == "lzf":
+        expected.append((h5py.h5z.FILTER_LZF, None))
+    elif compression is not None:
+        expected.append((compression, None))
+    actual = filter_pipeline(dataset)
+    return len(actual) == len(expected) and all(
+        code == expected_code
+        and (values is None or tuple(cd_values[:len(values)]) == values)
+        for (code, cd_values), (expected_code, values) in zip(actual,
+                                                              expected))
+
+
+def _shuffle(data, itemsize):
+    """Byte shuffle of HDF5's shuffle filter (H5Z_FILTER_SHUFFLE)."""
+    if itemsize == 1:
+        return data
+    whole = len(data) // itemsize * itemsize
+    shuffled = np.frombuffer(data, np.uint8, whole).reshape(-1, itemsize).T
+    return shuffled.tobytes() + data[whole:]
+
+
+def _zstd_encoder(level):
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    # compressor objects must not be shared between threads
+    return lambda data: zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def chunk_encoder(profile: str, dtype):
+    """Return a function encoding a chunk like the HDF5 filters of profile.
+
+    The encoded bytes can be written with ``write_direct_chunk`` and are
+    decoded by the HDF5 filter pipeline of any reader. The encoders release
+    the GIL, so chunks can be compressed in a thread pool.
+
+    :param profile: filter profile name
+    :param dtype: dtype of the dataset
+    :return *callable*: chunk bytes to stored bytes, ``None`` if the profile
+                        has no Python encoder, e.g. lzf and most plugins
+    """
+    kwargs = resolve_profile(profile)
+    compression = kwargs.get("compression")
+    if compression == "gzip":
+        level = kwargs.get("compression_opts", 4)
+
+        def compress(data):
+            return zlib.compress(data, level)
+    elif compression == PLUGIN_PROFILES["zstd"][0]:
+        compress = _zstd_encoder(kwargs["compression_opts"][0])
+        if compress is None:
+            return None
+    else:
+        return None
+    if not kwargs.get("shuffle"):
+        return compress
+    itemsize = np.dtype(dtype).itemsize
+    return lambda data: compress(_shuffle(data, itemsize))
+
+
+def add_compression_workers_argument(parser):
+    """Add the ``--compression-workers`` option to an argparse parser."""
+    parser.add_argument(
+        "--compression-workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="compress the chunks of the detector data in N threads "
+             "(gzip profiles, zstd with the zstandard package)",
+    )
+
+
+def add_filter_arguments(parser):
+    """Add the per-role filter profile options to an argparse parser."""
+    choices = list(BUILTIN_PROFILES) + list(PLUGIN_PROFILES)
+    parser.add_argument(
+        "--compression",
+        choices=choices,
+        default=None,
+        help="filter profile of the detector data",
+    )
+    parser.add_argument(
+        "--positioner-compression",
+        choices=choices,
+        default=None,
+        help="filter profile of the positioner raw values",
+    )
+    parser.add_argument(
+        "--axis-compression",
+        choices=choices,
+        default=None,
+        help="filter profile of the transformation axes",
+    )
+
+
+def filters_from_options(options) -> dict:
+    """Map parsed command line options to NXCreator's ``filters`` argument."""
+    return dict(
+        data=options.compression,
+        raw_value=options.positioner_compression,
+        axis=options.axis_compression,
+    )
@@ -1,6 +1,6 @@
 # TODO
 # [ ] create loaders/parser for different ptycho input files at the different beamlines/facilities
-# [ ] test class to check which loader is appropriate
+# [x] test class to check which loader is appropriate --> see identify()
 # [ ] using projections to get keys
 # [ ] future work to make converter multi-directional using projection
 # [ ] write tests
@@ -10,8 +10,71 @@
 # [ ] load memory efficient
 # [-] fix classes --> load dictionary to GeneralLoader
 
+import collections
+import collections.abc
+import os
+
 import h5py
-import dask
+
+# cxi paths relative to entry_N of the fields needed for the NeXus file
+CXI_FIELDS = dict(
+    # Beam/Source fields
+    source_name='instrument_1/source_1/name',  # Lightsource Name
+    instrument_name='instrument_1/name',  # beamline name
+    energy='instrument_1/source_1/energy',
+    # data_illumination_key = 'instrument_1/source_1/data_illumination'
+    # probe_key = 'instrument_1/source_1/probe'
+    # probe_mask_key = 'instrument_1/source_1/probe_mask'
+    # Detector fields
+    data='instrument_1/detector_1/data',
+    data_average='instrument_1/detector_1/Data Average',
+    x_pixel_size='instrument_1/detector_1/x_pixel_size',
+    y_pixel_size='instrument_1/detector_1/y_pixel_size',
+    distance='instrument_1/detector_1/distance',
+    translation='instrument_1/detector_1/translation',
+)
+SMALL_DATASET_BYTES = 2**20  # datasets up to this size are read into memory
+# fields read into memory whatever their size, they are sliced per column
+IN_MEMORY_FIELDS = ('translation', )
+
+
+class CXIEntry(collections.abc.Mapping):
+    """
+    Lazy view of one entry of a cxi file
+    - every path is resolved at most once, on first access
+    - small datasets (scalars, strings) and the translations are read once and the values are
+      shared between all accesses, large ones (the frames) are returned as lazy h5py datasets
+    """
+    def __init__(self, data_file, entry_number, fields=CXI_FIELDS):
+        self.group = data_file.get(f'entry_{entry_number}')
+        self.fields = fields
+        self._datasets = {}
+        self._values = {}
+
+    def dataset(self, key):
+        """Return the h5py object of a field, ``None`` if it is missing."""
+        if key not in self._datasets:
+            path = self.fields[key]
+            self._datasets[key] = None if self.group is None else self.group.get(path)
+        return self._datasets[key]
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            value = self.dataset(key)
+            if isinstance(value, h5py.Dataset) and (
+                    key in IN_MEMORY_FIELDS
+                    or value.nbytes <= SMALL_DATASET_BYTES):
+                value = value[()]
+                if isinstance(value, bytes):
+                    value = value.decode('utf-8')
+            self._values[key] = value
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
 
 
 class CXILoader():
@@ -20,9 +83,22 @@ class CXILoader():
     - init a dictionary containing the path structure of the cxi file that should be converted
     - optional: add further special methods for extracting data special to cxi
     """
+    key_dict = {f'{key}_key': path for key, path in CXI_FIELDS.items()}
+
     def __init__(self, input_file):
         self.data_file = h5py.File(input_file, 'r')
+        self._entries = {}
         # TODO create key dictionary --> to be passed in GeneralLoader
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.data_file.close()
+
     # def prepare_diff_data(self, entry_number, chunk_size):
     #     diff_data = self.data_file.get(f'entry_{entry_number}/data_1/data')
     #     number_of_chunks = 1+diff_data.shape[0]//chunk_size
@@ -33,26 +109,10 @@ class CXILoader():
     #             chunk = diff_data[n*chunk_size+1:(n+1)*chunk_size,:,:]
 
     def data_dict(self, entry_number):
-        cxi_dict = dict(
-            ### Beam/Source fields
-            source_name=self.data_file.get(f'entry_{entry_number}/instrument_1/source_1/name'),
-            energy=self.data_file.get(f'entry_{entry_number}/instrument_1/source_1/energy'),
-            # data_illumination_key = 'instrument_1/source_1/data_illumination'
-            # probe_key = 'instrument_1/source_1/probe'
-            # probe_mask_key = 'instrument_1/source_1/probe_mask'
-            # source_name_key = 'entry_1/instrument_1/source_1/name' # Lightsource Name
-            # instrument_name_key = 'entry_1/instrument_1/name' # beamline name
-            ### Detector fields
-            data=self.data_file.get(f'entry_{entry_number}/instrument_1/detector_1/data'),
-            x_pixel_size=self.data_file.get(f'entry_{entry_number}/instrument_1/detector_1/x_pixel_size'),
-            y_pixel_size=self.data_file.get(f'entry_{entry_number}/instrument_1/detector_1/y_pixel_size'),
-            distance=self.data_file.get(f'entry_{entry_number}/instrument_1/detector_1/distance'),
-            translation=self.data_file.get(f'entry_{entry_number}/instrument_1/detector_1/translation'),
-            # self.data_avg_key = 'instrument_1/detector_1/Data Average'
-            ### Data (plottable data?) fields
-
-        )
-        return cxi_dict
+        """Return the cached lazy view of an entry, see CXIEntry."""
+        if entry_number not in self._entries:
+            self._entries[entry_number] = CXIEntry(self.data_file, entry_number)
+        return self._entries[entry_number]
 
 
 class HDF_loader():
@@ -63,6 +123,83 @@ class ptyd_loader():
     ...
 
 
+LoaderSpec = collections.namedtuple('LoaderSpec', ['name', 'probe', 'loader'])
+"""A registered input format: its name, a probe ``probe(h5file) -> bool`` and
+the loader class opening it (``None`` if it is converted without a loader)."""
+
+LOADERS = []  # registered formats in the order they are probed
+_probe_cache = {}  # (path, size, mtime) -> format name
+
+
+def register_loader(name, probe, loader=None, first=False):
+    """
+    Register an input format.
+
+    Probes get the input opened with h5py and must stay cheap: only look at root attributes and a
+    few key paths, never read data and never import optional dependencies.
+    :param name: format name
+    :param probe: callable returning ``True`` if the opened file has this format
+    :param loader: loader class of the format
+    :param first: probe this format before all registered ones
+    """
+    spec = LoaderSpec(name, probe, loader)
+    if first:
+        LOADERS.insert(0, spec)
+    else:
+        LOADERS.append(spec)
+    _probe_cache.clear()
+
+
+def identify(path):
+    """
+    Return the name of the format of an input file, ``None`` if no probe matches.
+
+    The file is opened once for all probes and the result is cached per path, size and modification
+    time, so batch jobs can dispatch many files without reopening them.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _probe_cache:
+        name = None
+        if h5py.is_hdf5(path):
+            with h5py.File(path, 'r') as f:
+                name = next((spec.name for spec in LOADERS if spec.probe(f)), None)
+        _probe_cache[key] = name
+    return _probe_cache[key]
+
+
+def open_loader(path):
+    """Identify an input file and open it with the loader of its format."""
+    name = identify(path)
+    spec = next((spec for spec in LOADERS if spec.name == name), None)
+    if spec is None or spec.loader is None:
+        raise ValueError(f'No loader for {path} (format: {name})')
+    return spec.loader(path)
+
+
+def _probe_cxi(f):
+    return 'cxi_version' in f or 'entry_1/instrument_1/detector_1' in f
+
+
+def _probe_velociprobe(f):
+    # Eiger NXmx master files link their data files as /entry/data/data_NNNNNN
+    data = f.get('entry/data', getclass=True)
+    return (data is h5py.Group and 'entry/instrument/detector' in f
+            and any(name.startswith('data_') for name in f['entry/data']))
+
+
+def _probe_ptyd(f):
+    return 'meta' in f and 'chunks' in f
+
+
+# ptyd has no loader yet. There is no generic HDF5 format: a probe matching
+# every HDF5 file would claim files of unknown layout, which identify() reports
+# as None and open_loader() as unsupported instead.
+register_loader('cxi', _probe_cxi, CXILoader)
+register_loader('velociprobe', _probe_velociprobe)
+register_loader('ptyd', _probe_ptyd)
+
+
 #see https://goodcode.io/articles/python-dict-object/ for passing key_dict to class
 class GeneralLoader():
     """
@@ -79,17 +216,18 @@ class GeneralLoader():
         self.data = {}
         self.data_avg = {}
         self.path = path
-        self.key_dict = self.check_suffix(self.path).key_dict
+        self.loader = open_loader(self.path)
+        self.key_dict = self.loader.key_dict
         self.number_of_entries = None
 
-    def check_suffix(self, path):
-        if path.endswith('.cxi'):
-            return CXILoader()
-        elif path.endswith('hdf'):
-            print('hdf converter not yet implemented')
-        elif path.endswith('ptyd'):
-            print('ptyd converter not yet implemented')
-        #TODO add more checks
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.loader.close()
 
     def get_data(self, mode='single'):
         """
@@ -101,7 +239,7 @@ class GeneralLoader():
 
         """
 
-        self.file = h5py.File(self.path, 'r')
+        self.file = self.loader.data_file
         #TODO add multiple input modes, such as single file or folder etc.
         if mode == 'single':
             self.number_of_entries = len([entry for entry in self.file.keys() if 'entry' in entry])
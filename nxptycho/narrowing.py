@@ -0,0 +1,170 @@
+"""Store detector frames in the narrowest lossless integer type.
+
+Detector stacks often arrive as uint32 or float while the counts fit in
+uint16 or uint8. :class:`Narrowing` finds the count range, either from a
+precomputed range (e.g. the count cutoff of an Eiger) or by scanning the
+frames slab by slab before they are copied, and converts the frames to the
+narrowest integer type holding that range.
+
+Unsigned integer detectors mark overflowing and dead pixels with the
+largest value of their type (``2**32 - 1`` for uint32). These markers are
+excluded from the count range and written as the largest value of the
+narrow type, which is then recorded as ``overflow_value`` attribute of the
+data together with the ``original_dtype``.
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INTEGER_TYPES = (np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32,
+                 np.uint64, np.int64)
+
+
+def narrowest_dtype(minimum, maximum):
+    """Return the smallest integer dtype holding ``minimum..maximum``."""
+    for dtype in INTEGER_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= minimum and maximum <= info.max:
+            return np.dtype(dtype)
+    raise ValueError(f"No integer type holds {minimum}..{maximum}")
+
+
+class Narrowing:
+    """Transform converting frames into the narrowest lossless integer type.
+
+    Used as ``transform`` of :meth:`NXCreator._create_dataset`: the creator
+    calls :meth:`prepare` with the slabs of the source before the output
+    dataset is created, unless the count range is given.
+    """
+
+    def __init__(self, count_range=None, overflow_value=None, transform=None):
+        """
+        :param count_range: ``(min, max)`` of the valid counts, skips the scan
+        :param overflow_value: value marking overflowing pixels in the
+                               source, defaults to the largest value of
+                               unsigned integer sources
+        :param transform: transform applied before narrowing, e.g. a
+                          :class:`~nxptycho.preprocess.Preprocessing`
+        """
+        self.count_range = count_range
+        self.overflow_value = overflow_value
+        self.transform = transform
+        self.has_overflow = count_range is not None  # reserve the marker
+        self.integral = True
+        self.dtype = None  # narrow dtype, None to keep the source dtype
+        self.source_dtype = None
+
+    def _source_overflow(self, dtype):
+        if self.overflow_value is not None:
+            return self.overflow_value
+        if dtype.kind == "u":
+            return np.iinfo(dtype).max
+        return None
+
+    def output_shape(self, shape):
+        if self.transform is not None:
+            return self.transform.output_shape(shape)
+        return shape
+
+    def _inner_dtype(self, dtype):
+        if self.transform is not None:
+            return self.transform.output_dtype(dtype)
+        return np.dtype(dtype)
+
+    def prepare(self, slabs):
+        """Scan the slabs of the source for the range of the counts."""
+        if self.count_range is not None:
+            return
+        minimum, maximum = None, None
+        for _, _, slab in slabs:
+            if self.transform is not None:
+                slab = self.transform(slab)
+            overflow = self._source_overflow(slab.dtype)
+            if overflow is not None:
+                valid = slab != overflow
+                self.has_overflow |= not valid.all()
+                slab = slab[valid]
+            if slab.size == 0:
+                continue
+            if slab.dtype.kind == "f" and not np.all(np.mod(slab, 1) == 0):
+                self.integral = False
+                return
+            low, high = slab.min(), slab.max()
+            minimum = low if minimum is None else min(minimum, low)
+            maximum = high if maximum is None else max(maximum, high)
+        self.count_range = (0 if minimum is None else int(minimum),
+                            0 if maximum is None else int(maximum))
+
+    def output_dtype(self, dtype):
+        """Narrow dtype of frames of ``dtype``, see :meth:`prepare`."""
+        dtype = self._inner_dtype(dtype)
+        self.source_dtype = dtype
+        if not self.integral or dtype.kind not in "iuf":
+            logger.info(" Counts are not integers, kept as %s", dtype)
+            return dtype
+        minimum, maximum = self.count_range
+        if self.has_overflow:
+            maximum += 1  # the largest value marks overflows
+        narrow = narrowest_dtype(minimum, maximum)
+        if narrow.itemsize >= dtype.itemsize:
+            return dtype
+        self.dtype = narrow
+        logger.info(" Counts %d..%d stored as %s instead of %s",
+                    *self.count_range, narrow, dtype)
+        return narrow
+
+    def __call__(self, slab):
+        """Narrow a slab, counts above the count range become overflows.
+
+        :raises ValueError: if the slab has counts below the count range,
+                            which the narrow type may not hold
+        """
+        if self.transform is not None:
+            slab = self.transform(slab)
+        if self.dtype is None:
+            return slab
+        minimum, maximum = self.count_range
+        if slab.size and slab.min() < minimum:
+            raise ValueError(f"Counts below {minimum} cannot be stored as "
+                             f"{self.dtype}")
+        narrow = slab.astype(self.dtype)
+        if self.has_overflow:
+            # overflow markers and counts a given range did not expect
+            invalid = slab > maximum
+            overflow = self._source_overflow(slab.dtype)
+            if overflow is not None and overflow <= maximum:
+                invalid |= slab == overflow
+            narrow[invalid] = np.iinfo(self.dtype).max
+        return narrow
+
+    def saturation_value(self, dtype):
+        """Value marking overflows in the output frames of ``dtype``.
+
+        :return: the overflow marker, ``None`` if narrowed frames have none
+        """
+        if self.dtype is None:
+            return self._source_overflow(np.dtype(dtype))
+        if self.has_overflow:
+            return np.iinfo(self.dtype).max
+        return None
+
+    def attributes(self):
+        """Attributes of the narrowed data."""
+        if self.dtype is None:
+            return {}
+        attrs = dict(original_dtype=str(self.source_dtype))
+        if self.has_overflow:
+            attrs["overflow_value"] = np.iinfo(self.dtype).max
+        return attrs
+
+
+def add_narrow_dtype_argument(parser):
+    """Add the ``--narrow-dtype`` option to an argparse parser."""
+    parser.add_argument(
+        "--narrow-dtype",
+        action="store_true",
+        help="store the frames in the narrowest integer type holding their "
+             "counts, overflow markers become the largest value of that type",
+    )
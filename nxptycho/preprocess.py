@@ -0,0 +1,175 @@
+"""Frame preprocessing applied while the detector data is copied.
+
+:class:`Preprocessing` subtracts a dark frame, blanks masked pixels, crops
+and bins every slab of frames streamed by NXCreator, so the converted file
+holds the preprocessed frames without a second pass over the data. The
+operations and their parameters are recorded in an NXprocess group of the
+entry::
+
+    preprocess = Preprocessing(dark=dark, mask=mask, crop=(64, 576, 64, 576),
+                               bin=2)
+    with NXCreator("scan.nxs", preprocess=preprocess) as creator:
+        ...
+
+The operations are applied in that order: dark subtraction and masking on
+the full frame, then cropping and binning.
+"""
+import h5py
+import numpy as np
+
+PROCESS_NAME = "preprocessing"
+
+
+def load_array(spec):
+    """Load a frame sized array from ``file.npy`` or ``file.h5:/path``."""
+    if spec is None:
+        return None
+    if spec.endswith(".npy"):
+        return np.load(spec)
+    filename, _, path = spec.rpartition(":")
+    if not filename:
+        raise ValueError(f"Give '{spec}' as file.npy or file.h5:/path")
+    with h5py.File(filename, "r") as f:
+        return f[path][()]
+
+
+def add_preprocess_arguments(parser):
+    """Add the preprocessing options to an argparse parser."""
+    parser.add_argument(
+        "--dark",
+        metavar="FILE",
+        help="dark frame subtracted from every frame, as file.npy or "
+             "file.h5:/path",
+    )
+    parser.add_argument(
+        "--mask",
+        metavar="FILE",
+        help="pixel mask, nonzero pixels are set to zero, as file.npy or "
+             "file.h5:/path",
+    )
+    parser.add_argument(
+        "--crop",
+        type=int,
+        nargs=4,
+        metavar=("Y0", "Y1", "X0", "X1"),
+        help="keep rows Y0:Y1 and columns X0:X1 of every frame",
+    )
+    parser.add_argument(
+        "--bin",
+        type=int,
+        default=1,
+        help="sum BIN x BIN pixels into one",
+    )
+
+
+def preprocess_from_options(options):
+    """Return the Preprocessing of the parsed options, ``None`` if unused."""
+    preprocess = Preprocessing(dark=load_array(options.dark),
+                               mask=load_array(options.mask),
+                               crop=options.crop,
+                               bin=options.bin)
+    return preprocess if preprocess.operations else None
+
+
+class Preprocessing:
+    """Dark subtraction, masking, cropping and binning of frame stacks.
+
+    Instances are callables mapping a slab of frames ``(n, y, x)`` to the
+    preprocessed slab, see :meth:`output_shape` and :meth:`output_dtype` for
+    its shape and dtype.
+    """
+
+    def __init__(self, dark=None, mask=None, crop=None, bin=1,
+                 mask_value=0):
+        """
+        :param dark: dark frame subtracted from every frame
+        :param mask: pixel mask, nonzero marks bad pixels
+        :param crop: ``(y0, y1, x0, x1)`` region kept of every frame
+        :param bin: number of pixels summed along each axis, trailing rows
+                    and columns that do not fill a bin are dropped
+        :param mask_value: value of masked pixels
+        """
+        if bin < 1:
+            raise ValueError(f"Binning factor must be positive, got {bin}")
+        self.dark = None if dark is None else np.asarray(dark)
+        self.mask = None if mask is None else np.asarray(mask) != 0
+        self.crop = None if crop is None else tuple(int(c) for c in crop)
+        self.bin = int(bin)
+        self.mask_value = mask_value
+
+    @property
+    def operations(self):
+        """Names of the operations applied, in order."""
+        return [
+            name for name, used in (
+                ("dark_subtraction", self.dark is not None),
+                ("mask", self.mask is not None),
+                ("crop", self.crop is not None),
+                ("bin", self.bin > 1),
+            ) if used
+        ]
+
+    def check_frame_shape(self, frame_shape):
+        """Raise ValueError if dark, mask or crop do not fit the frames."""
+        for name, array in (("dark", self.dark), ("mask", self.mask)):
+            if array is not None and array.shape != tuple(frame_shape):
+                raise ValueError(f"{name} shape {array.shape} does not match "
+                                 f"the frame shape {tuple(frame_shape)}")
+        if self.crop is not None:
+            y0, y1, x0, x1 = self.crop
+            if not (0 <= y0 < y1 <= frame_shape[0]
+                    and 0 <= x0 < x1 <= frame_shape[1]):
+                raise ValueError(f"crop {self.crop} is outside the frame "
+                                 f"shape {tuple(frame_shape)}")
+
+    def output_shape(self, shape):
+        """Shape of the preprocessed frame stack of ``shape``."""
+        nframes, ny, nx = shape
+        if self.crop is not None:
+            y0, y1, x0, x1 = self.crop
+            ny, nx = y1 - y0, x1 - x0
+        return (nframes, ny // self.bin, nx // self.bin)
+
+    def output_dtype(self, dtype):
+        """dtype of the preprocessed frames of ``dtype``.
+
+        Dark subtraction gives floating point frames, binning integer frames
+        accumulates into at least 32 bit integers.
+        """
+        dtype = np.dtype(dtype)
+        if self.dark is not None:
+            return np.result_type(dtype, np.float32)
+        if self.bin > 1 and dtype.kind in "iu":
+            return np.promote_types(dtype, np.uint32 if dtype.kind == "u"
+                                    else np.int32)
+        return dtype
+
+    def __call__(self, slab):
+        dtype = self.output_dtype(slab.dtype)
+        if self.dark is not None:
+            slab = np.subtract(slab, self.dark, dtype=dtype)
+        if self.mask is not None:
+            slab = np.where(self.mask, slab.dtype.type(self.mask_value), slab)
+        if self.crop is not None:
+            y0, y1, x0, x1 = self.crop
+            slab = slab[:, y0:y1, x0:x1]
+        if self.bin > 1:
+            n, ny, nx = slab.shape
+            b = self.bin
+            slab = slab[:, :ny // b * b, :nx // b * b].reshape(
+                n, ny // b, b, nx // b, b).sum(axis=(2, 4), dtype=dtype)
+        return slab.astype(dtype, copy=False)
+
+    def parameters(self):
+        """Parameters of the operations as NXparameters fields."""
+        parameters = dict(operations=", ".join(self.operations))
+        if self.dark is not None:
+            parameters["dark"] = self.dark
+        if self.mask is not None:
+            parameters["mask"] = self.mask.astype(np.uint8)
+            parameters["mask_value"] = self.mask_value
+        if self.crop is not None:
+            parameters["crop"] = np.array(self.crop)
+        if self.bin > 1:
+            parameters["bin"] = self.bin
+        return parameters
@@ -0,0 +1,94 @@
+"""Instrumentation events of NXCreator and their aggregation into a report.
+
+NXCreator calls its ``observer`` with an :class:`Event` for every file
+open/close, group creation, dataset write, unit check and dataset link.
+:class:`ProfileReport` is an observer summing these events per stage::
+
+    report = ProfileReport()
+    with NXCreator("scan.nxs", observer=report) as creator:
+        ...
+    report.write("report.json")
+
+The command line converters write such a report with ``--profile``.
+"""
+import collections
+import json
+
+EVENT_KINDS = ("file_open", "file_close", "group", "dataset", "unit_check",
+               "link")
+
+Event = collections.namedtuple(
+    "Event", ["kind", "name", "seconds", "nbytes", "details"])
+"""An instrumented step: its kind (one of EVENT_KINDS), the HDF5 path or
+file name, its wall time, the bytes written and kind specific details such
+as the filter profile of a dataset or the units of a unit check."""
+
+
+def add_profile_argument(parser):
+    """Add the ``--profile`` option to an argparse parser."""
+    parser.add_argument(
+        "--profile",
+        metavar="REPORT.json",
+        help="write the time and bytes spent per conversion stage to a JSON "
+             "report",
+    )
+
+
+class ProfileReport:
+    """Observer aggregating NXCreator events per stage.
+
+    Stages are the event kinds. Time between opening and closing a file that
+    is not covered by any event (e.g. reading the input) is reported as
+    ``untracked``.
+    """
+
+    def __init__(self):
+        self.stages = {
+            kind: dict(count=0, seconds=0.0, bytes=0)
+            for kind in EVENT_KINDS
+        }
+        self.datasets = []
+        self.files = []
+
+    def __call__(self, event):
+        stage = self.stages[event.kind]
+        stage["count"] += 1
+        stage["seconds"] += event.seconds
+        stage["bytes"] += event.nbytes
+        if event.kind == "dataset":
+            self.datasets.append(
+                dict(path=event.name, seconds=event.seconds,
+                     bytes=event.nbytes, **event.details))
+        elif event.kind == "file_close":
+            self.files.append(dict(filename=event.name, **event.details))
+
+    def merge(self, other):
+        """Add the events of another report, e.g. of a worker process."""
+        for kind, stage in other.stages.items():
+            for key, value in stage.items():
+                self.stages[kind][key] += value
+        self.datasets.extend(other.datasets)
+        self.files.extend(other.files)
+
+    def as_dict(self):
+        """Return the report as JSON serializable dict."""
+        total = sum(f["wall_seconds"] for f in self.files)
+        tracked = sum(stage["seconds"] for stage in self.stages.values())
+        stages = {}
+        for kind, stage in self.stages.items():
+            stages[kind] = dict(stage)
+            if stage["seconds"] > 0 and stage["bytes"]:
+                stages[kind]["mb_s"] = (stage["bytes"] / 2**20 /
+                                        stage["seconds"])
+        return dict(
+            total_seconds=total,
+            untracked_seconds=max(total - tracked, 0.0),
+            stages=stages,
+            files=self.files,
+            datasets=sorted(self.datasets, key=lambda d: -d["seconds"]),
+        )
+
+    def write(self, filename):
+        """Write the report as JSON file."""
+        with open(filename, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
@@ -0,0 +1,334 @@
+"""Read NXptycho files written by NXCreator.
+
+:class:`NXReader` resolves the entry, detector, sample and transformation
+groups of a NeXus file and reads detector frames by index range or index
+list. Soft and external links, virtual datasets and the sparse frames of
+:mod:`nxptycho.sparse` are followed transparently::
+
+    with NXReader("scan.nxs", cache_bytes=2**30) as reader:
+        for iteration in range(100):
+            for start in range(0, len(reader), 64):
+                frames = reader.read_frames(start, start + 64)
+                ...
+        print(reader.cache_info())
+
+Frames are read in blocks of whole HDF5 chunks, decompressed blocks are kept
+in an LRU cache of ``cache_bytes``, so loops revisiting the same frames read
+every chunk only once. Sequential reads prefetch the following
+``read_ahead`` blocks in a background thread.
+"""
+import collections
+import concurrent.futures
+import logging
+
+import h5py
+import numpy as np
+
+from .sparse import open_frames
+
+logger = logging.getLogger(__name__)
+DEFAULT_CACHE_BYTES = 256 * 2**20  # bytes of decompressed frames cached
+MIN_BLOCK_BYTES = 2**20  # blocks span whole chunks of at least this size
+
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "blocks", "nbytes", "max_bytes"])
+"""Frame cache statistics, like :func:`functools.lru_cache`'s cache_info."""
+
+
+def _decode(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def nx_class(item):
+    """NX_class attribute of an HDF5 object, ``None`` if missing."""
+    return _decode(item.attrs.get("NX_class"))
+
+
+def find_groups(group, nxclass):
+    """Child groups of ``group`` with the given NX_class, by name.
+
+    Links are followed, unresolvable links are skipped with a warning.
+    """
+    found = {}
+    for name in group:
+        try:
+            item = group[name]
+        except KeyError:
+            logger.warning(' %s/%s: broken link, skipped', group.name, name)
+            continue
+        if isinstance(item, h5py.Group) and nx_class(item) == nxclass:
+            found[name] = item
+    return found
+
+
+def _first(group, nxclass):
+    groups = find_groups(group, nxclass)
+    if not groups:
+        raise ValueError(f"{group.name} has no {nxclass} group")
+    return next(iter(groups.values()))
+
+
+def axis_chain(transformations):
+    """Axes of an NXtransformations group in depends_on order.
+
+    The first axis is the one no other axis depends on, the last one
+    depends on ``"."`` or on a field outside of the group.
+    """
+    axes = {name: item for name, item in transformations.items()
+            if isinstance(item, h5py.Dataset)}
+    depends_on = {name: _decode(ds.attrs.get("depends_on", "."))
+                  for name, ds in axes.items()}
+    targets = set(depends_on.values())
+    heads = [name for name in axes if name not in targets]
+    chain = []
+    for name in heads or list(axes)[:1]:
+        while name in axes and name not in chain:
+            chain.append(name)
+            name = depends_on[name]
+    chain += [name for name in axes if name not in chain]
+    return [axes[name] for name in chain]
+
+
+class NXReader:
+    """Read the frames and geometry of one entry of a NXptycho file.
+
+    The reader is a context manager, or call :meth:`open` and :meth:`close`.
+    """
+
+    def __init__(self,
+                 filename,
+                 entry: str = None,
+                 cache_bytes: int = DEFAULT_CACHE_BYTES,
+                 read_ahead: int = 1,
+                 block_frames: int = None):
+        """
+        :param filename: NeXus file to read
+        :param entry: name of the NXentry, defaults to the file's default
+                      entry or the first one
+        :param cache_bytes: bytes of decompressed frames kept in the cache,
+                            0 disables caching
+        :param read_ahead: number of blocks prefetched after sequential
+                           reads, 0 disables prefetching
+        :param block_frames: frames read and cached at once, defaults to
+                             whole chunks of at least MIN_BLOCK_BYTES
+        """
+        self.filename = filename
+        self.entry_name = entry
+        self.cache_bytes = cache_bytes
+        self.read_ahead = read_ahead
+        self.block_frames = block_frames
+        self.file_handle = None
+        self.entry = None
+        self.detector = None
+        self.sample = None
+        self.frames = None
+        self._cache = collections.OrderedDict()  # block index -> frames
+        self._cache_nbytes = 0
+        self._pending = {}  # block index -> prefetch future
+        self._executor = None
+        self._last_block = None
+        self._hits = 0
+        self._misses = 0
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def open(self):
+        """Open the file and resolve entry, detector, sample and frames."""
+        self.file_handle = h5py.File(self.filename, "r")
+        entries = self.entries
+        if not entries:
+            raise ValueError(f"{self.filename} has no NXentry group")
+        name = self.entry_name or _decode(
+            self.file_handle.attrs.get("default"))
+        if name not in entries:
+            if self.entry_name is not None:
+                raise ValueError(f"{self.filename} has no entry "
+                                 f"'{self.entry_name}', choose one of "
+                                 f"{', '.join(entries)}")
+            name = entries[0]
+        self.entry_name = name
+        self.entry = self.file_handle[name]
+        self.detector = _first(_first(self.entry, "NXinstrument"),
+                               "NXdetector")
+        samples = find_groups(self.entry, "NXsample")
+        self.sample = next(iter(samples.values()), None)
+        self.frames = open_frames(self.detector)
+        if self.block_frames is None:
+            self.block_frames = self._default_block_frames()
+        return self
+
+    def close(self):
+        """Stop prefetching, drop the cache and close the file."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._pending.clear()
+        self._cache.clear()
+        self._cache_nbytes = 0
+        if self.file_handle is None:
+            return
+        # entries linked from other files keep those files open
+        linked = {group.file for group in (self.entry, self.detector,
+                                           self.sample) if group is not None}
+        self.entry = self.detector = self.sample = self.frames = None
+        for f in linked:
+            if f.id.valid and f != self.file_handle:
+                f.close()
+        self.file_handle.close()
+        self.file_handle = None
+
+    @property
+    def entries(self):
+        """Names of the NXentry groups of the file."""
+        return list(find_groups(self.file_handle, "NXentry"))
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+    @property
+    def frame_shape(self):
+        return tuple(self.frames.shape[1:])
+
+    @property
+    def dtype(self):
+        return self.frames.dtype
+
+    def transformations(self, role="detector"):
+        """Axes of the NXtransformations group of the detector or sample.
+
+        :param role: 'detector' or 'sample'
+        :return *list*: axis datasets in depends_on order, see
+                        :func:`axis_chain`
+        """
+        parent = dict(detector=self.detector, sample=self.sample).get(role)
+        if parent is None:
+            return []
+        groups = find_groups(parent, "NXtransformations")
+        if not groups:
+            return []
+        return axis_chain(next(iter(groups.values())))
+
+    def positioners(self):
+        """Raw values of the sample's NXpositioner groups by their name."""
+        if self.sample is None:
+            return {}
+        positioners = {}
+        for group_name, group in find_groups(self.sample,
+                                             "NXpositioner").items():
+            name = _decode(group["name"][()]) if "name" in group else group_name
+            if "raw_value" in group:
+                positioners[name] = group["raw_value"]
+        return positioners
+
+    def _default_block_frames(self):
+        frame_nbytes = self.dtype.itemsize * int(
+            np.prod(self.frame_shape, dtype=np.int64))
+        chunks = getattr(self.frames, "chunks", None)
+        chunk_frames = chunks[0] if chunks else 1
+        chunk_nbytes = max(chunk_frames * frame_nbytes, 1)
+        per_block = max(1, -(-MIN_BLOCK_BYTES // chunk_nbytes))
+        return max(1, min(chunk_frames * per_block, len(self)))
+
+    def _load_block(self, block):
+        start = block * self.block_frames
+        return self.frames[start:min(start + self.block_frames, len(self))]
+
+    def _get_block(self, block):
+        """Frames of a block, from the cache, a prefetch or the file."""
+        frames = self._cache.get(block)
+        if frames is not None:
+            self._cache.move_to_end(block)
+            self._hits += 1
+            return frames
+        self._misses += 1
+        future = self._pending.pop(block, None)
+        frames = future.result() if future is not None else \
+            self._load_block(block)
+        self._store(block, frames)
+        return frames
+
+    def _store(self, block, frames):
+        if frames.nbytes > self.cache_bytes:
+            return
+        self._cache[block] = frames
+        self._cache_nbytes += frames.nbytes
+        while self._cache_nbytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_nbytes -= evicted.nbytes
+
+    def _prefetch(self, first_block, last_block):
+        """Prefetch the blocks after a sequential read."""
+        sequential = (self._last_block is not None
+                      and first_block in (self._last_block,
+                                          self._last_block + 1))
+        self._last_block = last_block
+        if not sequential or self.read_ahead <= 0:
+            return
+        nblocks = -(-len(self) // self.block_frames)
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                1, thread_name_prefix="nxreader")
+        for block in range(last_block + 1,
+                           min(last_block + 1 + self.read_ahead, nblocks)):
+            if block not in self._cache and block not in self._pending:
+                self._pending[block] = self._executor.submit(
+                    self._load_block, block)
+
+    def read_frames(self, start=0, stop=None):
+        """Dense frames ``start:stop`` as array of shape ``(n, ny, nx)``."""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if stop <= start:
+            return np.empty((0, *self.frame_shape), dtype=self.dtype)
+        first, last = start // self.block_frames, (stop - 1) // self.block_frames
+        parts = []
+        for block in range(first, last + 1):
+            offset = block * self.block_frames
+            frames = self._get_block(block)
+            parts.append(frames[max(start - offset, 0):stop - offset])
+        self._prefetch(first, last)
+        return parts[0].copy() if len(parts) == 1 else np.concatenate(parts)
+
+    def take_frames(self, indices):
+        """Dense frames at the given indices, in their order."""
+        indices = np.asarray(indices, dtype=np.int64).ravel()
+        indices = np.where(indices < 0, indices + len(self), indices)
+        if indices.size and (indices.min() < 0 or indices.max() >= len(self)):
+            raise IndexError(f"Frame indices out of range 0..{len(self) - 1}")
+        out = np.empty((indices.size, *self.frame_shape), dtype=self.dtype)
+        blocks = indices // self.block_frames
+        for block in np.unique(blocks):
+            selected = blocks == block
+            out[selected] = self._get_block(int(block))[
+                indices[selected] - block * self.block_frames]
+        return out
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            index = range(len(self))[key]
+            return self.read_frames(index, index + 1)[0]
+        if isinstance(key, slice) and key.step in (None, 1):
+            return self.read_frames(key.start, key.stop)
+        if isinstance(key, slice):
+            return self.take_frames(list(range(len(self))[key]))
+        return self.take_frames(key)
+
+    def iter_frames(self, batch_frames):
+        """Yield ``(start, stop, frames)`` in batches of frames."""
+        for start in range(0, len(self), batch_frames):
+            stop = min(start + batch_frames, len(self))
+            yield start, stop, self.read_frames(start, stop)
+
+    def cache_info(self):
+        """Return the cache statistics as CacheInfo."""
+        return CacheInfo(self._hits, self._misses, len(self._cache),
+                         self._cache_nbytes, self.cache_bytes)
+
+    def clear_cache(self):
+        """Drop all cached blocks and reset the statistics."""
+        self._cache.clear()
+        self._cache_nbytes = 0
+        self._hits = self._misses = 0
@@ -0,0 +1,138 @@
+"""Sparse storage of mostly empty detector frames.
+
+Frames far from the central beam are mostly zeros. Instead of the dense
+``data`` field, NXCreator can store the frame stack as three fields of the
+NXdetector group:
+
+* ``data_indices``: flat pixel index ``y * nx + x`` of every nonzero pixel
+* ``data_values``: counts of these pixels
+* ``data_offsets``: ``npts + 1`` offsets, the pixels of frame ``i`` are
+  ``offsets[i]:offsets[i + 1]``, with the frame shape as attribute
+
+:class:`SparseFrames` rebuilds dense batches of frames on demand::
+
+    frames = open_frames(f["entry_1/instrument/detector"])
+    batch = frames[100:200]  # dense (100, ny, nx) array
+"""
+import numpy as np
+
+SPARSE_FIELDS = ("indices", "values", "offsets")
+SPARSE_CHUNK = 2**18  # elements per chunk of the index and value fields
+
+
+def add_sparse_argument(parser):
+    """Add the ``--sparse`` option to an argparse parser."""
+    parser.add_argument(
+        "--sparse",
+        type=float,
+        metavar="THRESHOLD",
+        help="store the frames as nonzero pixel indices and values if the "
+             "fraction of zero pixels exceeds THRESHOLD, e.g. 0.9",
+    )
+
+
+def sparse_names(name):
+    """Names of the index, value and offset fields of sparse ``name``."""
+    return tuple(f"{name}_{field}" for field in SPARSE_FIELDS)
+
+
+def is_sparse(group, name="data"):
+    """Return ``True`` if ``name`` of group is stored sparse."""
+    return name not in group and sparse_names(name)[2] in group
+
+
+def open_frames(group, name="data"):
+    """Return the frames ``name`` of group, dense or as SparseFrames."""
+    if is_sparse(group, name):
+        return SparseFrames(group, name)
+    return group[name]
+
+
+def sparsify(slab):
+    """Nonzero pixels of a slab of frames.
+
+    :return *tuple*: number of nonzero pixels per frame, their flat pixel
+                     indices and values
+    """
+    flat = slab.reshape(len(slab), -1)
+    frames, indices = np.nonzero(flat)
+    counts = np.bincount(frames, minlength=len(slab))
+    return counts, indices.astype(np.uint32), flat[frames, indices]
+
+
+def zero_fraction(slabs, total_pixels, threshold=None):
+    """Fraction of zero pixels of the slabs.
+
+    :param slabs: iterable of slabs of frames
+    :param total_pixels: number of pixels of all slabs
+    :param threshold: stop counting as soon as the fraction cannot exceed the
+                      threshold any more and return its upper bound then
+    :return *float*:
+    """
+    zeros, seen = 0, 0
+    for slab in slabs:
+        zeros += slab.size - np.count_nonzero(slab)
+        seen += slab.size
+        if (threshold is not None
+                and zeros + total_pixels - seen <= threshold * total_pixels):
+            break
+    return (zeros + total_pixels - seen) / max(total_pixels, 1)
+
+
+class SparseFrames:
+    """Read-only frame stack of a sparse field, indexed like a dataset.
+
+    Integer indices return a dense frame, slices a dense batch of frames.
+    """
+
+    def __init__(self, group, name="data"):
+        indices, values, offsets = sparse_names(name)
+        self.indices = group[indices]
+        self.values = group[values]
+        self.offsets = group[offsets]
+        self.frame_shape = tuple(self.offsets.attrs["frame_shape"])
+        self.dtype = self.values.dtype
+        self.shape = (self.offsets.shape[0] - 1, *self.frame_shape)
+        self.ndim = len(self.shape)
+        self.attrs = self.values.attrs
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nnz(self):
+        """Number of stored pixels."""
+        return self.values.shape[0]
+
+    def read(self, start, stop):
+        """Dense frames ``start:stop``."""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        offsets = self.offsets[start:stop + 1]
+        out = np.zeros((stop - start, int(np.prod(self.frame_shape))),
+                       dtype=self.dtype)
+        if stop > start and offsets[-1] > offsets[0]:
+            frames = np.repeat(np.arange(stop - start), np.diff(offsets))
+            out[frames, self.indices[offsets[0]:offsets[-1]]] = \
+                self.values[offsets[0]:offsets[-1]]
+        return out.reshape(stop - start, *self.frame_shape)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            index = range(len(self))[key]
+            return self.read(index, index + 1)[0]
+        if isinstance(key, slice):
+            index = range(len(self))[key]
+            if not index or index.step == 1:
+                return self.read(index.start, max(index.start, index.stop))
+            low, high = min(index), max(index) + 1
+            return self.read(low, high)[np.asarray(index) - low]
+        if key is Ellipsis or key == ():
+            return self.read(0, len(self))
+        raise TypeError(f"SparseFrames takes an integer or slice, not {key!r}")
+
+    def iter_batches(self, batch_frames):
+        """Yield ``(start, stop, frames)`` in dense batches of frames."""
+        for start in range(0, len(self), batch_frames):
+            stop = min(start + batch_frames, len(self))
+            yield start, stop, self.read(start, stop)
@@ -0,0 +1,126 @@
+"""Per-frame statistics accumulated while the frames are copied.
+
+Quality checks need the total counts, maximum and number of saturated pixels
+of every frame and the average frame. :class:`FrameStatistics` collects them
+from the slabs NXCreator copies anyway, so they cost no extra read of the
+data. Pixels at or above the saturation value (overflow markers, counts
+above an Eiger's count cutoff) are counted as saturated and left out of the
+totals, maxima and average.
+
+The results are written to the NXdetector group as ``total_counts``,
+``maximum_counts``, ``saturated_pixels``, ``saturation_value`` and
+``data_average``, and linked into the NXdata groups ``frame_statistics`` and
+``data_average`` of the entry.
+"""
+import numpy as np
+
+STATISTICS_FIELDS = ("total_counts", "maximum_counts", "saturated_pixels")
+
+
+def add_frame_statistics_argument(parser):
+    """Add the ``--frame-statistics`` option to an argparse parser."""
+    parser.add_argument(
+        "--frame-statistics",
+        action="store_true",
+        help="record total counts, maximum and saturated pixels of every "
+             "frame and the average frame while the frames are copied",
+    )
+
+
+def overflow_marker(dtype):
+    """Largest value of unsigned integer frames, ``None`` for other types."""
+    dtype = np.dtype(dtype)
+    return np.iinfo(dtype).max if dtype.kind == "u" else None
+
+
+def _sum_dtype(dtype, terms):
+    """Narrowest exact accumulator of ``terms`` values of ``dtype``.
+
+    Summing uint8 and uint16 pixels into uint32 is twice as fast as int64.
+    """
+    if (dtype.kind == "u" and dtype.itemsize <= 2
+            and terms * np.iinfo(dtype).max <= np.iinfo(np.uint32).max):
+        return np.uint32
+    if dtype.kind in "biu":
+        return np.int64
+    return np.float64
+
+
+class FrameStatistics:
+    """Accumulate per-frame statistics and the average frame slab by slab.
+
+    Every frame must be passed to :meth:`update` exactly once, in any order.
+    """
+
+    def __init__(self, nframes, saturation_value=overflow_marker):
+        """
+        :param nframes: number of frames of the stack
+        :param saturation_value: counts at or above it are saturated, or a
+                                 callable returning it for the dtype of the
+                                 first slab, ``None`` counts no pixel as
+                                 saturated; defaults to the overflow marker
+                                 of unsigned integer frames
+        """
+        self.nframes = nframes
+        self.saturation_value = saturation_value
+        self.frames = 0  # frames counted so far
+        self.total_counts = None
+        self.maximum_counts = None
+        self.saturated_pixels = None
+        self._sum = None  # float64 sum of the valid pixels of all frames
+
+    @property
+    def complete(self):
+        """``True`` once every frame was counted."""
+        return self.frames == self.nframes
+
+    def _allocate(self, slab):
+        total = np.int64 if slab.dtype.kind in "biu" else np.float64
+        self.total_counts = np.zeros(self.nframes, dtype=total)
+        self.maximum_counts = np.zeros(self.nframes, dtype=slab.dtype)
+        self.saturated_pixels = np.zeros(self.nframes, dtype=np.int64)
+        self._sum = np.zeros(slab.shape[1:], dtype=np.float64)
+        if callable(self.saturation_value):
+            self.saturation_value = self.saturation_value(slab.dtype)
+
+    def update(self, start, slab):
+        """Count the frames ``start:start + len(slab)``."""
+        if len(slab) == 0:
+            return
+        if self._sum is None:
+            self._allocate(slab)
+        stop = start + len(slab)
+        axes = tuple(range(1, slab.ndim))
+        maxima = slab.max(axis=axes)
+        if self.saturation_value is not None:
+            # only frames reaching the saturation value are masked
+            hot = np.flatnonzero(maxima >= self.saturation_value)
+            if hot.size:
+                saturated = slab[hot] >= self.saturation_value
+                self.saturated_pixels[start + hot] = np.count_nonzero(
+                    saturated, axis=axes)
+                slab = slab.copy()
+                slab[hot] = np.where(saturated, 0, slab[hot])
+                maxima[hot] = slab[hot].max(axis=axes)
+        self.maximum_counts[start:stop] = maxima
+        frame_pixels = slab[0].size
+        self.total_counts[start:stop] = slab.sum(
+            axis=axes, dtype=_sum_dtype(slab.dtype, frame_pixels))
+        self._sum += slab.sum(axis=0, dtype=_sum_dtype(slab.dtype, len(slab)))
+        self.frames += len(slab)
+
+    @property
+    def data_average(self):
+        """Average frame, saturated pixels count as zero."""
+        return self._sum / max(self.frames, 1)
+
+    def results(self):
+        """Statistics by field name, ``saturated_pixels`` only if known."""
+        if self._sum is None:
+            return {}
+        results = dict(total_counts=self.total_counts,
+                       maximum_counts=self.maximum_counts,
+                       data_average=self.data_average)
+        if self.saturation_value is not None:
+            results["saturated_pixels"] = self.saturated_pixels
+        return results
@@ -0,0 +1,206 @@
+"""Declarative NXtransformations chains.
+
+A transformations spec lists the axes of the detector and sample
+transformation groups, as Python dict or JSON (or YAML, with PyYAML) file::
+
+    {
+        "sample": [
+            {"name": "vertical", "type": "translation", "vector": [0, 1, 0],
+             "positioner": "vertical"},
+            {"name": "rotation", "type": "rotation", "vector": [0, 1, 0],
+             "positioner": "rotation", "depends_on": "vertical"}
+        ]
+    }
+
+Each axis has a ``name``, a ``type`` (translation or rotation) and a unit
+``vector``. Optional are ``offset`` (zeros), ``units`` and ``offset_units``
+(meter or degree, for axes linked to a positioner the positioner's units),
+``depends_on`` (``"."``, ends the chain), ``positioner`` (name of the
+NXpositioner whose raw values are the axis values) and a constant ``value``.
+
+:func:`compile_plan` validates a spec once, including units and depends_on
+chains, and returns a :class:`TransformationPlan` that writes the axes of
+every entry without validating them again: the attributes of each axis are
+prepared at compile time and only the units of the positioners linked to an
+axis are checked when it is written.
+"""
+import collections
+import json
+import logging
+import os
+
+import numpy as np
+
+from .creator import check_units
+
+logger = logging.getLogger(__name__)
+TRANSFORMATION_ROLES = ("detector", "sample")
+EXPECTED_UNITS = dict(translation="m", rotation="deg")
+AXIS_KEYS = {"name", "type", "vector", "offset", "units", "offset_units",
+             "depends_on", "positioner", "value"}
+
+AxisPlan = collections.namedtuple(
+    "AxisPlan", ["name", "expected_units", "units", "positioner", "value",
+                 "attrs"])
+"""Compiled axis: expected and supplied units (``None`` to take the units of
+the positioner), positioner name, constant value and the axis attributes."""
+
+
+def add_transformations_argument(parser):
+    """Add the ``--transformations`` option to an argparse parser."""
+    parser.add_argument(
+        "--transformations",
+        metavar="SPEC",
+        help="JSON or YAML file describing the detector and sample "
+             "NXtransformations axes, replaces the converter's default axes",
+    )
+
+
+def load_spec(spec):
+    """Return a spec given as dict or as JSON or YAML file name."""
+    if isinstance(spec, dict):
+        return spec
+    extension = os.path.splitext(spec)[1].lower()
+    with open(spec) as f:
+        if extension in (".yml", ".yaml"):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(
+                    f"Install PyYAML to read the YAML spec {spec}") from None
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def _check_chain(role, axes):
+    """Raise ValueError if a depends_on chain is broken or circular."""
+    depends_on = {axis["name"]: axis.get("depends_on", ".") for axis in axes}
+    for name in depends_on:
+        seen = [name]
+        target = depends_on[name]
+        # paths to fields in other groups end the chain within this group
+        while target != "." and "/" not in target:
+            if target not in depends_on:
+                raise ValueError(f"{role} axis '{seen[-1]}' depends on "
+                                 f"unknown axis '{target}'")
+            if target in seen:
+                raise ValueError(f"{role} axes {' -> '.join(seen + [target])}"
+                                 " form a circular depends_on chain")
+            seen.append(target)
+            target = depends_on[target]
+
+
+def _compile_axis(role, axis):
+    """Validate a single axis and return its AxisPlan."""
+    unknown = set(axis) - AXIS_KEYS
+    if unknown:
+        raise ValueError(f"{role} axis '{axis.get('name')}' has unknown keys "
+                         f"{', '.join(sorted(unknown))}")
+    if "name" not in axis:
+        raise ValueError(f"{role} axis without name")
+    name = axis["name"]
+    kind = axis.get("type")
+    if kind not in EXPECTED_UNITS:
+        raise ValueError(f"{role} axis '{name}' needs a type: translation or "
+                         "rotation")
+    expected = EXPECTED_UNITS[kind]
+    vector = np.asarray(axis.get("vector"), dtype=float)
+    offset = np.asarray(axis.get("offset", np.zeros(3)), dtype=float)
+    if vector.shape != (3, ) or offset.shape != (3, ):
+        raise ValueError(f"{role} axis '{name}' needs a vector and offset "
+                         "of three values")
+    units = axis.get("units")
+    if units is None and axis.get("positioner") is None:
+        units = expected
+    offset_units = axis.get("offset_units", expected)
+    for supplied in (units, offset_units):
+        if supplied is not None and not check_units(supplied, expected).valid:
+            raise ValueError(f"{role} axis '{name}': units [{supplied}] are "
+                             f"not compatible with [{expected}]")
+    return AxisPlan(
+        name=name,
+        expected_units=expected,
+        units=units,
+        positioner=axis.get("positioner"),
+        value=axis.get("value", 0),
+        attrs=dict(transformation_type=kind,
+                   vector=vector,
+                   offset=offset,
+                   offset_units=offset_units,
+                   depends_on=axis.get("depends_on", ".")),
+    )
+
+
+def compile_plan(spec):
+    """Validate a transformations spec and compile it into a write plan.
+
+    :param spec: spec as dict or JSON/YAML file name
+    :return *TransformationPlan*:
+    :raises ValueError: if the spec is invalid
+    """
+    spec = load_spec(spec)
+    roles = {}
+    for role, axes in spec.items():
+        if role not in TRANSFORMATION_ROLES:
+            raise ValueError(f"Unknown transformations group '{role}', "
+                             f"choose one of {', '.join(TRANSFORMATION_ROLES)}")
+        names = [axis.get("name") for axis in axes]
+        duplicates = {name for name in names if names.count(name) > 1}
+        if duplicates:
+            raise ValueError(f"Duplicate {role} axes: "
+                             f"{', '.join(sorted(map(str, duplicates)))}")
+        plans = tuple(_compile_axis(role, axis) for axis in axes)
+        _check_chain(role, axes)
+        roles[role] = plans
+    return TransformationPlan(roles)
+
+
+class TransformationPlan:
+    """Compiled transformations spec, see :func:`compile_plan`."""
+
+    def __init__(self, roles):
+        self.roles = roles
+
+    def __getitem__(self, role):
+        return self.roles.get(role, ())
+
+    def write(self, creator, role, h5parent, positioners=None, values=None):
+        """Write the NXtransformations group of ``role`` below h5parent.
+
+        :param creator: NXCreator of the output file
+        :param role: 'detector' or 'sample'
+        :param h5parent: detector or sample group
+        :param positioners: NXpositioner groups by name, their raw values
+                            become the values of the axes linked to them
+        :param values: values by axis name, override the spec's values
+        :return *h5py.Group*: the transformations group
+        """
+        positioners = positioners or {}
+        values = values or {}
+        transformation = creator.create_transformation_group(h5parent)
+        for axis in self[role]:
+            value = values.get(axis.name, axis.value)
+            units = axis.units
+            if axis.positioner is not None:
+                if axis.positioner not in positioners:
+                    raise ValueError(f"{role} axis '{axis.name}' needs "
+                                     f"positioner '{axis.positioner}'")
+                value = positioners[axis.positioner]["raw_value"]
+                if units is None:
+                    units = value.attrs.get("units") or axis.expected_units
+                    if isinstance(units, bytes):
+                        units = units.decode("utf-8")
+                    if not check_units(units, axis.expected_units).valid:
+                        logger.warning(
+                            ' Units [%s] of positioner %s do not match '
+                            'expected units [%s], axis %s written without '
+                            'units', units, axis.positioner,
+                            axis.expected_units, axis.name)
+                        units = None
+            creator._create_dataset(transformation,
+                                    axis.name,
+                                    value,
+                                    filters=creator.filters.get("axis"),
+                                    **({} if units is None else dict(units=units)),
+                                    **axis.attrs)
+        return transformation
@@ -0,0 +1,53 @@
+"""Input files shared by the tests."""
+import h5py
+import numpy as np
+
+from nxptycho.creator import NXCreator
+
+
+def write_cxi(filename, entries, frames=5):
+    """Write a small cxi file, frames of entry ``n`` are filled with ``n``."""
+    with h5py.File(filename, 'w') as f:
+        f['cxi_version'] = 150
+        for n in range(1, entries + 1):
+            instrument = f.create_group(f'entry_{n}/instrument_1')
+            instrument['name'] = 'test'
+            instrument['source_1/name'] = 'test'
+            instrument['source_1/energy'] = 800.0
+            detector = instrument.create_group('detector_1')
+            detector['data'] = np.full((frames, 4, 4), n, dtype=np.float32)
+            detector['distance'] = 0.12
+            detector['x_pixel_size'] = 30.0
+            detector['y_pixel_size'] = 30.0
+            detector['translation'] = np.random.default_rng(n).random(
+                (frames, 3))
+
+
+def write_detector(filename, data, count_range=None, **options):
+    """Write a NeXus file with frames in its detector group.
+
+    Frames given as an HDF5 file name are linked from its ``data`` dataset.
+    A memory budget of two frames forces copies in several slabs.
+
+    :param options: keyword arguments of NXCreator
+    """
+    source = h5py.File(data, 'r')['data'] if isinstance(data, str) else data
+    frame_bytes = source.dtype.itemsize * int(np.prod(source.shape[1:]))
+    creator = NXCreator(filename, memory_budget=2 * frame_bytes, **options)
+    if source is not data:
+        # the source file is closed before its frames are read through the link
+        with source.file:
+            data = creator.link_dataset(source)
+    with creator:
+        entry = creator.create_entry_group()
+        instrument = creator.create_instrument_group(h5parent=entry,
+                                                     name='test')
+        creator.create_detector_group(h5parent=instrument,
+                                      data=data,
+                                      data_units='counts',
+                                      distance=1.0,
+                                      distance_units='m',
+                                      x_pixel_size=1e-5,
+                                      y_pixel_size=1e-5,
+                                      pixel_size_units='m',
+                                      count_range=count_range)
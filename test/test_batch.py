@@ -0,0 +1,98 @@
+import csv
+import os
+import unittest
+
+import h5py
+import pytest
+
+from nxptycho.converter.batch import (convert_batch, convert_job, find_jobs,
+                                      load_manifest)
+
+from helpers import write_cxi
+
+
+def write_broken_cxi(filename):
+    """Write a file identified as cxi that cannot be converted."""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with h5py.File(filename, 'w') as f:
+        f['entry_1/instrument_1/detector_1/data'] = [1.0]  # no translations
+
+
+def test_duplicate_outputs(tmp_path):
+    """Inputs with the same name in different directories are rejected."""
+    folder = f'{tmp_path}/batch'
+    write_broken_cxi(f'{folder}/a/scan.cxi')
+    write_broken_cxi(f'{folder}/b/scan.cxi')
+    assert len(find_jobs([f'{folder}/a'], f'{folder}/out')) == 1
+    with pytest.raises(ValueError, match='same output name'):
+        find_jobs([f'{folder}/a', f'{folder}/b'], f'{folder}/out')
+
+
+def test_failed_input_is_retried(tmp_path):
+    """Failed conversions are recorded and converted again on a rerun."""
+    folder = f'{tmp_path}/batch'
+    write_broken_cxi(f'{folder}/a/scan.cxi')
+    for _ in range(2):
+        records = convert_batch([f'{folder}/a'], f'{folder}/out', jobs=1)
+        assert [record['status'] for record in records] == ['failed']
+        assert records[0]['fingerprints'][0]['size'] > 0
+        assert load_manifest(f'{folder}/out')[records[0]['inputs'][0]] == \
+            records[0]
+
+    job = dict(kind='cxi', inputs=[f'{folder}/a/missing.cxi'],
+               output=f'{folder}/out/missing.nxs')
+    record = convert_job(job)
+    assert record['status'] == 'failed' and record['fingerprints'] == []
+
+
+def test_converted_inputs_are_skipped(tmp_path):
+    """Converted inputs are recorded and skipped on reruns until they change."""
+    folder = f'{tmp_path}/batch'
+    os.makedirs(f'{folder}/a')
+    write_cxi(f'{folder}/a/first.cxi', entries=1)
+    write_cxi(f'{folder}/a/second.cxi', entries=1)
+    records = convert_batch([f'{folder}/a'], f'{folder}/out', jobs=2,
+                            creator_options=dict(frame_statistics=True))
+    assert [record['status'] for record in records] == ['ok', 'ok']
+    assert [record['output'] for record in records] == \
+        [f'{folder}/out/first.nxs', f'{folder}/out/second.nxs']
+    for record in records:
+        assert record['output_bytes'] == os.path.getsize(record['output'])
+        assert record['input_bytes'] == os.path.getsize(record['inputs'][0])
+        with h5py.File(record['output'], 'r') as f:
+            assert 'total_counts' in f['entry_1/instrument/detector']
+
+    manifest = load_manifest(f'{folder}/out')
+    assert [manifest[record['inputs'][0]] for record in records] == records
+    with open(f'{folder}/out/manifest.csv', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['inputs'] for row in rows] == \
+        [record['inputs'][0] for record in records]
+    assert [row['fingerprints'] for row in rows] == \
+        [record['fingerprints'][0]['sha256'] for record in records]
+    assert {row['status'] for row in rows} == {'ok'}
+
+    # unchanged inputs keep their records
+    assert convert_batch([f'{folder}/a'], f'{folder}/out', jobs=1) == records
+
+    # a rewrite with the same size and modification time is converted again
+    path = records[0]['inputs'][0]
+    stat = os.stat(path)
+    with h5py.File(path, 'r+') as f:
+        f['entry_1/instrument_1/detector_1/data'][...] = 7
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.path.getsize(path) == stat.st_size
+    rerun = convert_batch([f'{folder}/a'], f'{folder}/out', jobs=1)
+    assert rerun[0]['seconds'] != records[0]['seconds']
+    assert rerun[0]['fingerprints'] != records[0]['fingerprints']
+    assert rerun[1] == records[1]
+    with h5py.File(rerun[0]['output'], 'r') as f:
+        assert (f['entry_1/instrument/detector/data'][()] == 7).all()
+
+    forced = convert_batch([f'{folder}/a'], f'{folder}/out', jobs=1,
+                           force=True)
+    assert forced[1]['seconds'] != rerun[1]['seconds']
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+import h5py
+import numpy as np
+import pytest
+
+from nxptycho.chunking import parse_profile, plan_chunks
+from nxptycho.creator import NXCreator
+
+
+def test_plan_chunks():
+    """Chunks follow the access profile and stay within their byte limits."""
+    shape = (1000, 512, 512)
+    assert plan_chunks(shape, np.uint16, 'frame').chunks == (1, 512, 512)
+    assert plan_chunks((1000, 64, 64), np.uint16, 'frame').chunks == \
+        (8, 64, 64)
+    # 16 frames of 512 KiB exceed 4 MiB and are split into halves
+    assert plan_chunks(shape, np.uint16, 'batch-16').chunks == (16, 256, 512)
+    plan = plan_chunks(shape, np.uint16, 'pixel', memory_budget=2**26)
+    assert plan.chunks == (128, 64, 64) and plan.profile == 'pixel'
+    assert plan.cache_nbytes == 64 * 128 * 64 * 64 * 2
+    assert plan_chunks(shape, np.uint16, 'batch').profile == 'batch-16'
+    assert parse_profile('batch-4') == ('batch', 4)
+    for profile in ('frames', 'pixel-4', 'batch-0', 'batch-k'):
+        with pytest.raises(ValueError):
+            parse_profile(profile)
+
+
+def test_plan_chunks_of_more_axes():
+    """Axes between frames and pixels stay whole, only the pixels are tiled."""
+    shape = (100, 3, 512, 512)
+    assert plan_chunks(shape, np.uint16, 'frame').chunks == (1, 3, 512, 512)
+    assert plan_chunks(shape, np.uint16, 'batch-16').chunks == \
+        (16, 3, 85, 512)
+    assert plan_chunks(shape, np.uint16, 'pixel',
+                       memory_budget=2**26).chunks == (42, 3, 64, 65)
+    assert plan_chunks((1000, 512), np.uint16, 'batch-16').chunks == \
+        (16, 512)
+
+
+def test_chunk_profile(tmp_path):
+    """Detector data is chunked for the creator's access profile."""
+    frames = np.arange(20 * 8 * 6, dtype=np.uint16).reshape(20, 8, 6)
+    filename = f'{tmp_path}/chunk_profile.nx'
+    with NXCreator(filename, chunk_profile='batch-4') as creator:
+        entry = creator.create_entry_group()
+        instrument = creator.create_instrument_group(h5parent=entry, name='test')
+        creator.create_detector_group(h5parent=instrument,
+                                      data=frames,
+                                      data_units='counts',
+                                      distance=1.0,
+                                      distance_units='m',
+                                      x_pixel_size=1e-5,
+                                      y_pixel_size=1e-5,
+                                      pixel_size_units='m')
+
+    with h5py.File(filename, 'r') as f:
+        data = f['entry/instrument/detector/data']
+        assert data.chunks == (4, 8, 6)
+        assert data.attrs['chunk_profile'] == 'batch-4'
+        np.testing.assert_array_equal(data[()], frames)
+
+
+if __name__ == "__main__":
+    unittest.main()
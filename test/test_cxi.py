@@ -0,0 +1,60 @@
+import unittest
+
+import h5py
+import numpy as np
+import pytest
+
+from nxptycho.converter import cxi2nexus
+from nxptycho.preprocess import Preprocessing
+
+from helpers import write_cxi
+
+
+def datasets(group):
+    """All datasets below group by their relative path."""
+    found = {}
+    group.visititems(lambda name, obj: found.setdefault(name, obj[()])
+                     if isinstance(obj, h5py.Dataset) else None)
+    return found
+
+
+def test_parallel_entries(tmp_path):
+    """Entries converted in a process pool match a serial conversion."""
+    write_cxi(f'{tmp_path}/scan.cxi', entries=3)
+    cxi2nexus(f'{tmp_path}/scan.cxi', f'{tmp_path}/serial.nxs', jobs=1)
+    cxi2nexus(f'{tmp_path}/scan.cxi', f'{tmp_path}/parallel.nxs', jobs=2)
+
+    with h5py.File(f'{tmp_path}/serial.nxs', 'r') as serial, \
+            h5py.File(f'{tmp_path}/parallel.nxs', 'r') as master:
+        assert sorted(master) == sorted(serial) == \
+            ['entry_1', 'entry_2', 'entry_3']
+        for n in (1, 2, 3):
+            link = master.get(f'entry_{n}', getlink=True)
+            assert isinstance(link, h5py.ExternalLink)
+            assert link.filename == f'parallel_entry_{n}.nxs'
+            expected = datasets(serial[f'entry_{n}'])
+            converted = datasets(master[f'entry_{n}'])
+            assert sorted(converted) == sorted(expected)
+            for name, value in expected.items():
+                np.testing.assert_array_equal(converted[name], value)
+            assert (master[f'entry_{n}/instrument/detector/data'][()] == n
+                    ).all()
+
+
+@pytest.mark.parametrize('options', [
+    dict(preprocess=Preprocessing(bin=2)),
+    dict(narrow_dtype=True),
+    dict(sparse_threshold=0.9),
+    dict(chunk_profile='frame'),
+    dict(frame_statistics=True),
+])
+def test_link_rejects_copy_options(tmp_path, options):
+    """Options that need a copy of the frames cannot be combined with link."""
+    write_cxi(f'{tmp_path}/scan.cxi', entries=1)
+    with pytest.raises(ValueError):
+        cxi2nexus(f'{tmp_path}/scan.cxi', f'{tmp_path}/linked.nxs',
+                  link=True, **options)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,3 @@
-import os
 import unittest
 
 import numpy as np
@@ -6,10 +5,7 @@ import numpy as np
 from nxptycho.creator import NXCreator
 
 
-__folder__ = os.path.dirname(__file__)
-
-
-def test_creator():
+def test_creator(tmp_path):
     """Create a NeXus Ptycho file of random data using only required fields.
 
     NXCreator is a convenience class which does the following:
@@ -23,7 +19,7 @@ def test_creator():
     format to call the NXCreator.create_foo() functions in the correct order.
     """
 
-    with NXCreator(f'{__folder__}/data/dummy.nx') as creator:
+    with NXCreator(f'{tmp_path}/dummy.nx') as creator:
 
         entry = creator.create_entry_group(definition='NXptycho')
 
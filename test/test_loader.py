@@ -0,0 +1,36 @@
+import unittest
+
+import h5py
+import numpy as np
+
+from nxptycho.loader import SMALL_DATASET_BYTES, CXILoader, GeneralLoader
+
+
+def test_large_translations_are_read(tmp_path):
+    """Translations are read into memory whatever their size, frames not."""
+    translation = np.zeros((SMALL_DATASET_BYTES // 24 + 1, 3))
+    with h5py.File(f'{tmp_path}/loader.cxi', 'w') as f:
+        detector = f.create_group('entry_1/instrument_1/detector_1')
+        detector['translation'] = translation
+        detector['data'] = np.zeros((translation.nbytes // 64 + 1, 4, 4))
+    with CXILoader(f'{tmp_path}/loader.cxi') as loader:
+        cxi = loader.data_dict(1)
+        assert isinstance(cxi['translation'], np.ndarray)
+        np.testing.assert_array_equal(cxi['translation'], translation)
+        assert isinstance(cxi['data'], h5py.Dataset)
+
+
+def test_general_loader_closes_the_input(tmp_path):
+    """GeneralLoader reads through its loader's file and closes it."""
+    with h5py.File(f'{tmp_path}/general.cxi', 'w') as f:
+        f['cxi_version'] = 150
+        f['entry_1/instrument_1/detector_1/distance'] = 0.12
+    with GeneralLoader(f'{tmp_path}/general.cxi') as loader:
+        loader.get_data()
+        assert loader.file is loader.loader.data_file
+        assert loader.distance[()] == 0.12
+    assert not loader.file.id.valid
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import h5py
+import numpy as np
+import pytest
+
+from helpers import write_detector
+
+
+def write_narrowed(filename, frames, count_range=None):
+    """Return dtype, values and attributes of the narrowed frames."""
+    write_detector(filename, frames, count_range, narrow_dtype=True)
+    with h5py.File(filename, 'r') as f:
+        data = f['entry/instrument/detector/data']
+        return data.dtype, data[()], dict(data.attrs)
+
+
+@pytest.mark.parametrize('count_range, dtype', [(None, np.uint8),
+                                                ((0, 1000), np.uint16)])
+def test_narrow_counts(count_range, dtype, tmp_path):
+    """Counts are stored in the narrowest type, overflows as its maximum."""
+    frames = np.arange(6 * 4 * 4, dtype=np.uint32).reshape(6, 4, 4)
+    frames[3, 1, 2] = np.iinfo(np.uint32).max
+    narrow, data, attrs = write_narrowed(f'{tmp_path}/narrowed.nx',
+                                         frames, count_range)
+    overflow = np.iinfo(dtype).max
+    assert narrow == dtype
+    assert attrs['original_dtype'] == 'uint32'
+    assert attrs['overflow_value'] == overflow
+    assert data[3, 1, 2] == overflow
+    valid = frames != np.iinfo(np.uint32).max
+    np.testing.assert_array_equal(data[valid], frames[valid])
+
+
+def test_counts_above_the_count_range(tmp_path):
+    """Counts above a given range are stored as overflows, not wrapped."""
+    frames = np.arange(6 * 4 * 4, dtype=np.uint32).reshape(6, 4, 4)
+    frames[2, 0, 1] = 70000
+    narrow, data, attrs = write_narrowed(f'{tmp_path}/narrowed.nx',
+                                         frames, count_range=(0, 1000))
+    assert narrow == np.uint16
+    assert data[2, 0, 1] == attrs['overflow_value'] == 65535
+    valid = frames <= 1000
+    np.testing.assert_array_equal(data[valid], frames[valid])
+
+    with pytest.raises(ValueError):
+        write_narrowed(f'{tmp_path}/narrowed.nx', frames,
+                       count_range=(10, 1000))
+
+
+def test_fractional_counts_are_kept(tmp_path):
+    """Frames with fractional counts keep their dtype."""
+    frames = np.full((4, 4, 4), 0.5)
+    narrow, data, attrs = write_narrowed(f'{tmp_path}/not_narrowed.nx',
+                                         frames)
+    assert narrow == np.float64
+    assert 'original_dtype' not in attrs
+    np.testing.assert_array_equal(data, frames)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+import h5py
+import numpy as np
+
+from nxptycho.preprocess import Preprocessing
+
+from helpers import write_detector
+
+
+def test_preprocess_while_streaming(tmp_path):
+    """Frames are preprocessed slab by slab and the steps are recorded."""
+    frames = np.arange(6 * 8 * 8, dtype=np.uint16).reshape(6, 8, 8)
+    dark = np.ones((8, 8))
+    mask = np.zeros((8, 8), dtype=bool)
+    mask[2, 3] = True
+    preprocess = Preprocessing(dark=dark, mask=mask, crop=(2, 8, 0, 6), bin=2)
+
+    expected = frames - dark
+    expected[:, mask] = 0
+    expected = expected[:, 2:8, 0:6].reshape(6, 3, 2, 3, 2).sum(axis=(2, 4))
+
+    filename = f'{tmp_path}/preprocessed.nx'
+    write_detector(filename, frames, preprocess=preprocess)
+    with h5py.File(filename, 'r') as f:
+        entry = f['entry']
+        detector = entry['instrument/detector']
+        assert detector['data'].dtype == np.float32
+        np.testing.assert_allclose(detector['data'][()], expected)
+        assert detector['x_pixel_size'][()] == 2e-5
+
+        process = entry['preprocessing']
+        assert process.attrs['NX_class'] == 'NXprocess'
+        assert process['parameters/operations'][()] == b'dark_subtraction, mask, crop, bin'
+        np.testing.assert_array_equal(process['parameters/crop'][()], [2, 8, 0, 6])
+
+
+if __name__ == "__main__":
+    unittest.main()
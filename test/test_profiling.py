@@ -0,0 +1,49 @@
+import json
+import unittest
+
+import numpy as np
+
+from nxptycho.creator import NXCreator
+from nxptycho.profiling import ProfileReport
+
+
+def test_profile_report(tmp_path):
+    """The observer receives every stage and the report sums them up."""
+    events = []
+    report = ProfileReport()
+
+    def observer(event):
+        events.append(event)
+        report(event)
+
+    frames = np.ones((4, 8, 8), dtype=np.uint16)
+    with NXCreator(f'{tmp_path}/profiled.nx',
+                   observer=observer) as creator:
+        entry = creator.create_entry_group()
+        instrument = creator.create_instrument_group(h5parent=entry, name='test')
+        creator.create_detector_group(h5parent=instrument,
+                                      data=frames,
+                                      data_units='counts',
+                                      distance=1.0,
+                                      distance_units='m',
+                                      x_pixel_size=1e-5,
+                                      y_pixel_size=1e-5,
+                                      pixel_size_units='m')
+
+    kinds = [event.kind for event in events]
+    assert kinds[0] == 'file_open' and kinds[-1] == 'file_close'
+    data = next(e for e in events
+                if e.kind == 'dataset' and e.name.endswith('detector/data'))
+    assert data.nbytes == frames.nbytes
+
+    report.write(f'{tmp_path}/profiled.json')
+    with open(f'{tmp_path}/profiled.json') as f:
+        result = json.load(f)
+    assert result['stages']['group']['count'] == 3
+    assert result['stages']['unit_check']['count'] == 4
+    assert result['stages']['dataset']['bytes'] >= frames.nbytes
+    assert result['total_seconds'] >= result['untracked_seconds']
+
+
+if __name__ == "__main__":
+    unittest.main()
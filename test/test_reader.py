@@ -0,0 +1,99 @@
+import unittest
+
+import h5py
+import numpy as np
+
+from nxptycho.creator import NXCreator
+from nxptycho.reader import NXReader
+from nxptycho.transformations import compile_plan
+
+
+SPEC = dict(sample=[
+    dict(name='x', type='translation', vector=[1, 0, 0],
+         positioner='horizontal'),
+    dict(name='y', type='translation', vector=[0, 1, 0],
+         positioner='vertical', depends_on='x'),
+])
+
+
+def write_scan(folder, frames, positions):
+    """Write a master file linking an entry that references the frames."""
+    with h5py.File(f'{folder}/reader_frames.h5', 'w') as f:
+        f.create_dataset('data', data=frames, chunks=(2, *frames.shape[1:]))
+    with h5py.File(f'{folder}/reader_frames.h5', 'r') as f, \
+            NXCreator(f'{folder}/reader_entry.nx') as creator:
+        entry = creator.create_entry_group(entry_index=1)
+        instrument = creator.create_instrument_group(h5parent=entry, name='test')
+        creator.create_detector_group(
+            h5parent=instrument,
+            data=creator.link_dataset(f['data']),
+            data_units='counts',
+            distance=1.0,
+            distance_units='m',
+            x_pixel_size=1e-5,
+            y_pixel_size=1e-5,
+            pixel_size_units='m')
+        plan = compile_plan(SPEC)
+        sample = creator.create_sample_group(h5parent=entry)
+        x = creator.create_positioner_group(h5parent=sample,
+                                            name='horizontal',
+                                            raw_value=positions[:, 0],
+                                            positioner_index=1)
+        y = creator.create_positioner_group(h5parent=sample,
+                                            name='vertical',
+                                            raw_value=positions[:, 1],
+                                            positioner_index=2)
+        plan.write(creator, 'sample', sample,
+                   positioners=dict(horizontal=x, vertical=y))
+    with NXCreator(f'{folder}/reader_master.nx') as creator:
+        creator.create_entry_link(f'{folder}/reader_entry.nx',
+                                  entry_index=1)
+
+
+def test_read_frames(tmp_path):
+    """Frames are read through entry links and virtual datasets, cached."""
+    frames = np.arange(10 * 4 * 3, dtype=np.uint16).reshape(10, 4, 3)
+    positions = np.random.default_rng(0).random((10, 2))
+    write_scan(tmp_path, frames, positions)
+
+    with NXReader(f'{tmp_path}/reader_master.nx',
+                  block_frames=4) as reader:
+        assert reader.entries == ['entry_1']
+        assert len(reader) == 10 and reader.frame_shape == (4, 3)
+        np.testing.assert_array_equal(reader.read_frames(3, 9), frames[3:9])
+        np.testing.assert_array_equal(reader.take_frames([9, 0, 5, 0]),
+                                      frames[[9, 0, 5, 0]])
+        np.testing.assert_array_equal(reader[-1], frames[-1])
+        np.testing.assert_array_equal(reader[::3], frames[::3])
+        assert reader.cache_info().blocks == 3
+
+        reader.clear_cache()
+        for _ in range(2):
+            for start, stop, batch in reader.iter_frames(4):
+                np.testing.assert_array_equal(batch, frames[start:stop])
+        info = reader.cache_info()
+        assert (info.hits, info.misses) == (3, 3)
+
+        positioners = reader.positioners()
+        np.testing.assert_array_equal(positioners['vertical'], positions[:, 1])
+        chain = [axis.name.rsplit('/', 1)[-1]
+                 for axis in reader.transformations('sample')]
+        assert chain == ['y', 'x']
+
+
+def test_cache_limit(tmp_path):
+    """The cache keeps the most recently used blocks within its budget."""
+    frames = np.arange(10 * 4 * 3, dtype=np.uint16).reshape(10, 4, 3)
+    write_scan(tmp_path, frames, np.zeros((10, 2)))
+    block_nbytes = 2 * frames[0].nbytes
+    with NXReader(f'{tmp_path}/reader_master.nx', block_frames=2,
+                  cache_bytes=2 * block_nbytes, read_ahead=0) as reader:
+        for index in (0, 2, 4, 0):
+            reader[index]
+        info = reader.cache_info()
+        assert (info.hits, info.misses, info.blocks) == (0, 4, 2)
+        assert info.nbytes == 2 * block_nbytes
+
+
+if __name__ == "__main__":
+    unittest.main()
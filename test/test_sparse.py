@@ -0,0 +1,46 @@
+import unittest
+
+import h5py
+import numpy as np
+
+from nxptycho.sparse import SparseFrames, is_sparse, open_frames
+
+from helpers import write_detector
+
+
+def test_sparse_frames(tmp_path):
+    """Mostly empty frames are stored as nonzero pixels and read back dense."""
+    frames = np.zeros((7, 16, 12), dtype=np.uint16)
+    frames[:, 8, 6] = np.arange(1, 8)
+    frames[2, 0, 0] = 5
+    frames[4] = 0  # an empty frame
+    filename = f'{tmp_path}/sparse.nx'
+    write_detector(filename, frames, sparse_threshold=0.9)
+
+    with h5py.File(filename, 'r') as f:
+        detector = f['entry/instrument/detector']
+        assert is_sparse(detector)
+        assert detector['data_values'].attrs['units'] == 'counts'
+        data = open_frames(detector)
+        assert isinstance(data, SparseFrames)
+        assert data.shape == frames.shape and data.nnz == 7
+        np.testing.assert_array_equal(data[...], frames)
+        np.testing.assert_array_equal(data[2], frames[2])
+        np.testing.assert_array_equal(data[1:6:2], frames[1:6:2])
+        np.testing.assert_array_equal(data[::-1], frames[::-1])
+
+
+def test_dense_below_threshold(tmp_path):
+    """Frames with fewer zero pixels than the threshold stay dense."""
+    frames = np.ones((4, 8, 8), dtype=np.uint16)
+    filename = f'{tmp_path}/not_sparse.nx'
+    write_detector(filename, frames, sparse_threshold=0.9)
+
+    with h5py.File(filename, 'r') as f:
+        detector = f['entry/instrument/detector']
+        assert not is_sparse(detector)
+        np.testing.assert_array_equal(open_frames(detector)[()], frames)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import unittest
+
+import h5py
+import numpy as np
+
+from nxptycho.creator import NXCreator
+from nxptycho.statistics import FrameStatistics
+
+from helpers import write_detector
+
+
+def synthetic_frames():
+    frames = np.random.default_rng(0).poisson(
+        3.0, (9, 8, 6)).astype(np.uint16)
+    frames[2, 1, 1] = frames[5, 0, 3] = frames[5, 7, 5] = 65535  # overflows
+    return frames
+
+
+def check_statistics(filename, frames):
+    valid = np.where(frames == 65535, 0, frames)
+    with h5py.File(filename, 'r') as f:
+        detector = f['entry/instrument/detector']
+        np.testing.assert_array_equal(detector['total_counts'],
+                                      valid.sum(axis=(1, 2)))
+        np.testing.assert_array_equal(detector['maximum_counts'],
+                                      valid.max(axis=(1, 2)))
+        np.testing.assert_array_equal(detector['saturated_pixels'],
+                                      [0, 0, 1, 0, 0, 2, 0, 0, 0])
+        np.testing.assert_allclose(detector['data_average'],
+                                   valid.mean(axis=0))
+        assert detector['saturation_value'][()] == 65535
+        assert detector['total_counts'].attrs['units'] == 'counts'
+        statistics = f['entry/frame_statistics']
+        assert statistics.attrs['signal'] == 'total_counts'
+        assert list(statistics.attrs['auxiliary_signals']) == \
+            ['maximum_counts', 'saturated_pixels']
+        np.testing.assert_array_equal(statistics['total_counts'],
+                                      detector['total_counts'])
+        assert f['entry/data_average'].attrs['signal'] == 'data_average'
+
+
+def test_frame_statistics(tmp_path):
+    """Statistics are accumulated from the slabs of dense and sparse copies."""
+    frames = synthetic_frames()
+    filename = f'{tmp_path}/statistics.nx'
+    write_detector(filename, frames, frame_statistics=True)
+    check_statistics(filename, frames)
+
+    sparse = np.where(frames < 5, 0, frames).astype(np.uint16)
+    write_detector(filename, sparse, frame_statistics=True,
+                   sparse_threshold=0.5)
+    check_statistics(filename, sparse)
+
+
+def test_linked_frame_statistics(tmp_path):
+    """Frames that are only referenced are read once for the statistics."""
+    frames = synthetic_frames()
+    with h5py.File(f'{tmp_path}/statistics_frames.h5', 'w') as f:
+        f.create_dataset('data', data=frames)
+    filename = f'{tmp_path}/statistics_linked.nx'
+    write_detector(filename, f'{tmp_path}/statistics_frames.h5',
+                   frame_statistics=True)
+    check_statistics(filename, frames)
+    with h5py.File(filename, 'r') as f:
+        assert f['entry/instrument/detector/data'].is_virtual
+
+    statistics = FrameStatistics(len(frames))
+    for start in (6, 0, 3):  # any order
+        statistics.update(start, frames[start:start + 3])
+    assert statistics.complete and statistics.saturation_value == 65535
+
+
+class CountingCreator(NXCreator):
+    """Creator that records the file and number of every frame it reads."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reads = []
+
+    def _iter_slabs(self, source, slab_frames, first_frame=0):
+        for start, stop, slab in super()._iter_slabs(source, slab_frames,
+                                                     first_frame):
+            self.reads.append((source.file.filename, stop - start))
+            yield start, stop, slab
+
+
+def test_frames_are_read_once(tmp_path):
+    """Frames HDF5 could copy are streamed instead of read back."""
+    frames = synthetic_frames()
+    source = f'{tmp_path}/statistics_frames.h5'
+    with h5py.File(source, 'w') as f:
+        f.create_dataset('data', data=frames, chunks=(3, 8, 6))
+    filename = f'{tmp_path}/statistics_copied.nx'
+    events = []
+    with h5py.File(source, 'r') as f, \
+            CountingCreator(filename, frame_statistics=True,
+                            observer=events.append) as creator:
+        entry = creator.create_entry_group()
+        instrument = creator.create_instrument_group(h5parent=entry,
+                                                     name='test')
+        creator.create_detector_group(h5parent=instrument,
+                                      data=f['data'],
+                                      data_units='counts',
+                                      distance=1.0,
+                                      distance_units='m',
+                                      x_pixel_size=1e-5,
+                                      y_pixel_size=1e-5,
+                                      pixel_size_units='m')
+    assert creator.reads and all(name == source for name, _ in creator.reads)
+    assert sum(count for _, count in creator.reads) == len(frames)
+    modes = {e.name: e.details['mode'] for e in events if e.kind == 'dataset'}
+    assert modes['/entry/instrument/detector/data'] == 'stream'
+    check_statistics(filename, frames)
+
+
+def test_narrowed_frame_statistics(tmp_path):
+    """Narrowed counts are saturated only where the source overflowed."""
+    frames = np.full((4, 8, 6), 0, dtype=np.uint32)
+    frames[:, 0, 0] = 255  # the largest value of uint8, a valid count
+    frames[1, 1, 1] = 7
+    filename = f'{tmp_path}/statistics_narrowed.nx'
+    write_detector(filename, frames, frame_statistics=True,
+                   narrow_dtype=True)
+    with h5py.File(filename, 'r') as f:
+        detector = f['entry/instrument/detector']
+        assert detector['data'].dtype == np.uint8
+        np.testing.assert_array_equal(detector['total_counts'],
+                                      [255, 262, 255, 255])
+        np.testing.assert_array_equal(detector['maximum_counts'], 255)
+        np.testing.assert_allclose(detector['data_average'],
+                                   frames.mean(axis=0))
+        assert 'saturated_pixels' not in detector
+        assert 'saturation_value' not in detector
+
+    frames[2, 3, 3] = np.iinfo(np.uint32).max
+    write_detector(filename, frames, frame_statistics=True,
+                   narrow_dtype=True)
+    with h5py.File(filename, 'r') as f:
+        detector = f['entry/instrument/detector']
+        assert detector['data'].dtype == np.uint16
+        np.testing.assert_array_equal(detector['saturated_pixels'],
+                                      [0, 0, 1, 0])
+        np.testing.assert_array_equal(detector['total_counts'],
+                                      [255, 262, 255, 255])
+        assert detector['saturation_value'][()] == 65535
+
+
+if __name__ == "__main__":
+    unittest.main()
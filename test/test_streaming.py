@@ -0,0 +1,160 @@
+import json
+import os
+import unittest
+
+import h5py
+import numpy as np
+
+from nxptycho.creator import NXCreator
+
+
+def test_stream_external_frames(tmp_path):
+    """Frames from another file are copied slab by slab into a chunked dataset."""
+    frames = np.arange(10 * 8 * 8, dtype=np.uint16).reshape(10, 8, 8)
+    with h5py.File(f'{tmp_path}/frames.h5', 'w') as f:
+        f['data'] = frames
+
+    # a budget of three frames forces several slabs
+    with h5py.File(f'{tmp_path}/frames.h5', 'r') as f, \
+            NXCreator(f'{tmp_path}/streamed.nx',
+                      memory_budget=3 * frames[0].nbytes) as creator:
+        entry = creator.create_entry_group()
+        ds = creator._create_dataset(entry, 'data', f['data'], chunk_size=2)
+        assert ds.chunks == (2, 8, 8)
+        np.testing.assert_array_equal(ds[()], frames)
+
+
+def test_copy_external_dataset(tmp_path):
+    """Datasets stored as requested are copied by HDF5, others streamed."""
+    frames = np.arange(6 * 8 * 8, dtype=np.uint16).reshape(6, 8, 8)
+    with h5py.File(f'{tmp_path}/frames.h5', 'w') as f:
+        f.create_dataset('data', data=frames, chunks=(3, 8, 8),
+                         compression='gzip', shuffle=True)
+        f['data'].attrs['note'] = 'source attribute'
+
+    events = []
+    with h5py.File(f'{tmp_path}/frames.h5', 'r') as f, \
+            NXCreator(f'{tmp_path}/copied.nx',
+                      observer=events.append) as creator:
+        entry = creator.create_entry_group()
+        for name, filters in (('kept', None), ('same', 'shuffle-gzip-4'),
+                              ('recompressed', 'lzf')):
+            ds = creator._create_dataset(entry, name, f['data'],
+                                         filters=filters, units='counts')
+            np.testing.assert_array_equal(ds[()], frames)
+            assert 'note' not in ds.attrs and ds.attrs['units'] == 'counts'
+        assert entry['kept'].chunks == (3, 8, 8)
+        assert entry['recompressed'].compression == 'lzf'
+    modes = {e.name: e.details['mode'] for e in events if e.kind == 'dataset'}
+    assert modes['/entry/kept'] == modes['/entry/same'] == 'object_copy'
+    assert modes['/entry/recompressed'] == 'stream'
+
+
+class InterruptedCreator(NXCreator):
+    """Creator that is interrupted after copying two slabs."""
+
+    def _iter_slabs(self, source, slab_frames, first_frame=0):
+        slabs = super()._iter_slabs(source, slab_frames, first_frame)
+        for i, slab in enumerate(slabs):
+            if i == 2:
+                raise KeyboardInterrupt
+            yield slab
+
+
+def test_resume_interrupted_copy(tmp_path):
+    """A resumable conversion continues from the last committed slab."""
+    frames = np.arange(10 * 4 * 4, dtype=np.float32).reshape(10, 4, 4)
+    filename = f'{tmp_path}/resumed.nx'
+
+    def convert(creator_class):
+        with creator_class(filename,
+                           memory_budget=2 * frames[0].nbytes,
+                           resumable=True) as creator:
+            entry = creator.create_entry_group()
+            creator._create_dataset(entry, 'title', 'resumed')
+            creator._create_dataset(entry, 'data', frames, chunk_size=2)
+
+    try:
+        convert(InterruptedCreator)
+    except KeyboardInterrupt:
+        pass
+    with open(filename + '.checkpoint.json') as f:
+        checkpoint = json.load(f)
+    assert checkpoint['datasets']['/entry/data'] == [4, 10]
+
+    convert(NXCreator)
+    assert not os.path.exists(filename + '.checkpoint.json')
+    with h5py.File(filename, 'r') as f:
+        np.testing.assert_array_equal(f['entry/data'][()], frames)
+        assert f['entry/title'][()] == b'resumed'
+
+
+def test_link_dataset(tmp_path):
+    """Linked datasets reference the source file instead of copying frames."""
+    positions = np.random.rand(5, 3)
+    with h5py.File(f'{tmp_path}/positions.h5', 'w') as f:
+        f['translation'] = positions
+
+    with h5py.File(f'{tmp_path}/positions.h5', 'r') as f, \
+            NXCreator(f'{tmp_path}/linked.nx') as creator:
+        entry = creator.create_entry_group()
+        layout = creator.link_dataset(f['translation'], np.s_[:, 1])
+        ds = creator._create_dataset(entry, 'y', layout, units='m')
+        assert ds.is_virtual
+        assert ds.virtual_sources()[0].file_name == 'positions.h5'
+
+    with h5py.File(f'{tmp_path}/linked.nx', 'r') as f:
+        np.testing.assert_array_equal(f['entry/y'][()], positions[:, 1])
+
+
+def test_filter_profiles(tmp_path):
+    """Filter profiles are applied per dataset role."""
+    with NXCreator(f'{tmp_path}/filtered.nx',
+                   filters=dict(data='shuffle-gzip-4')) as creator:
+        entry = creator.create_entry_group()
+        instrument = creator.create_instrument_group(h5parent=entry,
+                                                     name='test')
+        detector = creator.create_detector_group(
+            h5parent=instrument,
+            data=np.zeros((4, 16, 16), dtype=np.uint16),
+            data_units='counts',
+            distance=1,
+            distance_units='m',
+            x_pixel_size=1,
+            y_pixel_size=1,
+            pixel_size_units='m',
+        )
+        assert detector['data'].compression == 'gzip'
+        assert detector['data'].shuffle
+        assert detector['distance'].compression is None
+
+    try:
+        NXCreator(f'{tmp_path}/filtered.nx', filters=dict(data='foo'))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unknown profile accepted")
+
+
+def test_threaded_chunk_compression(tmp_path):
+    """Chunks compressed in threads are decoded by HDF5 like its own."""
+    frames = np.random.default_rng(0).poisson(
+        2.0, (10, 16, 12)).astype(np.uint16)
+    sizes = {}
+    for workers in (1, 4):
+        # three frames per chunk leave a partial chunk at the end
+        with NXCreator(f'{tmp_path}/threaded.nx',
+                       memory_budget=6 * frames[0].nbytes,
+                       compression_workers=workers) as creator:
+            entry = creator.create_entry_group()
+            ds = creator._create_dataset(entry, 'data', frames, chunk_size=3,
+                                         filters='shuffle-gzip-4')
+            sizes[workers] = ds.id.get_storage_size()
+        with h5py.File(f'{tmp_path}/threaded.nx', 'r') as f:
+            np.testing.assert_array_equal(f['entry/data'][()], frames)
+            assert f['entry/data'].compression == 'gzip'
+    assert sizes[1] == sizes[4]
+
+
+if __name__ == "__main__":
+    unittest.main()
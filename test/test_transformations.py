@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+import pytest
+
+from nxptycho.creator import NXCreator
+from nxptycho.transformations import compile_plan
+
+
+SPEC = dict(sample=[
+    dict(name='vertical', type='translation', vector=[0, 1, 0],
+         positioner='vertical'),
+    dict(name='rotation', type='rotation', vector=[0, 1, 0], units='degree',
+         depends_on='vertical'),
+])
+
+
+def test_write_plan(tmp_path):
+    """Every entry gets the axes of the plan, linked to its positioners."""
+    plan = compile_plan(SPEC)
+    with NXCreator(f'{tmp_path}/transformations.nx') as creator:
+        for n in (1, 2):
+            entry = creator.create_entry_group(entry_index=n)
+            sample = creator.create_sample_group(h5parent=entry)
+            y = creator.create_positioner_group(h5parent=sample,
+                                                name='vertical',
+                                                raw_value=np.arange(5.0),
+                                                units='um')
+            transformations = plan.write(creator, 'sample', sample,
+                                         positioners=dict(vertical=y))
+            vertical = transformations['vertical']
+            assert vertical == y['raw_value']
+            assert vertical.attrs['units'] == 'um'
+            assert transformations['rotation'].attrs['depends_on'] == 'vertical'
+            np.testing.assert_array_equal(
+                transformations['rotation'].attrs['vector'], [0, 1, 0])
+
+
+@pytest.mark.parametrize('axes, message', [
+    ([dict(name='a', type='translation', vector=[1, 0, 0], depends_on='b'),
+      dict(name='b', type='translation', vector=[1, 0, 0], depends_on='a')],
+     'circular'),
+    ([dict(name='a', type='translation', vector=[1, 0, 0], depends_on='c')],
+     'unknown axis'),
+    ([dict(name='a', type='rotation', vector=[1, 0, 0], units='m')],
+     'not compatible'),
+    ([dict(name='a', type='translation', vector=[1, 0])], 'three values'),
+])
+def test_invalid_specs(axes, message):
+    """Specs are validated before anything is written."""
+    with pytest.raises(ValueError, match=message):
+        compile_plan(dict(sample=axes))
+
+
+if __name__ == "__main__":
+    unittest.main()
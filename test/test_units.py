@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from nxptycho import creator
+
+
+def test_unit_checks_are_memoized():
+    """Unit checks share one registry and cache their conversion factors."""
+    first = creator.check_units('um', 'm')
+    assert first.valid
+    assert abs(first.factor - 1e-6) < 1e-18
+    assert creator.check_units('um', 'm') is first
+    assert creator.get_unit_registry() is creator.get_unit_registry()
+
+    mismatch = creator.check_units('cm', 'eV')
+    assert not mismatch.valid and mismatch.error is None
+
+    undefined = creator.check_units('not_a_unit', 'm')
+    assert not undefined.valid and undefined.error is not None
+
+
+def test_pint_is_imported_on_first_use():
+    """Importing the creator and converters does not load pint."""
+    code = ("import sys, nxptycho.creator, nxptycho.converter.batch; "
+            "print('pint' in sys.modules, 'dask' in sys.modules)")
+    output = subprocess.run([sys.executable, '-c', code], check=True,
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(__file__))).stdout
+    assert output.split() == ['False', 'False']
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,9 +5,19 @@ https://drive.google.com/drive/folders/1jIBwDuBcYVFkWvKJwLuONPYMo7ja5_Jz in the
 test/data folder.
 """
 import os
+import subprocess
+import sys
 import unittest
 
+import h5py
+import numpy as np
+import pytest
+
 from nxptycho.converter import velociprobe2nexus
+from nxptycho.converter.velociprobe import (follow_velociprobe,
+                                            load_positions,
+                                            update_velociprobe)
+from nxptycho.loader import identify, open_loader
 
 
 __folder__ = os.path.dirname(__file__)
@@ -20,5 +30,188 @@ def test_velociprobe_conversion():
     )
 
 
+def write_velociprobe_scan(folder, name, frame_counts, missing=(),
+                           nimages=None, **dataset_kwargs):
+    """Write a small synthetic velociprobe scan with one data file per count.
+
+    Frames of data file ``i`` are filled with ``i + 1``, files listed in
+    missing are linked from the master file but never written. Dataset
+    keyword arguments, e.g. chunks and compression, go to the frames.
+    """
+    os.makedirs(folder, exist_ok=True)
+    with h5py.File(f"{folder}/{name}_master.h5", "w") as master:
+        for i, count in enumerate(frame_counts):
+            data_name = f"{name}_data_{i + 1:06d}.h5"
+            if i not in missing:
+                with h5py.File(f"{folder}/{data_name}", "w") as f:
+                    f.create_dataset("entry/data/data",
+                                     data=np.full((count, 4, 4), i + 1,
+                                                  dtype=np.uint16),
+                                     **dataset_kwargs)
+            master[f"entry/data/data_{i + 1:06d}"] = h5py.ExternalLink(
+                data_name, "entry/data/data")
+        master["entry/instrument/beam/incident_wavelength"] = 1e-10
+        detector = master.create_group("entry/instrument/detector")
+        for field, value in (("detector_distance", 2.0),
+                             ("x_pixel_size", 75e-6),
+                             ("y_pixel_size", 75e-6)):
+            detector[field] = value
+            detector[field].attrs["units"] = np.bytes_("m")
+        if nimages is not None:
+            detector["detectorSpecific/nimages"] = nimages
+        master["entry/sample/goniometer/chi"] = np.zeros(1)
+        master["entry/sample/goniometer/chi"].attrs["units"] = np.bytes_(
+            "degree")
+    frame_count = nimages or sum(frame_counts)
+    np.savetxt(f"{folder}/{name}_pos.csv", np.random.rand(frame_count, 2),
+               delimiter=",")
+
+
+def test_ragged_and_missing_data_files(tmp_path):
+    """Short and missing data files are mapped at their actual frame offsets."""
+    folder = f"{tmp_path}/ragged"
+    write_velociprobe_scan(folder, "scan", [5, 5, 3], missing=(1, ),
+                           nimages=15)
+    velociprobe2nexus(
+        master_path=f"{folder}/scan_master.h5",
+        position_path=f"{folder}/scan_pos.csv",
+        nexus_path=f"{folder}/scan.nx",
+    )
+    with h5py.File(f"{folder}/scan.nx", "r") as f:
+        detector = f["entry/instrument/detector"]
+        np.testing.assert_array_equal(detector["data"][:, 0, 0],
+                                      [1] * 5 + [0] * 5 + [3] * 3 + [0] * 2)
+        np.testing.assert_array_equal(detector["frame_file"][()],
+                                      [0] * 5 + [-1] * 5 + [1] * 3 + [-1] * 2)
+        assert detector["frame_mask"][()].sum() == 8
+        assert detector["frame_index"]["first_frame"].tolist() == [0, 10]
+
+
+def test_materialize_raw_chunks(tmp_path):
+    """Materialized frames hold the stored chunks of the data files."""
+    folder = f"{tmp_path}/materialized"
+    write_velociprobe_scan(folder, "scan", [4, 4, 2], missing=(1, ),
+                           chunks=(2, 4, 4), compression="gzip")
+    velociprobe2nexus(
+        master_path=f"{folder}/scan_master.h5",
+        position_path=f"{folder}/scan_pos.csv",
+        nexus_path=f"{folder}/scan.nx",
+        materialize=True,
+    )
+    with h5py.File(f"{folder}/scan.nx", "r") as f, \
+            h5py.File(f"{folder}/scan_data_000003.h5", "r") as source:
+        data = f["entry/instrument/detector/data"]
+        assert not data.is_virtual
+        assert data.chunks == (2, 4, 4) and data.compression == "gzip"
+        assert data.fillvalue == 0 and data.id.get_num_chunks() == 3
+        np.testing.assert_array_equal(data[:, 0, 0], [1] * 4 + [0] * 4 + [3] * 2)
+        assert (data.id.read_direct_chunk((8, 0, 0))
+                == source["entry/data/data"].id.read_direct_chunk((0, 0, 0)))
+
+
+def test_update_growing_scan(tmp_path):
+    """Data files and positions that arrive later extend the NeXus file."""
+    folder = f"{tmp_path}/growing"
+    write_velociprobe_scan(folder, "scan", [3, 3], missing=(1, ), nimages=6)
+    positions = np.loadtxt(f"{folder}/scan_pos.csv", delimiter=",")
+    np.savetxt(f"{folder}/scan_pos.csv", positions[:3], delimiter=",")
+    paths = dict(master_path=f"{folder}/scan_master.h5",
+                 position_path=f"{folder}/scan_pos.csv",
+                 nexus_path=f"{folder}/scan.nx")
+    velociprobe2nexus(**paths, growing=True)
+    nframes, npositions, offset = update_velociprobe(*paths.values())
+    assert (nframes, npositions) == (3, 3)
+    with h5py.File(f"{folder}/scan.nx", "r") as f:
+        detector = f["entry/instrument/detector"]
+        np.testing.assert_array_equal(detector["frame_mask"][()], [True] * 3)
+
+    # the second data file and its positions arrive
+    with h5py.File(f"{folder}/scan_data_000002.h5", "w") as f:
+        f["entry/data/data"] = np.full((3, 4, 4), 2, dtype=np.uint16)
+    with open(f"{folder}/scan_pos.csv", "a") as f:
+        np.savetxt(f, positions[3:], delimiter=",")
+    nframes, npositions, offset = update_velociprobe(*paths.values(), offset)
+    assert (nframes, npositions) == (6, 6)
+    assert update_velociprobe(*paths.values(), offset) == (6, 6, offset)
+    with h5py.File(f"{folder}/scan.nx", "r") as f:
+        detector = f["entry/instrument/detector"]
+        assert detector["data"].is_virtual
+        np.testing.assert_array_equal(detector["data"][:, 0, 0],
+                                      [1] * 3 + [2] * 3)
+        assert detector["frame_index"]["first_frame"].tolist() == [0, 3]
+        np.testing.assert_array_equal(detector["frame_file"][()],
+                                      [0] * 3 + [1] * 3)
+        assert detector["frame_mask"][()].all()
+        np.testing.assert_allclose(
+            f["entry/sample/positioner_0/raw_value"][()], positions[:, 0])
+        np.testing.assert_allclose(
+            f["entry/sample/positioner_1/raw_value"][()], positions[:, 1])
+
+    # a data file claiming frames of another one is rejected
+    with h5py.File(f"{folder}/scan_data_000002.h5", "a") as f:
+        f["entry/data/data"].attrs["image_nr_low"] = 3
+    with pytest.raises(ValueError, match="overlap"):
+        update_velociprobe(*paths.values(), offset)
+
+
+def test_follow_complete_scan(tmp_path):
+    """Following stops once all announced frames and positions are converted."""
+    folder = f"{tmp_path}/follow"
+    write_velociprobe_scan(folder, "scan", [2, 2], nimages=4)
+    follow_velociprobe(f"{folder}/scan_master.h5", f"{folder}/scan_pos.csv",
+                       f"{folder}/scan.nx", poll_interval=0, timeout=10)
+    with h5py.File(f"{folder}/scan.nx", "r") as f:
+        np.testing.assert_array_equal(
+            f["entry/instrument/detector/data"][:, 0, 0], [1, 1, 2, 2])
+        assert f["entry/sample/positioner_0/raw_value"].shape == (4, )
+
+
+def test_position_cache(tmp_path):
+    """Positions are parsed once and memory-mapped from the cache afterwards."""
+    position_path = f"{tmp_path}/positions_pos.csv"
+    positions = np.random.rand(100, 3)
+    np.savetxt(position_path, positions, delimiter=",")
+
+    first = load_positions(position_path, usecols=(0, 1))
+    np.testing.assert_allclose(first, positions[:, :2])
+    cached = load_positions(position_path, usecols=(0, 1))
+    assert isinstance(cached, np.memmap)
+    np.testing.assert_array_equal(cached, first)
+
+
+def test_identify_by_content(tmp_path):
+    """Inputs are identified by their content, not by their file names."""
+    folder = f"{tmp_path}/identify"
+    write_velociprobe_scan(folder, "scan", [2])
+    with h5py.File(f"{folder}/renamed.h5", "w") as f:
+        f["cxi_version"] = 150
+    assert identify(f"{folder}/scan_master.h5") == "velociprobe"
+    assert identify(f"{folder}/scan_data_000001.h5") is None
+    assert identify(f"{folder}/renamed.h5") == "cxi"
+    assert identify(f"{folder}/scan_pos.csv") is None
+    with pytest.raises(ValueError, match="No loader"):
+        open_loader(f"{folder}/scan_data_000001.h5")
+
+
+@pytest.mark.parametrize("options, converts", [
+    (["--link"], True),
+    (["--jobs", "2"], False),
+    (["--resumable"], False),
+    (["--link", "--narrow-dtype"], False),
+])
+def test_converter_options(tmp_path, options, converts):
+    """toNXconverter rejects the cxi-only options for velociprobe scans."""
+    write_velociprobe_scan(f"{tmp_path}", "scan", [2])
+    result = subprocess.run(
+        [sys.executable, "toNXconverter.py", f"{tmp_path}/scan_master.h5",
+         f"{tmp_path}/scan.nxs", *options],
+        capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert (result.returncode == 0) == converts
+    assert os.path.exists(f"{tmp_path}/scan.nxs") == converts
+    if not converts:
+        assert "ValueError" in result.stderr
+
+
 if __name__ == "__main__":
     unittest.main()
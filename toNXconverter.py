@@ -1,9 +1,18 @@
-import h5py
 import logging
 import sys
 
-from nxptycho.creator import NXCreator
-from nxptycho.loader import CXILoader
+from nxptycho.chunking import add_chunk_profile_argument
+from nxptycho.converter.cxi import cxi2nexus
+from nxptycho.converter.parallel import add_jobs_argument
+from nxptycho.filters import (add_compression_workers_argument,
+                              add_filter_arguments, filters_from_options)
+from nxptycho.loader import identify
+from nxptycho.narrowing import add_narrow_dtype_argument
+from nxptycho.preprocess import add_preprocess_arguments, preprocess_from_options
+from nxptycho.sparse import add_sparse_argument
+from nxptycho.statistics import add_frame_statistics_argument
+from nxptycho.profiling import ProfileReport, add_profile_argument
+from nxptycho.transformations import add_transformations_argument
 
 
 def get_user_parameters():
@@ -44,6 +53,31 @@ def get_user_parameters():
         help="NXcxi_ptycho (output) data file name",
     )
 
+    parser.add_argument(
+        "--link",
+        action="store_true",
+        help="reference frames and translations of the input file through "
+             "virtual datasets instead of copying them",
+    )
+
+    parser.add_argument(
+        "--resumable",
+        action="store_true",
+        help="checkpoint the progress and continue an interrupted conversion "
+             "of the same output file",
+    )
+
+    add_jobs_argument(parser)
+    add_filter_arguments(parser)
+    add_compression_workers_argument(parser)
+    add_profile_argument(parser)
+    add_transformations_argument(parser)
+    add_preprocess_arguments(parser)
+    add_narrow_dtype_argument(parser)
+    add_sparse_argument(parser)
+    add_chunk_profile_argument(parser)
+    add_frame_statistics_argument(parser)
+
     return parser.parse_args()
 
 
@@ -58,48 +92,54 @@ def main():
     logging.basicConfig(level=choices[logLevel])
     logger = logging.getLogger(__name__)
 
-    # TODO: have options to call different loaders based on file suffix
-    loader = CXILoader(input_filename)
-    number_of_entries = len([entry for entry in loader.data_file.keys() if 'entry' in entry])
-    print('Total number of entries in single file is:', number_of_entries)
-    #TODO remove after testing
-    number_of_entries = 1
-    with NXCreator(output_filename) as creator:
-        for n in range(1, number_of_entries+1):
-            data_dict = loader.data_dict(n)
-            entry = creator.create_entry_group(entry_index=n,
-                                               experiment_description="Ptycho experiment",
-                                               title="Ptychography")
-            # Create instrument group(s), create multiple instances if multiple instruments produced the data,
-            # if more than one instrument group is created, add index as arg instrument_index
-            instrument = creator.create_instrument_group(parent=entry,
-                                                         name="COSMIC")
-            # Create beam group(s), create multiple instances if multiple beams produced the data,
-            # if more than one beam group is created, add index as arg beam_index
-            # set the correct instrument as parent
-            beam = creator.create_beam_group(parent=instrument,
-                                             incident_beam_energy=data_dict.get("energy"))
-            detector = creator.create_detector_group(parent=beam,
-                                                     data=data_dict.get("data"),
-                                                     distance=data_dict.get("distance"),
-                                                     x_pixel_size=data_dict.get("x_pixel_size"),
-                                                     y_pixel_size=data_dict.get("y_pixel_size"))
-            transformation = creator.create_transformation_group(h5parent=detector)
-            sample = creator.create_sample_group(entry=entry)
-            # TODO get axis information from some sort of config file
-            # creator.create_axis()
-
-            creator.create_positioner_group(h5parent=sample,
-                                            name='vertical',
-                                            raw_value=data_dict.get("translation")[:,1],
-                                            positioner_index=1)
-            creator.create_positioner_group(h5parent=sample,
-                                            name='horizontal',
-                                            raw_value=data_dict.get("translation")[:,0],
-                                            positioner_index=2)
-
-
+    report = ProfileReport() if options.profile else None
+    preprocess = preprocess_from_options(options)
+    kind = identify(input_filename)
+    if kind == "velociprobe":
+        # the frames of a velociprobe scan are referenced unless copy options
+        # are given, there is a single entry and no checkpointing
+        if options.resumable or options.jobs > 1:
+            raise ValueError("--resumable and --jobs are only available for "
+                             "cxi inputs")
+        if options.link and (preprocess is not None or options.narrow_dtype
+                             or options.sparse is not None
+                             or options.chunk_profile is not None):
+            raise ValueError("Linked frames cannot be preprocessed, narrowed, "
+                             "sparse or rechunked")
+        from nxptycho.converter.velociprobe import velociprobe2nexus, velociprobe_position_path
+        velociprobe2nexus(input_filename,
+                          velociprobe_position_path(input_filename),
+                          output_filename,
+                          filters=filters_from_options(options),
+                          observer=report,
+                          transformations=options.transformations,
+                          preprocess=preprocess,
+                          narrow_dtype=options.narrow_dtype,
+                          sparse_threshold=options.sparse,
+                          compression_workers=options.compression_workers,
+                          chunk_profile=options.chunk_profile,
+                          frame_statistics=options.frame_statistics)
+    elif kind == "cxi":
+        cxi2nexus(input_filename,
+                  output_filename,
+                  jobs=options.jobs,
+                  filters=filters_from_options(options),
+                  link=options.link,
+                  resumable=options.resumable,
+                  report=report,
+                  transformations=options.transformations,
+                  preprocess=preprocess,
+                  narrow_dtype=options.narrow_dtype,
+                  sparse_threshold=options.sparse,
+                  compression_workers=options.compression_workers,
+                  chunk_profile=options.chunk_profile,
+                  frame_statistics=options.frame_statistics)
+    else:
+        raise ValueError(f"Conversion of {input_filename} (format: {kind}) is not supported yet")
     logger.info("Wrote HDF5 file: %s", output_filename)
+    if report is not None:
+        report.write(options.profile)
+        logger.info("Wrote profile report: %s", options.profile)
 
 
 if __name__ == "__main__":